@@ -103,6 +103,24 @@ tools_dictionary = {
     "src.heatmaps_bliss_features.Main:main",
     [],
     []
+),
+"dsb_enrichment": (
+    "dsb-enrich",
+    "src.dsb_enrichment.Main:main",
+    [],
+    []
+),
+"dsb_coverage": (
+    "dsb-coverage",
+    "src.dsb_coverage.Main:main",
+    [],
+    []
+),
+"table_converter": (
+    "table-to-tsv",
+    "src.table_converter.Main:main",
+    [],
+    []
 )
 }
 
@@ -0,0 +1,290 @@
+"""
+Coverage
+===================
+The SparseCoverage class holds a genome-wide point coverage (e.g. the number of DSBs, i.e. read starts,
+at each base) without a per-base array. Each chromosome keeps only the sorted positions with a non-zero
+value and the cumulative value up to each of them, so that memory grows with the number of covered
+positions instead of the chromosome length. The signal of any set of windows is the difference of two
+sorted-array searches, and coverages (e.g. replicates) are merged by merging their positions.
+
+A coverage is serialized as a compressed numpy archive (.npz) holding, per chromosome, the gaps between
+consecutive positions and the value at each position in the smallest integer dtype that fits them.
+
+Authors: Eduardo Gade Gusmao.
+"""
+
+# Python
+from __future__ import print_function
+
+# External
+import numpy as np
+
+# Internal
+from .Signal import BamSignal, smallest_dtype
+
+# Serialization format
+COVERAGE_FORMAT_NAME = "gothe_et_al_coverage"
+COVERAGE_FORMAT_VERSION = 1
+
+class SparseCoverage:
+    """Represents a sparse point coverage: chromosome -> (sorted int32 positions, float64 cumulative value
+    up to and including each position).
+
+    *Keyword arguments:*
+
+        - chrom_sizes_dict -- Dictionary chromosome -> length (default = None).
+    """
+
+    def __init__(self, chrom_sizes_dict=None):
+
+        # Variable initializations
+        self.chrom_sizes_dict = dict(chrom_sizes_dict) if chrom_sizes_dict else dict()
+        self.positions = dict()
+        self.cumulative = dict()
+
+    def chromosomes(self):
+        """Returns the sorted list of chromosomes with a coverage."""
+        return sorted(self.positions.keys())
+
+    def set_counts(self, chrom, positions, values):
+        """Sets the coverage of chrom from unique sorted positions and their (non-zero) values.
+
+        *Keyword arguments:*
+
+            - chrom -- Chromosome name.
+            - positions -- Sorted unique positions.
+            - values -- Value at each position.
+        """
+        self.positions[chrom] = np.asarray(positions, dtype=np.int32)
+        self.cumulative[chrom] = np.cumsum(np.asarray(values, dtype=np.float64))
+
+    def add(self, chrom, positions, values=None):
+        """Adds point values to chrom (each position adds 1, or its value), merging them with the current
+        coverage. Positions outside the chromosome (if its size is known) are ignored.
+
+        *Keyword arguments:*
+
+            - chrom -- Chromosome name.
+            - positions -- Positions (in any order, possibly repeated).
+            - values -- Value of each position (default = None, i.e. 1).
+        """
+        positions = np.asarray(positions, dtype=np.int64)
+        if values is None: values = np.ones(len(positions), dtype=np.float64)
+        else: values = np.asarray(values, dtype=np.float64)
+        keep = positions >= 0
+        if chrom in self.chrom_sizes_dict: keep &= positions < self.chrom_sizes_dict[chrom]
+        positions = positions[keep]
+        values = values[keep]
+        if chrom in self.positions:
+            current_positions, current_values = self.counts(chrom)
+            positions = np.concatenate([current_positions.astype(np.int64), positions])
+            values = np.concatenate([current_values, values])
+        unique_positions, inverse = np.unique(positions, return_inverse=True)
+        unique_values = np.bincount(inverse, weights=values, minlength=len(unique_positions))
+        non_zero = unique_values != 0
+        self.set_counts(chrom, unique_positions[non_zero], unique_values[non_zero])
+
+    def counts(self, chrom):
+        """Returns the positions of chrom with a non-zero value and their values.
+
+        *Keyword arguments:*
+
+            - chrom -- Chromosome name.
+        """
+        if chrom not in self.positions: return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float64)
+        cumulative = self.cumulative[chrom]
+        return self.positions[chrom], np.diff(np.concatenate([np.zeros(1), cumulative]))
+
+    def cumulative_at(self, chrom, positions):
+        """Returns the total value of chrom before each position.
+
+        *Keyword arguments:*
+
+            - chrom -- Chromosome name.
+            - positions -- Int array of positions.
+        """
+        positions = np.asarray(positions, dtype=np.int64)
+        if chrom not in self.positions: return np.zeros(positions.shape, dtype=np.float64)
+        index = np.searchsorted(self.positions[chrom], positions, side="left")
+        return np.concatenate([np.zeros(1), self.cumulative[chrom]])[index]
+
+    def window_sums(self, chrom, starts, ends):
+        """Returns the total value of chrom in each window [start, end).
+
+        *Keyword arguments:*
+
+            - chrom -- Chromosome name.
+            - starts -- Window starts.
+            - ends -- Window ends.
+        """
+        return self.cumulative_at(chrom, ends) - self.cumulative_at(chrom, starts)
+
+    def binned(self, chrom, edges_list):
+        """Sums the values of chrom in the bins delimited by each row of the edge matrices in edges_list.
+        Returns a list with one float64 matrix (rows x bins) per edge matrix.
+
+        *Keyword arguments:*
+
+            - chrom -- Chromosome name.
+            - edges_list -- List of int matrices (rows x (bins + 1)) of ascending bin edges.
+        """
+        return [np.diff(self.cumulative_at(chrom, edges), axis=1) for edges in edges_list]
+
+    def bin_totals(self, chrom, bin_size):
+        """Returns the index and total value of the non-empty bins of bin_size bp of chrom.
+
+        *Keyword arguments:*
+
+            - chrom -- Chromosome name.
+            - bin_size -- Bin size (bp).
+        """
+        positions, values = self.counts(chrom)
+        bin_index, inverse = np.unique(positions.astype(np.int64) // bin_size, return_inverse=True)
+        return bin_index, np.bincount(inverse, weights=values, minlength=len(bin_index))
+
+    def slice(self, chrom, start, end):
+        """Returns a new SparseCoverage with the values of chrom in [start, end) (same coordinates).
+
+        *Keyword arguments:*
+
+            - chrom -- Chromosome name.
+            - start -- Region start.
+            - end -- Region end.
+        """
+        coverage = SparseCoverage(self.chrom_sizes_dict)
+        positions, values = self.counts(chrom)
+        lower = np.searchsorted(positions, start, side="left")
+        upper = np.searchsorted(positions, end, side="left")
+        coverage.set_counts(chrom, positions[lower:upper], values[lower:upper])
+        return coverage
+
+    def merge(self, other):
+        """Adds the coverage of other (e.g. a replicate) to this coverage. Returns self.
+
+        *Keyword arguments:*
+
+            - other -- SparseCoverage.
+        """
+        for chrom, size in other.chrom_sizes_dict.items(): self.chrom_sizes_dict.setdefault(chrom, size)
+        for chrom in other.chromosomes():
+            positions, values = other.counts(chrom)
+            if chrom in self.positions: self.add(chrom, positions, values)
+            else: self.set_counts(chrom, positions, values)
+        return self
+
+    def scale(self, factor):
+        """Multiplies all values by factor (e.g. 1 / reads per million). Returns self.
+
+        *Keyword arguments:*
+
+            - factor -- Scaling factor.
+        """
+        for chrom in self.chromosomes(): self.cumulative[chrom] = self.cumulative[chrom] * factor
+        return self
+
+    def total(self, chrom=None):
+        """Returns the total value of chrom, or of all chromosomes.
+
+        *Keyword arguments:*
+
+            - chrom -- Chromosome name (default = None).
+        """
+        if chrom is not None:
+            if chrom not in self.cumulative or len(self.cumulative[chrom]) == 0: return 0.0
+            return float(self.cumulative[chrom][-1])
+        return sum([self.total(e) for e in self.chromosomes()])
+
+    def nbytes(self):
+        """Returns the memory (bytes) held by the positions and cumulative values."""
+        return sum([self.positions[e].nbytes + self.cumulative[e].nbytes for e in self.chromosomes()])
+
+    def write(self, file_name):
+        """Writes the coverage as a compressed numpy archive (see the module documentation).
+
+        *Keyword arguments:*
+
+            - file_name -- Output file name (.npz).
+        """
+        arrays = dict()
+        chrom_list = self.chromosomes()
+        arrays["format"] = np.array([COVERAGE_FORMAT_NAME, str(COVERAGE_FORMAT_VERSION)])
+        arrays["chroms"] = np.array(chrom_list if chrom_list else [""])
+        arrays["sizes"] = np.array([self.chrom_sizes_dict.get(e, -1) for e in chrom_list], dtype=np.int64)
+        for k, chrom in enumerate(chrom_list):
+            positions, values = self.counts(chrom)
+            gaps = np.diff(np.concatenate([np.zeros(1, dtype=np.int64), positions.astype(np.int64)]))
+            arrays["gaps"+str(k)] = gaps.astype(smallest_dtype(gaps))
+            arrays["values"+str(k)] = values.astype(smallest_dtype(values))
+        output_file = open(file_name, "wb")
+        np.savez_compressed(output_file, **arrays)
+        output_file.close()
+
+def read_coverage(file_name):
+    """Reads a SparseCoverage written by SparseCoverage.write.
+
+    *Keyword arguments:*
+
+        - file_name -- Coverage file name (.npz).
+    """
+    archive = np.load(file_name)
+    if str(archive["format"][0]) != COVERAGE_FORMAT_NAME:
+        raise ValueError("Not a sparse coverage: "+file_name)
+    sizes = archive["sizes"]
+    chrom_list = [str(e) for e in archive["chroms"]] if len(sizes) > 0 else []
+    coverage = SparseCoverage(dict([(chrom, int(size)) for chrom, size in zip(chrom_list, sizes) if size >= 0]))
+    for k, chrom in enumerate(chrom_list):
+        coverage.set_counts(chrom, np.cumsum(archive["gaps"+str(k)].astype(np.int64)), archive["values"+str(k)])
+    archive.close()
+    return coverage
+
+def dsb_coverage(file_name, chrom_sizes_dict, chrom_list=None, max_starts=1000000):
+    """Returns the SparseCoverage of the DSBs of a BAM file (read starts) or a BED file (region starts).
+    BED files follow the DSB format of processDsbFile: the chromosome name may lack the "chr" prefix
+    (it is then added) and an integer fourth column is the number of DSBs at the position; lines
+    without it count one DSB. Track, browser and comment lines are skipped; other lines must have a
+    chromosome and integer start and end positions (a ValueError is raised otherwise).
+
+    *Keyword arguments:*
+
+        - file_name -- BAM or BED file name.
+        - chrom_sizes_dict -- Dictionary chromosome -> length.
+        - chrom_list -- Chromosomes to read (default = None, i.e. all chromosomes of chrom_sizes_dict).
+        - max_starts -- Number of BED starts of a chromosome held before they are merged (default = 1000000).
+    """
+    if chrom_list is None: chrom_list = sorted(chrom_sizes_dict.keys())
+    coverage = SparseCoverage(dict([(chrom, chrom_sizes_dict[chrom]) for chrom in chrom_list]))
+    if file_name.split(".")[-1].lower() == "bam":
+        bam_file = BamSignal(file_name, strategy="sweep", verbose=False)
+        for chrom in chrom_list:
+            try:
+                starts = bam_file.starts(chrom, 0, chrom_sizes_dict[chrom])
+            except Exception:
+                continue
+            coverage.add(chrom, starts)
+        bam_file.close()
+    else:
+        # The starts (and their counts) are merged into the coverage every max_starts lines of a chromosome
+        chrom_set = set(chrom_list)
+        start_dict = dict()
+        count_dict = dict()
+        bed_file = open(file_name, "rU")
+        for line_number, line in enumerate(bed_file):
+            ll = line.strip().split("\t")
+            if not ll[0] or ll[0].startswith(("#", "track", "browser")): continue
+            try:
+                start = int(ll[1])
+                int(ll[2])
+            except (IndexError, ValueError):
+                bed_file.close()
+                raise ValueError("The DSB bed file must have the columns chromosome, start, end and (optionally) "
+                                 "the number of DSBs: "+file_name+", line "+str(line_number + 1))
+            chrom = ll[0] if ll[0].startswith("chr") else "chr"+ll[0]
+            if chrom not in chrom_set: continue
+            try: count = int(ll[3])
+            except (IndexError, ValueError): count = 1
+            start_dict.setdefault(chrom, []).append(start)
+            count_dict.setdefault(chrom, []).append(count)
+            if len(start_dict[chrom]) >= max_starts: coverage.add(chrom, start_dict.pop(chrom), count_dict.pop(chrom))
+        bed_file.close()
+        for chrom in sorted(start_dict.keys()): coverage.add(chrom, start_dict[chrom], count_dict[chrom])
+    return coverage
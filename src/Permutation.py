@@ -0,0 +1,290 @@
+"""
+Permutation
+===================
+The Permutation functions build an empirical null distribution of the number of DSBs falling inside
+feature windows. Either the DSB positions or the feature windows are shuffled uniformly within their
+own chromosome (outside optional exclusion regions) and the window counts of each class of features
+are recomputed for thousands of permutations at once with sorted-array searches. The permutations are
+split in chunks with their own random seeds and run in a process pool, so the result does not depend
+on the number of threads.
+
+Authors: Eduardo Gade Gusmao.
+"""
+
+# Python
+from __future__ import print_function
+import multiprocessing
+
+# External
+import numpy as np
+
+# Shuffling modes and default parameters
+MODES = ["dsb", "features"]
+DEFAULT_PERMUTATIONS = 1000
+DEFAULT_CHUNK_SIZE = 100
+MAX_BATCH_ELEMENTS = 4000000
+
+# Chromosome data of the permutation workers (set once per worker by init_permutation_worker)
+permutation_data = None
+
+def merge_intervals(starts, ends):
+    """Returns the sorted and merged (starts, ends) arrays of a list of half-open intervals.
+
+    *Keyword arguments:*
+
+        - starts -- Interval starts.
+        - ends -- Interval ends.
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    if len(starts) == 0: return starts, ends
+    order = np.argsort(starts, kind="mergesort")
+    starts = starts[order]
+    ends = np.maximum.accumulate(ends[order])
+    # A new interval begins wherever the start is beyond all previous ends
+    new = np.ones(len(starts), dtype=bool)
+    new[1:] = starts[1:] > ends[:-1]
+    first = np.flatnonzero(new)
+    last = np.append(first[1:] - 1, len(starts) - 1)
+    return starts[first], ends[last]
+
+def allowed_intervals(chrom_size, excluded=None):
+    """Returns the (starts, ends) arrays of the parts of [0, chrom_size) outside the excluded intervals.
+
+    *Keyword arguments:*
+
+        - chrom_size -- Chromosome length.
+        - excluded -- Tuple (starts, ends) of merged excluded intervals (default = None).
+    """
+    if excluded is None or len(excluded[0]) == 0:
+        return np.array([0], dtype=np.int64), np.array([chrom_size], dtype=np.int64)
+    ex_starts = np.clip(excluded[0], 0, chrom_size)
+    ex_ends = np.clip(excluded[1], 0, chrom_size)
+    starts = np.append(0, ex_ends)
+    ends = np.append(ex_starts, chrom_size)
+    keep = ends > starts
+    return starts[keep], ends[keep]
+
+def inside(positions, starts, ends):
+    """Returns a boolean array telling which positions fall inside the merged intervals (starts, ends).
+
+    *Keyword arguments:*
+
+        - positions -- Array of positions.
+        - starts -- Merged interval starts.
+        - ends -- Merged interval ends.
+    """
+    index = np.searchsorted(starts, positions, side="right") - 1
+    return (index >= 0) & (positions < ends[np.maximum(index, 0)])
+
+def sample_positions(random_state, shape, starts, ends):
+    """Returns an array of the given shape of positions drawn uniformly from the intervals (starts, ends).
+
+    *Keyword arguments:*
+
+        - random_state -- Numpy RandomState.
+        - shape -- Shape of the result.
+        - starts -- Interval starts.
+        - ends -- Interval ends.
+    """
+    offsets = np.append(0, np.cumsum(ends - starts))
+    draws = (random_state.random_sample(shape) * offsets[-1]).astype(np.int64)
+    index = np.searchsorted(offsets, draws, side="right") - 1
+    return starts[index] + (draws - offsets[index])
+
+def window_counts(positions, window_starts, window_ends):
+    """Returns the number of sorted positions inside each window [start, end).
+
+    *Keyword arguments:*
+
+        - positions -- Sorted array of positions.
+        - window_starts -- Array of window starts.
+        - window_ends -- Array of window ends.
+    """
+    return np.searchsorted(positions, window_ends, side="left") - np.searchsorted(positions, window_starts, side="left")
+
+def shuffled_dsb_counts(random_state, n_permutations, data):
+    """Returns the total window count of each class (classes x permutations) after shuffling the DSBs
+    of one chromosome. The window edges split the chromosome in segments; the shuffled DSBs of a batch
+    of permutations are counted per segment with a single bincount and the window counts are then
+    differences of the cumulative segment counts, so the DSBs never need to be sorted.
+
+    *Keyword arguments:*
+
+        - random_state -- Numpy RandomState.
+        - n_permutations -- Number of permutations.
+        - data -- Chromosome data dictionary (see chromosome_data).
+    """
+    size = data["size"]
+    n_dsb = len(data["dsb"])
+    result = np.zeros((len(data["windows"]), n_permutations), dtype=np.int64)
+    edge_list = [np.clip(np.concatenate(window), 0, size) for window in data["windows"]]
+    edges = np.unique(np.concatenate(edge_list)) if edge_list else np.zeros(0, dtype=np.int64)
+    n_segments = len(edges) + 1
+    batch = max(MAX_BATCH_ELEMENTS // max(n_dsb, 1), 1)
+    for first in range(0, n_permutations, batch):
+        n_rows = min(batch, n_permutations - first)
+        positions = sample_positions(random_state, (n_rows, n_dsb), data["allowed"][0], data["allowed"][1])
+        segments = np.searchsorted(edges, positions, side="right")
+        segments += (np.arange(n_rows, dtype=np.int64) * n_segments)[:, np.newaxis]
+        # cumulative[r, j] is the number of DSBs of permutation r before edges[j]
+        cumulative = np.bincount(segments.ravel(), minlength=n_rows * n_segments).reshape(n_rows, n_segments).cumsum(axis=1)
+        for k, (starts, ends) in enumerate(data["windows"]):
+            if len(starts) == 0: continue
+            start_index = np.searchsorted(edges, np.clip(starts, 0, size))
+            end_index = np.searchsorted(edges, np.clip(ends, 0, size))
+            result[k, first:first + n_rows] = (cumulative[:, end_index] - cumulative[:, start_index]).sum(axis=1)
+    return result
+
+def shuffled_feature_counts(random_state, n_permutations, data):
+    """Returns the total window count of each class (classes x permutations) after shuffling the
+    feature windows of one chromosome. Each window keeps its width and is centered at a random
+    position outside the excluded regions.
+
+    *Keyword arguments:*
+
+        - random_state -- Numpy RandomState.
+        - n_permutations -- Number of permutations.
+        - data -- Chromosome data dictionary (see chromosome_data).
+    """
+    result = np.zeros((len(data["windows"]), n_permutations), dtype=np.int64)
+    for k, (starts, ends) in enumerate(data["windows"]):
+        if len(starts) == 0: continue
+        widths = ends - starts
+        batch = max(MAX_BATCH_ELEMENTS // len(starts), 1)
+        for first in range(0, n_permutations, batch):
+            n_rows = min(batch, n_permutations - first)
+            centers = sample_positions(random_state, (n_rows, len(starts)), data["allowed"][0], data["allowed"][1])
+            new_starts = centers - widths // 2
+            counts = window_counts(data["dsb"], new_starts, new_starts + widths)
+            result[k, first:first + n_rows] = counts.sum(axis=1)
+    return result
+
+def chromosome_data(chrom_size, dsb_positions, window_list, excluded=None):
+    """Returns the data dictionary of one chromosome used by the permutations. DSBs inside the
+    excluded regions and windows centered inside them are removed.
+
+    *Keyword arguments:*
+
+        - chrom_size -- Chromosome length.
+        - dsb_positions -- Array of DSB positions.
+        - window_list -- List with one tuple (starts, ends) of window arrays per feature class.
+        - excluded -- Tuple (starts, ends) of merged excluded intervals (default = None).
+    """
+    allowed = allowed_intervals(chrom_size, excluded)
+    dsb = np.sort(np.asarray(dsb_positions, dtype=np.int64))
+    dsb = dsb[inside(dsb, allowed[0], allowed[1])]
+    windows = []
+    for starts, ends in window_list:
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        keep = inside((starts + ends) // 2, allowed[0], allowed[1])
+        windows.append((starts[keep], ends[keep]))
+    return {"size": chrom_size, "dsb": dsb, "windows": windows, "allowed": allowed}
+
+def init_permutation_worker(data_dict, mode):
+    """Stores the chromosome data in a permutation worker process.
+
+    *Keyword arguments:*
+
+        - data_dict -- Dictionary chromosome -> chromosome data (see chromosome_data).
+        - mode -- One of MODES.
+    """
+    global permutation_data
+    permutation_data = (data_dict, mode)
+
+def permutation_chunk(chunk):
+    """Computes the window counts of a chunk of permutations of one chromosome. Returns the chunk
+    index together with the counts (classes x permutations).
+
+    *Keyword arguments:*
+
+        - chunk -- Tuple (chunk index, chromosome, number of permutations, random seed).
+    """
+    index, chrom, n_permutations, chunk_seed = chunk
+    data_dict, mode = permutation_data
+    random_state = np.random.RandomState(chunk_seed)
+    if mode == "dsb": return index, shuffled_dsb_counts(random_state, n_permutations, data_dict[chrom])
+    else: return index, shuffled_feature_counts(random_state, n_permutations, data_dict[chrom])
+
+def observed_counts(data_dict, n_classes):
+    """Returns the total window count of each class in the original data.
+
+    *Keyword arguments:*
+
+        - data_dict -- Dictionary chromosome -> chromosome data (see chromosome_data).
+        - n_classes -- Number of feature classes.
+    """
+    result = np.zeros(n_classes, dtype=np.int64)
+    for data in data_dict.values():
+        for k, (starts, ends) in enumerate(data["windows"]):
+            result[k] += window_counts(data["dsb"], starts, ends).sum()
+    return result
+
+def permute(data_dict, n_classes, mode="dsb", n_permutations=DEFAULT_PERMUTATIONS, seed=111, threads=1,
+            chunk_size=DEFAULT_CHUNK_SIZE):
+    """Returns the total window count of each class in each permutation (classes x permutations).
+    Each chunk of permutations of each chromosome has its own random seed derived from seed, so the
+    result does not depend on the number of threads.
+
+    *Keyword arguments:*
+
+        - data_dict -- Dictionary chromosome -> chromosome data (see chromosome_data).
+        - n_classes -- Number of feature classes.
+        - mode -- 'dsb' (shuffle the DSBs) or 'features' (shuffle the feature windows) (default = 'dsb').
+        - n_permutations -- Number of permutations (default = DEFAULT_PERMUTATIONS).
+        - seed -- Random seed (default = 111).
+        - threads -- Number of worker processes (default = 1).
+        - chunk_size -- Number of permutations per chunk (default = DEFAULT_CHUNK_SIZE).
+    """
+    if mode not in MODES: raise ValueError("The permutation mode must be one of: "+", ".join(MODES))
+    result = np.zeros((n_classes, n_permutations), dtype=np.int64)
+    chrom_list = sorted(data_dict.keys())
+    n_chunks = int(np.ceil(n_permutations / float(chunk_size)))
+    if n_chunks == 0 or not chrom_list: return result
+    chunk_seeds = np.random.RandomState(seed).randint(0, 2**31 - 1, (n_chunks, len(chrom_list)))
+
+    # Largest chromosomes first, so that the workers stay balanced
+    weight = lambda chrom: len(data_dict[chrom]["dsb"]) + sum([len(e[0]) for e in data_dict[chrom]["windows"]])
+    chunk_list = [(i, chrom, min(chunk_size, n_permutations - i * chunk_size), int(chunk_seeds[i, j]))
+                  for j, chrom in sorted(enumerate(chrom_list), key=lambda e: weight(e[1]), reverse=True)
+                  for i in range(0, n_chunks)]
+    if threads <= 1:
+        init_permutation_worker(data_dict, mode)
+        for chunk in chunk_list:
+            index, counts = permutation_chunk(chunk)
+            result[:, index * chunk_size:index * chunk_size + counts.shape[1]] += counts
+    else:
+        pool = multiprocessing.Pool(min(threads, len(chunk_list)), init_permutation_worker, (data_dict, mode))
+        try:
+            for index, counts in pool.imap_unordered(permutation_chunk, chunk_list):
+                result[:, index * chunk_size:index * chunk_size + counts.shape[1]] += counts
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+    return result
+
+def enrichment_summary(observed, null):
+    """Returns the rows [observed, expected, standard deviation, z-score, fold enrichment, enrichment
+    p-value, depletion p-value] of each class. The empirical p-values count the observed value as one
+    of the permutations.
+
+    *Keyword arguments:*
+
+        - observed -- Observed count of each class.
+        - null -- Permutation counts (classes x permutations).
+    """
+    row_list = []
+    n_permutations = null.shape[1]
+    for k in range(0, len(observed)):
+        expected = null[k].mean() if n_permutations > 0 else np.nan
+        sd = null[k].std(ddof=1) if n_permutations > 1 else np.nan
+        z_score = (observed[k] - expected) / sd if sd > 0 else np.nan
+        fold = observed[k] / expected if expected > 0 else np.nan
+        p_enrichment = (1.0 + (null[k] >= observed[k]).sum()) / (n_permutations + 1.0)
+        p_depletion = (1.0 + (null[k] <= observed[k]).sum()) / (n_permutations + 1.0)
+        row_list.append([int(observed[k]), expected, sd, z_score, fold, p_enrichment, p_depletion])
+    return row_list
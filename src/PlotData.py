@@ -0,0 +1,210 @@
+"""
+PlotData
+===================
+The PlotData functions reduce the point clouds of the scatter plots to inputs whose size does not
+depend on the number of points: a regular 2D density grid (count and, optionally, median of a third
+value in each cell), the median profile of y along the x bins, and a point subsample stratified by
+grid cell, so that dense regions of the plot are thinned more than sparse ones.
+
+The correlations shown in the plot titles are computed here on all the points.
+
+Authors: Eduardo Gade Gusmao.
+"""
+
+# Python
+from __future__ import print_function
+import os
+
+# External
+import numpy as np
+from scipy.stats import rankdata
+
+# Default grid and subsample sizes
+DEFAULT_BINS = 100
+DEFAULT_MAX_POINTS = 5000
+
+def grid_edges(values, n_bins=DEFAULT_BINS, limits=None):
+    """Returns n_bins + 1 regular bin edges covering limits (or the finite range of values).
+
+    *Keyword arguments:*
+
+        - values -- Array of values.
+        - n_bins -- Number of bins (default = DEFAULT_BINS).
+        - limits -- Tuple (lower, upper) (default = None, i.e. the finite range of values).
+    """
+    if limits is None:
+        finite = values[np.isfinite(values)]
+        if len(finite) == 0: limits = (0.0, 1.0)
+        else: limits = (finite.min(), finite.max())
+    lower, upper = float(limits[0]), float(limits[1])
+    if upper <= lower: upper = lower + 1.0
+    return np.linspace(lower, upper, n_bins + 1)
+
+def grid_cells(x, y, x_edges, y_edges):
+    """Returns the flat grid cell of each point (-1 for points outside the grid or with missing values).
+
+    *Keyword arguments:*
+
+        - x -- Array of x values.
+        - y -- Array of y values.
+        - x_edges -- Bin edges of x.
+        - y_edges -- Bin edges of y.
+    """
+    n_x = len(x_edges) - 1
+    n_y = len(y_edges) - 1
+    with np.errstate(invalid="ignore"):
+        i = np.searchsorted(x_edges, x, side="right") - 1
+        j = np.searchsorted(y_edges, y, side="right") - 1
+        # The upper edges are included in the last bins
+        i[x == x_edges[-1]] = n_x - 1
+        j[y == y_edges[-1]] = n_y - 1
+        valid = (i >= 0) & (i < n_x) & (j >= 0) & (j < n_y) & np.isfinite(x) & np.isfinite(y)
+    return np.where(valid, i * n_y + j, -1)
+
+def grouped_medians(groups, values, n_groups):
+    """Returns the count and the median of values in each group (NaN for empty groups).
+
+    *Keyword arguments:*
+
+        - groups -- Array with the group (0 to n_groups - 1) of each value.
+        - values -- Array of values.
+        - n_groups -- Number of groups.
+    """
+    order = np.lexsort((values, groups))
+    sorted_values = values[order]
+    counts = np.bincount(groups, minlength=n_groups)
+    first = np.cumsum(counts) - counts
+    medians = np.ones(n_groups) * np.nan
+    full = counts > 0
+    lower = sorted_values[first[full] + (counts[full] - 1) // 2]
+    upper = sorted_values[first[full] + counts[full] // 2]
+    medians[full] = (lower + upper) / 2.0
+    return counts, medians
+
+def stratified_sample(cells, max_points=DEFAULT_MAX_POINTS, seed=111):
+    """Returns the sorted indices of a subsample of about max_points points with a valid cell. The
+    share of each cell is proportional to the square root of its count (rounded at random), so dense
+    cells are thinned more than sparse ones.
+
+    *Keyword arguments:*
+
+        - cells -- Array with the grid cell of each point (-1 to ignore the point).
+        - max_points -- Expected number of points kept (default = DEFAULT_MAX_POINTS).
+        - seed -- Random seed (default = 111).
+    """
+    index = np.flatnonzero(cells >= 0)
+    if len(index) <= max_points: return index
+    cells = cells[index]
+    random_state = np.random.RandomState(seed)
+    keys = random_state.random_sample(len(index))
+    order = np.lexsort((keys, cells))
+    counts = np.bincount(cells)
+    first = np.cumsum(counts) - counts
+    share = max_points * np.sqrt(counts) / np.sqrt(counts).sum()
+    quota = np.minimum(np.floor(share + random_state.random_sample(len(counts))), counts)
+    rank = np.arange(len(order)) - first[cells[order]]
+    return np.sort(index[order[rank < quota[cells[order]]]])
+
+def spearman(x, y):
+    """Returns the Spearman correlation of the pairs without NaN values (ties get average ranks).
+
+    *Keyword arguments:*
+
+        - x -- Array of x values.
+        - y -- Array of y values.
+    """
+    valid = ~(np.isnan(x) | np.isnan(y))
+    if valid.sum() < 2: return np.nan
+    rank_x = rankdata(x[valid])
+    rank_y = rankdata(y[valid])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.corrcoef(rank_x, rank_y)[0, 1]
+
+def adjusted_r_squared(z, x, y):
+    """Returns the adjusted R squared of the linear regression z ~ x + y over the finite triples.
+
+    *Keyword arguments:*
+
+        - z -- Array of response values.
+        - x -- Array of x values.
+        - y -- Array of y values.
+    """
+    valid = np.isfinite(x) & np.isfinite(y) & np.isfinite(z)
+    n = valid.sum()
+    if n < 4: return np.nan
+    design = np.column_stack([np.ones(n), x[valid], y[valid]])
+    coefficients = np.linalg.lstsq(design, z[valid], rcond=-1)[0]
+    residuals = z[valid] - np.dot(design, coefficients)
+    total = ((z[valid] - z[valid].mean()) ** 2).sum()
+    if total <= 0: return np.nan
+    return 1.0 - ((residuals ** 2).sum() / total) * (n - 1) / float(n - 3)
+
+def write_rows(file_name, header, row_list):
+    """Writes a tab-separated table ("NA" for missing values).
+
+    *Keyword arguments:*
+
+        - file_name -- Output file name.
+        - header -- List of column names.
+        - row_list -- List of rows.
+    """
+    output_file = open(file_name, "w")
+    output_file.write("\t".join(header)+"\n")
+    for row in row_list:
+        output_file.write("\t".join([("NA" if isinstance(e, float) and e != e else str(e)) for e in row])+"\n")
+    output_file.close()
+
+def write_plot_data(prefix, x, y, values=None, x_limits=None, y_limits=None, n_bins=DEFAULT_BINS,
+                    max_points=DEFAULT_MAX_POINTS, seed=111):
+    """Writes the plot inputs of the points (x, y):
+
+        - <prefix>_grid.txt -- Non-empty cells: X, Y (cell centers), COUNT and, with values, MEDIAN.
+        - <prefix>_median.txt -- Non-empty x bins: X (bin center), COUNT and MEDIAN of y.
+        - <prefix>_points.txt -- Stratified subsample: X, Y and, with values, VALUE.
+
+    *Keyword arguments:*
+
+        - prefix -- Output file prefix.
+        - x -- Array of x values.
+        - y -- Array of y values.
+        - values -- Array of a third value summarized per cell (default = None).
+        - x_limits -- Tuple (lower, upper) of the grid in x (default = None, i.e. the range of x).
+        - y_limits -- Tuple (lower, upper) of the grid in y (default = None, i.e. the range of y).
+        - n_bins -- Number of bins in each axis (default = DEFAULT_BINS).
+        - max_points -- Expected number of points of the subsample (default = DEFAULT_MAX_POINTS).
+        - seed -- Random seed of the subsample (default = 111).
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    x_edges = grid_edges(x, n_bins, x_limits)
+    y_edges = grid_edges(y, n_bins, y_limits)
+    x_centers = (x_edges[:-1] + x_edges[1:]) / 2.0
+    y_centers = (y_edges[:-1] + y_edges[1:]) / 2.0
+    cells = grid_cells(x, y, x_edges, y_edges)
+    valid = cells >= 0
+    location = os.path.dirname(prefix)
+    if location and not os.path.exists(location): os.makedirs(location)
+
+    # Density grid
+    if values is None:
+        counts = np.bincount(cells[valid], minlength=n_bins * n_bins)
+        header = ["X", "Y", "COUNT"]
+        row_list = [[x_centers[c // n_bins], y_centers[c % n_bins], int(counts[c])] for c in np.flatnonzero(counts)]
+    else:
+        values = np.asarray(values, dtype=np.float64)
+        with_value = valid & ~np.isnan(values)
+        counts = np.bincount(cells[valid], minlength=n_bins * n_bins)
+        medians = grouped_medians(cells[with_value], values[with_value], n_bins * n_bins)[1]
+        header = ["X", "Y", "COUNT", "MEDIAN"]
+        row_list = [[x_centers[c // n_bins], y_centers[c % n_bins], int(counts[c]), medians[c]] for c in np.flatnonzero(counts)]
+    write_rows(prefix + "_grid.txt", header, row_list)
+
+    # Median profile of y along x
+    bin_counts, bin_medians = grouped_medians(cells[valid] // n_bins, y[valid], n_bins)
+    write_rows(prefix + "_median.txt", ["X", "COUNT", "MEDIAN"],
+               [[x_centers[i], int(bin_counts[i]), bin_medians[i]] for i in np.flatnonzero(bin_counts)])
+
+    # Stratified subsample
+    index = stratified_sample(cells, max_points, seed)
+    if values is None: write_rows(prefix + "_points.txt", ["X", "Y"], zip(x[index], y[index]))
+    else: write_rows(prefix + "_points.txt", ["X", "Y", "VALUE"], zip(x[index], y[index], values[index]))
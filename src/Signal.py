@@ -0,0 +1,853 @@
+"""
+Signal
+===================
+The Signal classes provide cached access to BAM and BigWig signal files. Reads (or BigWig values) are
+decoded once per fixed-size chromosome chunk and kept in a memory-bounded LRU cache, so that overlapping
+and adjacent window queries reuse the decoded data instead of decoding the same blocks again.
+
+BAM queries can also be answered by a direct fetch per region or by a single sweep of the whole
+chromosome. When the regions of a chromosome are known in advance (see BamSignal.plan), the strategy
+with the lowest estimated cost is chosen from the number of regions, their total span and the number
+of mapped reads in the BAM index.
+
+A PyramidSignal answers the same queries from a multi-resolution pyramid built once from a BAM or BigWig
+file (see build_pyramid): the signal summed in cells of each resolution (e.g. 10 bp, 100 bp, 1 kb and
+10 kb), in the smallest dtype that holds them, plus the cumulative signal of the coarsest cells, all
+memory-mapped from disk. The signal before a bin edge is the cumulative value of the coarsest cells
+before it plus, at each finer level, the (at most resolution ratio - 1) cells up to the edge, so edges
+that fall on coarse cells read no fine cells and a wide window costs a few values per bin instead of
+decoding all of its reads.
+
+Authors: Eduardo Gade Gusmao.
+"""
+
+# Python
+from __future__ import print_function
+import os
+import json
+from collections import OrderedDict
+
+# External
+import numpy as np
+import pyBigWig
+
+# Internal
+from .Util import samfile_pool
+
+# Default chunk size (bp) and cache size (bytes)
+DEFAULT_CHUNK_SIZE = 65536
+DEFAULT_CACHE_BYTES = 256 * 1024 * 1024
+
+# Query strategies and their relative costs: one index seek (with its block decompression) and one
+# decoded read
+STRATEGIES = ["fetch", "chunk", "sweep"]
+SEEK_COST = 2000.0
+READ_COST = 1.0
+
+# Default pyramid resolutions (bp) and pyramid format
+DEFAULT_PYRAMID_LEVELS = [10, 100, 1000, 10000]
+PYRAMID_FORMAT_NAME = "gothe_et_al_pyramid"
+PYRAMID_FORMAT_VERSION = 2
+
+def smallest_dtype(values):
+    """Returns the smallest unsigned integer dtype holding values, or float64 if they are not all
+    non-negative integers.
+
+    *Keyword arguments:*
+
+        - values -- Numeric array.
+    """
+    if len(values) == 0: return np.dtype(np.uint8)
+    if values.min() < 0 or not np.all(np.floor(values) == values): return np.dtype(np.float64)
+    for dtype in [np.uint8, np.uint16, np.uint32, np.uint64]:
+        if values.max() <= np.iinfo(dtype).max: return np.dtype(dtype)
+    return np.dtype(np.float64)
+
+class ChunkCache:
+    """A memory-bounded least-recently-used cache of decoded chunks.
+
+    *Keyword arguments:*
+
+        - max_bytes -- Maximum number of bytes held by the cache (default = DEFAULT_CACHE_BYTES).
+    """
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+
+        # Variable initializations
+        self.max_bytes = max_bytes
+        self.chunks = OrderedDict()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Returns the chunk stored under key (marking it as recently used) or None.
+
+        *Keyword arguments:*
+
+            - key -- Chunk key.
+        """
+        try:
+            value = self.chunks.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+        self.chunks[key] = value
+        self.hits += 1
+        return value[0]
+
+    def put(self, key, chunk, nbytes):
+        """Stores a chunk, evicting the least recently used chunks until the cache fits in max_bytes.
+
+        *Keyword arguments:*
+
+            - key -- Chunk key.
+            - chunk -- Decoded chunk.
+            - nbytes -- Size of the decoded chunk in bytes.
+        """
+        if key in self.chunks:
+            self.current_bytes -= self.chunks.pop(key)[1]
+        self.chunks[key] = (chunk, nbytes)
+        self.current_bytes += nbytes
+        while self.current_bytes > self.max_bytes and len(self.chunks) > 1:
+            old_key, old_value = self.chunks.popitem(last=False)
+            self.current_bytes -= old_value[1]
+            self.evictions += 1
+
+    def clear(self):
+        """Removes all chunks from the cache (statistics are kept)."""
+        self.chunks.clear()
+        self.current_bytes = 0
+
+    def hit_rate(self):
+        """Returns the fraction of lookups answered from the cache."""
+        total = self.hits + self.misses
+        if total == 0: return 0.0
+        return float(self.hits) / total
+
+    def stats(self):
+        """Returns a one-line summary of the cache statistics."""
+        return ("hits = "+str(self.hits)+", misses = "+str(self.misses)+", evictions = "+str(self.evictions)+
+                ", hit rate = "+str(round(100.0 * self.hit_rate(), 2))+"%, memory = "+
+                str(round(self.current_bytes / (1024.0 * 1024.0), 2))+" MB")
+
+class BamSignal:
+    """Represents a cached BAM signal. Each chunk keeps the start and end positions of all reads that
+    overlap it, so that any query returns exactly the reads pysam's fetch would return.
+
+    *Keyword arguments:*
+
+        - file_name -- BAM file name.
+        - chunk_size -- Size, in bp, of each decoded chunk (default = DEFAULT_CHUNK_SIZE).
+        - cache -- A ChunkCache to store the chunks (default = a new ChunkCache).
+        - pool -- The SamfilePool providing the BAM handles (default = Util.samfile_pool).
+        - threads -- Number of htslib decompression threads of the handles (default = None, i.e. the pool's).
+        - strategy -- Query strategy: "auto", "fetch", "chunk" or "sweep" (default = "auto"). With "auto"
+                      the chromosomes given to plan use the cheapest strategy and the others use "chunk".
+        - verbose -- Whether to print the strategy chosen for each chromosome (default = False).
+    """
+
+    # Bins hold read counts (not per-base values)
+    per_base = False
+
+    def __init__(self, file_name, chunk_size=DEFAULT_CHUNK_SIZE, cache=None, pool=None, threads=None,
+                 strategy="auto", verbose=False):
+
+        # Variable initializations
+        self.file_name = file_name
+        self.chunk_size = chunk_size
+        if cache is None: cache = ChunkCache()
+        self.cache = cache
+        if pool is None: pool = samfile_pool
+        self.pool = pool
+        self.threads = threads
+        if strategy != "auto" and strategy not in STRATEGIES:
+            raise ValueError("Unknown query strategy: "+str(strategy))
+        self.strategy = strategy
+        self.verbose = verbose
+        self.chrom_strategy = dict()
+        self.index_stats = None
+        self.sweep_chrom = None
+        self.sweep_reads = None
+        self.pool.get(file_name, threads=threads)
+
+    def chromosomes(self):
+        """Returns the list of chromosomes of the BAM header."""
+        return list(self.pool.get(self.file_name, threads=self.threads).references)
+
+    def get_index_statistics(self):
+        """Returns a dictionary chromosome -> [mapped reads, chromosome length] read from the BAM index."""
+        if self.index_stats is None:
+            bam_file = self.pool.get(self.file_name, threads=self.threads)
+            lengths = dict(zip(bam_file.references, bam_file.lengths))
+            self.index_stats = dict()
+            try:
+                for stats in bam_file.get_index_statistics():
+                    self.index_stats[stats.contig] = [stats.mapped, lengths[stats.contig]]
+            except Exception:
+                self.index_stats = dict()
+        return self.index_stats
+
+    def estimate_costs(self, chrom, region_list):
+        """Returns a dictionary strategy -> estimated cost of answering all regions of chrom, or None if the
+        BAM index has no statistics for chrom.
+
+        *Keyword arguments:*
+
+            - chrom -- Chromosome name.
+            - region_list -- List of [start, end] regions of chrom.
+        """
+        try:
+            mapped, length = self.get_index_statistics()[chrom]
+        except KeyError:
+            return None
+        density = float(mapped) / max(length, 1)
+        span = 0
+        chunk_set = set()
+        for start, end in region_list:
+            start = max(int(start), 0)
+            end = int(end)
+            if end <= start: continue
+            span += end - start
+            chunk_set.update(range(start // self.chunk_size, (end - 1) // self.chunk_size + 1))
+        cost_dict = dict()
+        cost_dict["fetch"] = len(region_list) * SEEK_COST + density * span * READ_COST
+        cost_dict["chunk"] = len(chunk_set) * (SEEK_COST + density * self.chunk_size * READ_COST)
+        cost_dict["sweep"] = SEEK_COST + mapped * READ_COST
+        return cost_dict
+
+    def plan(self, region_list):
+        """Chooses the query strategy of each chromosome present in region_list. Has no effect unless the
+        strategy is "auto".
+
+        *Keyword arguments:*
+
+            - region_list -- List of [chrom, start, end] regions that will be queried.
+        """
+        if self.strategy != "auto": return
+        chrom_dict = dict()
+        for region in region_list: chrom_dict.setdefault(region[0], []).append([region[1], region[2]])
+        for chrom in sorted(chrom_dict.keys()):
+            cost_dict = self.estimate_costs(chrom, chrom_dict[chrom])
+            if cost_dict is None: strategy = "chunk"
+            else: strategy = min(STRATEGIES, key=lambda e: cost_dict[e])
+            self.chrom_strategy[chrom] = strategy
+            if self.verbose:
+                message = "Query strategy: "+self.file_name+" "+chrom+" -> "+strategy+" (regions = "+str(len(chrom_dict[chrom]))
+                if cost_dict is not None:
+                    message += ", "+", ".join([e+" = "+str(int(cost_dict[e])) for e in STRATEGIES])
+                print(message+")")
+
+    def get_strategy(self, chrom):
+        """Returns the query strategy used for chrom.
+
+        *Keyword arguments:*
+
+            - chrom -- Chromosome name.
+        """
+        if self.strategy != "auto": return self.strategy
+        return self.chrom_strategy.get(chrom, "chunk")
+
+    def fetch_reads(self, chrom, start, end):
+        """Returns the start and end arrays of all reads overlapping [start, end) with a direct fetch.
+
+        *Keyword arguments:*
+
+            - chrom -- Chromosome name.
+            - start -- Region start.
+            - end -- Region end.
+        """
+        starts = []
+        ends = []
+        for read in self.pool.get(self.file_name, threads=self.threads).fetch(chrom, start, end):
+            starts.append(read.reference_start)
+            ends.append(read.reference_end if read.reference_end is not None else read.reference_start + 1)
+        return np.array(starts, dtype=np.int64), np.array(ends, dtype=np.int64)
+
+    def get_sweep(self, chrom):
+        """Returns the sorted start and end arrays of all reads of chrom and the longest read length. Only the
+        last swept chromosome is kept in memory.
+
+        *Keyword arguments:*
+
+            - chrom -- Chromosome name.
+        """
+        if self.sweep_chrom != chrom:
+            self.sweep_reads = None
+            starts, ends = self.fetch_reads(chrom, 0, self.get_index_statistics()[chrom][1])
+            order = np.argsort(starts, kind="mergesort")
+            starts = starts[order]
+            ends = ends[order]
+            if len(starts) > 0: max_length = int((ends - starts).max())
+            else: max_length = 0
+            self.sweep_chrom = chrom
+            self.sweep_reads = (starts, ends, max_length)
+        return self.sweep_reads
+
+    def sweep_query(self, chrom, start, end):
+        """Returns the start and end arrays of all reads overlapping [start, end) from the chromosome sweep.
+
+        *Keyword arguments:*
+
+            - chrom -- Chromosome name.
+            - start -- Region start.
+            - end -- Region end.
+        """
+        starts, ends, max_length = self.get_sweep(chrom)
+        lower = np.searchsorted(starts, start - max_length, side="left")
+        upper = np.searchsorted(starts, end, side="left")
+        keep = ends[lower:upper] > start
+        return starts[lower:upper][keep], ends[lower:upper][keep]
+
+    def decode_chunk(self, chrom, index):
+        """Decodes the chunk number index of chrom into sorted start and end position arrays.
+
+        *Keyword arguments:*
+
+            - chrom -- Chromosome name.
+            - index -- Chunk index.
+        """
+        starts = []
+        ends = []
+        chunk_start = index * self.chunk_size
+        for read in self.pool.get(self.file_name, threads=self.threads).fetch(chrom, chunk_start, chunk_start + self.chunk_size):
+            starts.append(read.reference_start)
+            ends.append(read.reference_end if read.reference_end is not None else read.reference_start + 1)
+        starts = np.array(starts, dtype=np.int64)
+        ends = np.array(ends, dtype=np.int64)
+        order = np.argsort(starts, kind="mergesort")
+        return starts[order], ends[order]
+
+    def get_chunk(self, chrom, index):
+        """Returns the chunk number index of chrom, decoding it only if it is not cached.
+
+        *Keyword arguments:*
+
+            - chrom -- Chromosome name.
+            - index -- Chunk index.
+        """
+        key = (self.file_name, chrom, index)
+        chunk = self.cache.get(key)
+        if chunk is None:
+            chunk = self.decode_chunk(chrom, index)
+            self.cache.put(key, chunk, chunk[0].nbytes + chunk[1].nbytes)
+        return chunk
+
+    def reads(self, chrom, start, end):
+        """Returns the start and end arrays of all reads overlapping [start, end).
+
+        *Keyword arguments:*
+
+            - chrom -- Chromosome name.
+            - start -- Region start.
+            - end -- Region end.
+        """
+        start = max(int(start), 0)
+        end = int(end)
+        if end <= start: return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        strategy = self.get_strategy(chrom)
+        if strategy == "fetch": return self.fetch_reads(chrom, start, end)
+        elif strategy == "sweep" and chrom in self.get_index_statistics(): return self.sweep_query(chrom, start, end)
+        first = start // self.chunk_size
+        last = (end - 1) // self.chunk_size
+        starts_list = []
+        ends_list = []
+        for index in range(first, last + 1):
+            starts, ends = self.get_chunk(chrom, index)
+            chunk_end = (index + 1) * self.chunk_size
+            # Reads starting before the first chunk are only taken from it (they are repeated in later chunks)
+            if index == first: lower = 0
+            else: lower = np.searchsorted(starts, index * self.chunk_size, side="left")
+            upper = np.searchsorted(starts, min(end, chunk_end), side="left")
+            sel_starts = starts[lower:upper]
+            sel_ends = ends[lower:upper]
+            if index == first:
+                keep = sel_ends > start
+                sel_starts = sel_starts[keep]
+                sel_ends = sel_ends[keep]
+            starts_list.append(sel_starts)
+            ends_list.append(sel_ends)
+        return np.concatenate(starts_list), np.concatenate(ends_list)
+
+    def starts(self, chrom, start, end):
+        """Returns the start positions of all reads overlapping [start, end).
+
+        *Keyword arguments:*
+
+            - chrom -- Chromosome name.
+            - start -- Region start.
+            - end -- Region end.
+        """
+        return self.reads(chrom, start, end)[0]
+
+    def count(self, chrom, start, end):
+        """Returns the number of reads overlapping [start, end).
+
+        *Keyword arguments:*
+
+            - chrom -- Chromosome name.
+            - start -- Region start.
+            - end -- Region end.
+        """
+        return len(self.reads(chrom, start, end)[0])
+
+    def binned(self, chrom, edges_list):
+        """Counts the reads of chrom in the bins delimited by each row of the edge matrices in edges_list.
+        Each read is assigned to the bin containing its start; reads that start before the first edge of a row
+        but overlap it are counted in its first bin, and the last bin ends at the last edge. All matrices are
+        answered from a single query spanning their edges. Returns a list with one int64 count matrix (rows x
+        bins) per edge matrix.
+
+        *Keyword arguments:*
+
+            - chrom -- Chromosome name.
+            - edges_list -- List of int matrices (rows x (bins + 1)) of ascending bin edges.
+        """
+        edges_list = [np.asarray(e, dtype=np.int64) for e in edges_list]
+        non_empty = [e for e in edges_list if e.size > 0]
+        if not non_empty: return [np.zeros((e.shape[0], max(e.shape[1] - 1, 0)), dtype=np.int64) for e in edges_list]
+        starts, ends = self.reads(chrom, min([int(e.min()) for e in non_empty]), max([int(e.max()) for e in non_empty]))
+        ends = np.sort(ends)
+        counts_list = []
+        for edges in edges_list:
+            # Reads starting before each edge; the first edge only discounts the reads ending before it
+            cumulative = np.searchsorted(starts, edges, side="left")
+            if edges.size > 0: cumulative[:, 0] = np.searchsorted(ends, edges[:, 0], side="right")
+            counts_list.append(np.diff(cumulative, axis=1))
+        return counts_list
+
+    def close(self):
+        """Closes the pooled BAM handles and removes the chunks of this file from the cache."""
+        self.pool.close(self.file_name)
+        self.sweep_chrom = None
+        self.sweep_reads = None
+        for key in [k for k in self.cache.chunks.keys() if k[0] == self.file_name]:
+            self.cache.current_bytes -= self.cache.chunks.pop(key)[1]
+
+class BigWigSignal:
+    """Represents a cached BigWig signal. Each chunk keeps the per-base values (missing, NaN and
+    infinite values are stored as 0).
+
+    *Keyword arguments:*
+
+        - file_name -- BigWig file name.
+        - chunk_size -- Size, in bp, of each decoded chunk (default = DEFAULT_CHUNK_SIZE).
+        - cache -- A ChunkCache to store the chunks (default = a new ChunkCache).
+    """
+
+    # Bins hold sums of per-base values
+    per_base = True
+
+    def __init__(self, file_name, chunk_size=DEFAULT_CHUNK_SIZE, cache=None):
+
+        # Variable initializations
+        self.file_name = file_name
+        self.chunk_size = chunk_size
+        if cache is None: cache = ChunkCache()
+        self.cache = cache
+        self.bw_file = pyBigWig.open(file_name)
+        self.chrom_sizes = self.bw_file.chroms()
+
+    def chromosomes(self):
+        """Returns the list of chromosomes of the BigWig header."""
+        return list(self.chrom_sizes.keys())
+
+    def plan(self, region_list):
+        """Kept for compatibility with BamSignal. BigWig files are always read through the chunk cache.
+
+        *Keyword arguments:*
+
+            - region_list -- List of [chrom, start, end] regions that will be queried.
+        """
+        pass
+
+    def decode_chunk(self, chrom, index):
+        """Decodes the chunk number index of chrom into a float32 array of values.
+
+        *Keyword arguments:*
+
+            - chrom -- Chromosome name.
+            - index -- Chunk index.
+        """
+        values = np.zeros(self.chunk_size, dtype=np.float32)
+        chunk_start = index * self.chunk_size
+        chunk_end = min(chunk_start + self.chunk_size, self.chrom_sizes[chrom])
+        if chunk_end > chunk_start:
+            fetched = np.array(self.bw_file.values(chrom, chunk_start, chunk_end), dtype=np.float32)
+            fetched[~np.isfinite(fetched)] = 0.0
+            values[:chunk_end - chunk_start] = fetched
+        return values
+
+    def get_chunk(self, chrom, index):
+        """Returns the chunk number index of chrom, decoding it only if it is not cached.
+
+        *Keyword arguments:*
+
+            - chrom -- Chromosome name.
+            - index -- Chunk index.
+        """
+        key = (self.file_name, chrom, index)
+        chunk = self.cache.get(key)
+        if chunk is None:
+            chunk = self.decode_chunk(chrom, index)
+            self.cache.put(key, chunk, chunk.nbytes)
+        return chunk
+
+    def values(self, chrom, start, end):
+        """Returns the per-base values of [start, end) as a float64 array.
+
+        *Keyword arguments:*
+
+            - chrom -- Chromosome name.
+            - start -- Region start.
+            - end -- Region end.
+        """
+        start = max(int(start), 0)
+        end = int(end)
+        if end <= start: return np.zeros(0, dtype=np.float64)
+        first = start // self.chunk_size
+        last = (end - 1) // self.chunk_size
+        values_list = []
+        for index in range(first, last + 1):
+            chunk = self.get_chunk(chrom, index)
+            offset = index * self.chunk_size
+            values_list.append(chunk[max(start - offset, 0):min(end - offset, self.chunk_size)])
+        return np.concatenate(values_list).astype(np.float64)
+
+    def total(self, chrom, start, end):
+        """Returns the sum of the values in [start, end).
+
+        *Keyword arguments:*
+
+            - chrom -- Chromosome name.
+            - start -- Region start.
+            - end -- Region end.
+        """
+        return float(self.values(chrom, start, end).sum())
+
+    def binned(self, chrom, edges_list):
+        """Sums the values of chrom in the bins delimited by each row of the edge matrices in edges_list. All
+        matrices are answered from a single query spanning their edges. Returns a list with one float64 sum
+        matrix (rows x bins) per edge matrix.
+
+        *Keyword arguments:*
+
+            - chrom -- Chromosome name.
+            - edges_list -- List of int matrices (rows x (bins + 1)) of ascending bin edges.
+        """
+        edges_list = [np.asarray(e, dtype=np.int64) for e in edges_list]
+        non_empty = [e for e in edges_list if e.size > 0]
+        if not non_empty: return [np.zeros((e.shape[0], max(e.shape[1] - 1, 0)), dtype=np.float64) for e in edges_list]
+        lower = max(min([int(e.min()) for e in non_empty]), 0)
+        upper = max([int(e.max()) for e in non_empty])
+        prefix = np.concatenate([np.zeros(1), np.cumsum(self.values(chrom, lower, upper))])
+        sums_list = []
+        for edges in edges_list:
+            sums_list.append(np.diff(prefix[np.clip(edges - lower, 0, len(prefix) - 1)], axis=1))
+        return sums_list
+
+    def close(self):
+        """Closes the BigWig file and removes its chunks from the cache."""
+        self.bw_file.close()
+        for key in [k for k in self.cache.chunks.keys() if k[0] == self.file_name]:
+            self.cache.current_bytes -= self.cache.chunks.pop(key)[1]
+
+def pyramid_file_names(file_name):
+    """Returns the data and metadata file names of the pyramid file_name.
+
+    *Keyword arguments:*
+
+        - file_name -- Pyramid file name (<name>.pyr, the metadata; the data is <name>.pyr.bin).
+    """
+    if file_name.endswith(".pyr.bin"): file_name = file_name[:-len(".bin")]
+    elif not file_name.endswith(".pyr"): file_name = file_name + ".pyr"
+    return file_name + ".bin", file_name
+
+def pyramid_cells(signal, chrom, chrom_size, resolution, window=10485760):
+    """Returns the signal of chrom summed in cells of resolution bp (the last cell ends at the chromosome
+    end): the number of reads starting in each cell for a BamSignal, the sum of the values for a
+    BigWigSignal.
+
+    *Keyword arguments:*
+
+        - signal -- BamSignal or BigWigSignal.
+        - chrom -- Chromosome name.
+        - chrom_size -- Chromosome length.
+        - resolution -- Cell size (bp).
+        - window -- Size (bp) of the BigWig windows read at a time (default = 10485760).
+    """
+    n_cells = (chrom_size + resolution - 1) // resolution
+    if isinstance(signal, BamSignal):
+        try:
+            starts = signal.starts(chrom, 0, chrom_size)
+        except Exception:
+            starts = np.zeros(0, dtype=np.int64)
+        starts = starts[(starts >= 0) & (starts < chrom_size)]
+        return np.bincount(starts // resolution, minlength=n_cells).astype(np.float64)
+    cells = np.zeros(n_cells, dtype=np.float64)
+    window = max(window // resolution, 1) * resolution
+    for start in range(0, chrom_size, window):
+        end = min(start + window, chrom_size)
+        try:
+            values = signal.values(chrom, start, end)
+        except Exception:
+            continue
+        values = np.concatenate([values, np.zeros((-len(values)) % resolution)])
+        cells[start // resolution:start // resolution + len(values) // resolution] = values.reshape(-1, resolution).sum(axis=1)
+    return cells
+
+def write_pyramid(file_name, chrom_sizes_dict, cell_iterator, level_list=None, kind="counts", source=None):
+    """Writes a pyramid from the finest level cells of each chromosome. The coarser levels are aggregated
+    from the finest one and each level is stored as its cell sums, read counts in the smallest unsigned
+    integer dtype that holds them and sums of values as float32. The coarsest level is also stored as
+    the float64 cumulative sum of its cells (with a leading 0).
+
+    *Keyword arguments:*
+
+        - file_name -- Pyramid file name (see pyramid_file_names).
+        - chrom_sizes_dict -- Dictionary chromosome -> length.
+        - cell_iterator -- Iterable of (chromosome, cells of level_list[0] bp) pairs.
+        - level_list -- Ascending resolutions (bp), each one a multiple of the previous (default = DEFAULT_PYRAMID_LEVELS).
+        - kind -- "counts" (read counts) or "values" (sums of per-base values) (default = "counts").
+        - source -- BAM or BigWig file the cells were computed from, used for exact queries (default = None).
+    """
+    if level_list is None: level_list = DEFAULT_PYRAMID_LEVELS
+    level_list = [int(e) for e in level_list]
+    if not level_list or level_list[0] < 1 or any([b % a != 0 or b <= a for a, b in zip(level_list[:-1], level_list[1:])]):
+        raise ValueError("The pyramid levels must be ascending and each one a multiple of the previous: "+str(level_list))
+    data_file_name, metadata_file_name = pyramid_file_names(file_name)
+    data_file = open(data_file_name, "wb")
+    chrom_dict = dict()
+    def write_array(array):
+        # Arrays start at multiples of 8 bytes; returns the array description
+        data_file.write(b"\0" * ((-data_file.tell()) % 8))
+        array_dict = {"offset": data_file.tell(), "dtype": array.dtype.str, "length": len(array)}
+        array.tofile(data_file)
+        return array_dict
+    for chrom, cells in cell_iterator:
+        cells = np.asarray(cells, dtype=np.float64)
+        array_list = []
+        for resolution in level_list:
+            factor = resolution // level_list[0]
+            if factor > 1: level_cells = np.add.reduceat(cells, np.arange(0, len(cells), factor)) if len(cells) else cells
+            else: level_cells = cells
+            dtype = np.dtype(np.float32) if kind == "values" else smallest_dtype(level_cells)
+            array_list.append(write_array(level_cells.astype(dtype)))
+        cumulative = write_array(np.concatenate([np.zeros(1), np.cumsum(level_cells)]))
+        chrom_dict[chrom] = {"size": int(chrom_sizes_dict[chrom]), "levels": array_list, "cumulative": cumulative}
+    data_file.close()
+    metadata = dict()
+    metadata["format"] = PYRAMID_FORMAT_NAME
+    metadata["version"] = PYRAMID_FORMAT_VERSION
+    metadata["levels"] = level_list
+    metadata["kind"] = kind
+    metadata["source"] = os.path.abspath(source) if source else None
+    metadata["chroms"] = chrom_dict
+    metadata["data_file"] = os.path.basename(data_file_name)
+    metadata_file = open(metadata_file_name, "w")
+    json.dump(metadata, metadata_file, indent=2, sort_keys=True)
+    metadata_file.close()
+
+def build_pyramid(signal_file_name, file_name, chrom_sizes_dict, level_list=None):
+    """Builds the pyramid of a BAM (read starts) or BigWig (values) file, reading each chromosome once.
+
+    *Keyword arguments:*
+
+        - signal_file_name -- BAM or BigWig file name.
+        - file_name -- Pyramid file name (see pyramid_file_names).
+        - chrom_sizes_dict -- Dictionary chromosome -> length of the chromosomes to include.
+        - level_list -- Ascending resolutions (bp), each one a multiple of the previous (default = DEFAULT_PYRAMID_LEVELS).
+    """
+    if level_list is None: level_list = DEFAULT_PYRAMID_LEVELS
+    signal = open_signal(signal_file_name)
+    if isinstance(signal, BamSignal): signal.strategy = "sweep"
+    chrom_list = sorted(chrom_sizes_dict.keys())
+    cell_iterator = ((chrom, pyramid_cells(signal, chrom, chrom_sizes_dict[chrom], int(level_list[0]))) for chrom in chrom_list)
+    write_pyramid(file_name, chrom_sizes_dict, cell_iterator, level_list=level_list,
+                  kind="values" if signal.per_base else "counts", source=signal_file_name)
+    signal.close()
+
+class PyramidSignal:
+    """Represents a multi-resolution pyramid (see build_pyramid). Queries return the same bins as the
+    BamSignal (read starts, without the reads that start before the first edge) or BigWigSignal of the
+    source file. Edges that are not a multiple of the finest resolution are rounded to the nearest one,
+    unless exact is set: the signal between the rounded-down edge and the edge is then read from the
+    source file, which must be available (a ValueError is raised otherwise).
+
+    *Keyword arguments:*
+
+        - file_name -- Pyramid file name (see pyramid_file_names).
+        - exact -- Whether unaligned edges are completed from the source file instead of rounded (default = False).
+        - cache -- A ChunkCache for the source file (default = a new ChunkCache).
+    """
+
+    def __init__(self, file_name, exact=False, cache=None):
+
+        # Variable initializations
+        data_file_name, metadata_file_name = pyramid_file_names(file_name)
+        metadata_file = open(metadata_file_name, "r")
+        self.metadata = json.load(metadata_file)
+        metadata_file.close()
+        if self.metadata.get("format") != PYRAMID_FORMAT_NAME:
+            raise ValueError("Not a signal pyramid: "+metadata_file_name)
+        if self.metadata.get("version") != PYRAMID_FORMAT_VERSION:
+            raise ValueError("The pyramid was written by another version and must be built again: "+metadata_file_name)
+        self.file_name = file_name
+        self.data_file_name = os.path.join(os.path.dirname(metadata_file_name), self.metadata["data_file"])
+        self.levels = np.array(self.metadata["levels"], dtype=np.int64)
+        self.chroms = self.metadata["chroms"]
+        self.per_base = self.metadata["kind"] == "values"
+        self.exact = exact
+        if exact and not (self.metadata["source"] and os.path.exists(self.metadata["source"])):
+            raise ValueError("Exact queries need the source file of the pyramid, which is not available: "+metadata_file_name)
+        if cache is None: cache = ChunkCache()
+        self.cache = cache
+        self.source = None
+        self.arrays = dict()
+
+    def array(self, chrom, level=None):
+        """Returns the memory-mapped cells of a level of chrom, or its coarsest level cumulative sum.
+
+        *Keyword arguments:*
+
+            - chrom -- Chromosome name.
+            - level -- Level index (default = None, i.e. the cumulative sum).
+        """
+        key = (chrom, level)
+        if key not in self.arrays:
+            array_dict = self.chroms[chrom]["cumulative"] if level is None else self.chroms[chrom]["levels"][level]
+            if array_dict["length"] == 0: self.arrays[key] = np.zeros(0, dtype=np.dtype(str(array_dict["dtype"])))
+            else: self.arrays[key] = np.memmap(self.data_file_name, dtype=np.dtype(str(array_dict["dtype"])), mode="r",
+                                               offset=array_dict["offset"], shape=(array_dict["length"],))
+        return self.arrays[key]
+
+    def chromosomes(self):
+        """Returns the list of chromosomes of the pyramid."""
+        return list(self.chroms.keys())
+
+    def plan(self, region_list):
+        """Passes the regions to the source file of exact queries.
+
+        *Keyword arguments:*
+
+            - region_list -- List of [chrom, start, end] regions that will be queried.
+        """
+        if self.exact and self.get_source() is not None: self.source.plan(region_list)
+
+    def get_source(self):
+        """Returns the source file signal (opened on first use) or None if it is not available."""
+        if self.source is None and self.metadata["source"] and os.path.exists(self.metadata["source"]):
+            self.source = open_signal(self.metadata["source"], cache=self.cache)
+        return self.source
+
+    def partial(self, chrom, lower, upper):
+        """Returns the source file signal between each lower and upper position (lower <= upper).
+
+        *Keyword arguments:*
+
+            - chrom -- Chromosome name.
+            - lower -- Array of start positions.
+            - upper -- Array of end positions.
+        """
+        source = self.get_source()
+        if source is None or len(lower) == 0: return np.zeros(len(lower))
+        first = int(lower.min())
+        last = int(upper.max())
+        if isinstance(source, BamSignal):
+            starts = np.sort(source.starts(chrom, first, last))
+            return (np.searchsorted(starts, upper, side="left") - np.searchsorted(starts, lower, side="left")).astype(np.float64)
+        prefix = np.concatenate([np.zeros(1), np.cumsum(source.values(chrom, first, last))])
+        return prefix[upper - first] - prefix[lower - first]
+
+    def cumulative(self, chrom, positions):
+        """Returns the signal of chrom before each position (from the chromosome start): the cumulative
+        value of the coarsest cells before it plus, from the coarsest to the finest level, the cells
+        between the last multiple of the next coarser resolution and the position.
+
+        *Keyword arguments:*
+
+            - chrom -- Chromosome name.
+            - positions -- Int array of positions.
+        """
+        size = self.chroms[chrom]["size"]
+        shape = np.shape(positions)
+        positions = np.clip(np.asarray(positions, dtype=np.int64).ravel(), 0, size)
+        finest = int(self.levels[0])
+        aligned = (positions + finest // 2) // finest * finest
+        if self.exact: aligned = positions // finest * finest
+        aligned = np.minimum(aligned, size)
+        cumulative = self.array(chrom)
+        result = cumulative[aligned // self.levels[-1]].astype(np.float64)
+        for k in range(len(self.levels) - 2, -1, -1):
+            cells = self.array(chrom, k)
+            factor = int(self.levels[k + 1] // self.levels[k])
+            first = aligned // self.levels[k + 1] * factor
+            last = aligned // self.levels[k]
+            for j in range(0, factor - 1):
+                selected = np.flatnonzero(first + j < last)
+                if len(selected) == 0: break
+                result[selected] += cells[first[selected] + j]
+        # The chromosome end (possibly inside the last finest cell) is the total signal
+        if len(cumulative) > 0: result[aligned == size] = cumulative[-1]
+        if self.exact:
+            unaligned = aligned != positions
+            result[unaligned] += self.partial(chrom, aligned[unaligned], positions[unaligned])
+        return result.reshape(shape)
+
+    def binned(self, chrom, edges_list):
+        """Sums the signal of chrom in the bins delimited by each row of the edge matrices in edges_list.
+        Returns a list with one float64 matrix (rows x bins) per edge matrix.
+
+        *Keyword arguments:*
+
+            - chrom -- Chromosome name.
+            - edges_list -- List of int matrices (rows x (bins + 1)) of ascending bin edges.
+        """
+        edges_list = [np.asarray(e, dtype=np.int64) for e in edges_list]
+        if chrom not in self.chroms: return [np.zeros((e.shape[0], max(e.shape[1] - 1, 0)), dtype=np.float64) for e in edges_list]
+        return [np.diff(self.cumulative(chrom, edges), axis=1) for edges in edges_list]
+
+    def count(self, chrom, start, end):
+        """Returns the signal (number of reads or sum of values) in [start, end).
+
+        *Keyword arguments:*
+
+            - chrom -- Chromosome name.
+            - start -- Region start.
+            - end -- Region end.
+        """
+        return float(self.binned(chrom, [[[start, end]]])[0][0, 0])
+
+    def total(self, chrom, start, end):
+        """Returns the signal in [start, end) (see count).
+
+        *Keyword arguments:*
+
+            - chrom -- Chromosome name.
+            - start -- Region start.
+            - end -- Region end.
+        """
+        return self.count(chrom, start, end)
+
+    def close(self):
+        """Releases the memory maps and closes the source file."""
+        self.arrays = dict()
+        if self.source is not None: self.source.close()
+        self.source = None
+
+def open_signal(file_name, chunk_size=DEFAULT_CHUNK_SIZE, cache=None, verbose=False):
+    """Returns a BamSignal, BigWigSignal or PyramidSignal according to the file extension.
+
+    *Keyword arguments:*
+
+        - file_name -- BAM, BigWig or pyramid (.pyr) file name.
+        - chunk_size -- Size, in bp, of each decoded chunk (default = DEFAULT_CHUNK_SIZE).
+        - cache -- A ChunkCache to store the chunks (default = a new ChunkCache).
+        - verbose -- Whether a BAM file prints the query strategy of each chromosome (default = False).
+    """
+    extension = file_name.split(".")[-1].lower()
+    if extension == "bam": return BamSignal(file_name, chunk_size=chunk_size, cache=cache, verbose=verbose)
+    elif extension == "bw" or extension == "bigwig": return BigWigSignal(file_name, chunk_size=chunk_size, cache=cache)
+    elif extension == "pyr": return PyramidSignal(file_name, cache=cache)
+    else: raise ValueError("The signal file must be a BAM, a BIGWIG or a pyramid (.pyr) file: "+file_name)
@@ -0,0 +1,273 @@
+"""
+Statistics
+===================
+The Statistics functions compute Pearson, Spearman and partial correlations between the numeric
+columns of the result tables, with percentile bootstrap confidence intervals computed in parallel
+chunks, and write them as a compact summary table. Tables streamed in blocks keep a bounded uniform
+sample of their rows (RowReservoir), so the statistics of very large tables are computed on at most
+max_rows rows.
+
+Authors: Eduardo Gade Gusmao.
+"""
+
+# Python
+from __future__ import print_function
+import multiprocessing
+
+# External
+import numpy as np
+from scipy.stats import rankdata, t as t_distribution
+
+# Correlation methods and default bootstrap parameters
+METHODS = ["pearson", "spearman", "partial"]
+DEFAULT_BOOTSTRAP = 1000
+DEFAULT_CHUNK_SIZE = 100
+DEFAULT_CONFIDENCE = 0.95
+DEFAULT_MAX_ROWS = 200000
+
+# Data matrix of the bootstrap workers (set once per worker by init_bootstrap_worker)
+bootstrap_data = None
+
+class RowReservoir:
+    """Keeps a uniform random sample of at most max_rows of the rows added in blocks (reservoir sampling),
+    so that the memory does not depend on the number of rows.
+
+    *Keyword arguments:*
+
+        - n_columns -- Number of columns.
+        - max_rows -- Maximum number of rows kept (default = DEFAULT_MAX_ROWS).
+        - seed -- Random seed (default = 111).
+    """
+
+    def __init__(self, n_columns, max_rows=DEFAULT_MAX_ROWS, seed=111):
+
+        # Variable initializations
+        self.sample = np.zeros((max_rows, n_columns), dtype=np.float64)
+        self.max_rows = max_rows
+        self.n_rows = 0
+        self.random_state = np.random.RandomState(seed)
+
+    def add(self, block):
+        """Adds the rows of block (rows x columns) to the sample.
+
+        *Keyword arguments:*
+
+            - block -- Matrix (rows x columns).
+        """
+        block = np.asarray(block, dtype=np.float64).reshape(-1, self.sample.shape[1])
+        n_fill = max(min(self.max_rows - self.n_rows, len(block)), 0)
+        self.sample[self.n_rows:self.n_rows + n_fill] = block[:n_fill]
+        # Row t (0-based) replaces a random kept row with probability max_rows / (t + 1); for repeated
+        # slots the last row wins, as in the sequential algorithm
+        row_index = np.arange(self.n_rows + n_fill, self.n_rows + len(block))
+        slots = (self.random_state.random_sample(len(row_index)) * (row_index + 1)).astype(np.int64)
+        replace = slots < self.max_rows
+        self.sample[slots[replace]] = block[n_fill:][replace]
+        self.n_rows += len(block)
+
+    def rows(self):
+        """Returns the sampled rows."""
+        return self.sample[:min(self.n_rows, self.max_rows)]
+
+def complete_rows(data):
+    """Returns the rows of data without NaN values.
+
+    *Keyword arguments:*
+
+        - data -- Matrix (rows x columns).
+    """
+    data = np.asarray(data, dtype=np.float64)
+    return data[~np.isnan(data).any(axis=1)]
+
+def pearson_matrix(data):
+    """Returns the Pearson correlation matrix of the columns of data (NaN for constant columns).
+
+    *Keyword arguments:*
+
+        - data -- Matrix (rows x columns) without NaN values.
+    """
+    centered = data - data.mean(axis=0)
+    norm = np.sqrt((centered * centered).sum(axis=0))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        corr = np.dot(centered.T, centered) / np.outer(norm, norm)
+    return np.clip(corr, -1.0, 1.0)
+
+def spearman_matrix(data):
+    """Returns the Spearman correlation matrix of the columns of data (ties get average ranks).
+
+    *Keyword arguments:*
+
+        - data -- Matrix (rows x columns) without NaN values.
+    """
+    ranks = np.column_stack([rankdata(data[:, j]) for j in range(data.shape[1])]) if data.shape[1] > 0 else data
+    return pearson_matrix(ranks)
+
+def partial_matrix(data):
+    """Returns the partial (Pearson) correlation matrix of the columns of data: the correlation of each
+    pair of columns given all the other (non-constant) columns. Constant columns have no correlation, so
+    they are left out of the inversion and their partial correlations are NaN.
+
+    *Keyword arguments:*
+
+        - data -- Matrix (rows x columns) without NaN values.
+    """
+    pearson = pearson_matrix(data)
+    n_columns = pearson.shape[0]
+    corr = np.ones((n_columns, n_columns)) * np.nan
+    valid = np.flatnonzero(np.isfinite(np.diag(pearson)))
+    if len(valid) == 0: return corr
+    precision = np.linalg.pinv(pearson[np.ix_(valid, valid)])
+    diagonal = np.sqrt(np.abs(np.diag(precision)))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        valid_corr = -precision / np.outer(diagonal, diagonal)
+    np.fill_diagonal(valid_corr, 1.0)
+    corr[np.ix_(valid, valid)] = np.clip(valid_corr, -1.0, 1.0)
+    return corr
+
+def correlation_matrix(data, method):
+    """Returns the correlation matrix of the columns of data with the given method.
+
+    *Keyword arguments:*
+
+        - data -- Matrix (rows x columns) without NaN values.
+        - method -- One of METHODS.
+    """
+    if method == "pearson": return pearson_matrix(data)
+    elif method == "spearman": return spearman_matrix(data)
+    elif method == "partial": return partial_matrix(data)
+    else: raise ValueError("The correlation method must be one of: "+", ".join(METHODS))
+
+def p_values(corr, n_rows, n_controls=0):
+    """Returns the two-sided p-values of a correlation matrix (Student's t approximation).
+
+    *Keyword arguments:*
+
+        - corr -- Correlation matrix.
+        - n_rows -- Number of observations.
+        - n_controls -- Number of variables controlled for (partial correlations) (default = 0).
+    """
+    df = n_rows - 2 - n_controls
+    if df <= 0: return np.ones(corr.shape) * np.nan
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t_value = corr * np.sqrt(df / np.maximum(1.0 - corr * corr, 1e-300))
+    return 2.0 * t_distribution.sf(np.abs(t_value), df)
+
+def init_bootstrap_worker(data):
+    """Stores the data matrix in a bootstrap worker process.
+
+    *Keyword arguments:*
+
+        - data -- Matrix (rows x columns) without NaN values.
+    """
+    global bootstrap_data
+    bootstrap_data = data
+
+def bootstrap_chunk(chunk):
+    """Computes the correlation matrices of n_samples bootstrap resamples of the worker data. Returns an
+    array (methods x samples x columns x columns).
+
+    *Keyword arguments:*
+
+        - chunk -- Tuple (method list, number of resamples, random seed of the chunk).
+    """
+    method_list, n_samples, chunk_seed = chunk
+    random_state = np.random.RandomState(chunk_seed)
+    n_rows, n_columns = bootstrap_data.shape
+    result = np.zeros((len(method_list), n_samples, n_columns, n_columns))
+    for i in range(0, n_samples):
+        sample = bootstrap_data[random_state.randint(0, n_rows, n_rows)]
+        for k, method in enumerate(method_list): result[k, i] = correlation_matrix(sample, method)
+    return result
+
+def bootstrap(data, method_list, n_bootstrap=DEFAULT_BOOTSTRAP, seed=111, threads=1, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Returns the correlation matrices of n_bootstrap resamples of the rows of data for each method
+    (methods x resamples x columns x columns). Each chunk of resamples has its own random seed derived
+    from seed, so the result does not depend on the number of threads.
+
+    *Keyword arguments:*
+
+        - data -- Matrix (rows x columns) without NaN values.
+        - method_list -- List of methods (see METHODS).
+        - n_bootstrap -- Number of resamples (default = DEFAULT_BOOTSTRAP).
+        - seed -- Random seed (default = 111).
+        - threads -- Number of worker processes (default = 1).
+        - chunk_size -- Number of resamples per chunk (default = DEFAULT_CHUNK_SIZE).
+    """
+    chunk_seeds = np.random.RandomState(seed).randint(0, 2**31 - 1, max(int(np.ceil(n_bootstrap / float(chunk_size))), 1))
+    chunk_list = [(method_list, min(chunk_size, n_bootstrap - i * chunk_size), int(chunk_seeds[i]))
+                  for i in range(0, len(chunk_seeds)) if n_bootstrap - i * chunk_size > 0]
+    if not chunk_list: return np.zeros((len(method_list), 0, data.shape[1], data.shape[1]))
+    if threads <= 1:
+        init_bootstrap_worker(data)
+        result_list = [bootstrap_chunk(chunk) for chunk in chunk_list]
+    else:
+        pool = multiprocessing.Pool(min(threads, len(chunk_list)), init_bootstrap_worker, (data,))
+        try:
+            result_list = pool.map(bootstrap_chunk, chunk_list)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+    return np.concatenate(result_list, axis=1)
+
+def correlation_summary(data, names, method_list=METHODS, n_bootstrap=DEFAULT_BOOTSTRAP,
+                        confidence=DEFAULT_CONFIDENCE, seed=111, threads=1):
+    """Returns the summary rows [method, variable 1, variable 2, n, r, p-value, lower, upper] of all
+    pairs of columns of data. Rows with NaN values are removed first.
+
+    *Keyword arguments:*
+
+        - data -- Matrix (rows x columns).
+        - names -- List of column names.
+        - method_list -- List of methods (default = METHODS).
+        - n_bootstrap -- Number of bootstrap resamples; 0 skips the confidence intervals (default = DEFAULT_BOOTSTRAP).
+        - confidence -- Confidence level of the intervals (default = DEFAULT_CONFIDENCE).
+        - seed -- Random seed of the bootstrap (default = 111).
+        - threads -- Number of worker processes of the bootstrap (default = 1).
+    """
+    data = complete_rows(data)
+    n_rows, n_columns = data.shape
+    if n_rows > 1 and n_bootstrap > 0:
+        resamples = bootstrap(data, method_list, n_bootstrap=n_bootstrap, seed=seed, threads=threads)
+        with np.errstate(invalid="ignore"):
+            lower = np.nanpercentile(resamples, 100.0 * (1.0 - confidence) / 2.0, axis=1)
+            upper = np.nanpercentile(resamples, 100.0 * (1.0 + confidence) / 2.0, axis=1)
+    else:
+        lower = upper = np.ones((len(method_list), n_columns, n_columns)) * np.nan
+    row_list = []
+    for k, method in enumerate(method_list):
+        if n_rows > 1: corr = correlation_matrix(data, method)
+        else: corr = np.ones((n_columns, n_columns)) * np.nan
+        if method == "partial": p_value = p_values(corr, n_rows, n_controls=n_columns - 2)
+        else: p_value = p_values(corr, n_rows)
+        for i in range(0, n_columns):
+            for j in range(i + 1, n_columns):
+                row_list.append([method, names[i], names[j], n_rows, corr[i, j], p_value[i, j],
+                                 lower[k, i, j], upper[k, i, j]])
+    return row_list
+
+def write_summary(output_file_name, data, names, method_list=METHODS, n_bootstrap=DEFAULT_BOOTSTRAP,
+                  confidence=DEFAULT_CONFIDENCE, seed=111, threads=1):
+    """Writes the correlation summary of the columns of data as a tab-separated table ("NA" for missing
+    values).
+
+    *Keyword arguments:*
+
+        - output_file_name -- Output file name.
+        - data -- Matrix (rows x columns).
+        - names -- List of column names.
+        - method_list -- List of methods (default = METHODS).
+        - n_bootstrap -- Number of bootstrap resamples (default = DEFAULT_BOOTSTRAP).
+        - confidence -- Confidence level of the intervals (default = DEFAULT_CONFIDENCE).
+        - seed -- Random seed of the bootstrap (default = 111).
+        - threads -- Number of worker processes of the bootstrap (default = 1).
+    """
+    row_list = correlation_summary(data, names, method_list=method_list, n_bootstrap=n_bootstrap,
+                                   confidence=confidence, seed=seed, threads=threads)
+    output_file = open(output_file_name, "w")
+    output_file.write("\t".join(["METHOD", "VARIABLE1", "VARIABLE2", "N", "R", "P_VALUE", "CI_LOWER", "CI_UPPER"])+"\n")
+    for row in row_list:
+        output_file.write("\t".join([("NA" if isinstance(e, float) and e != e else str(e)) for e in row])+"\n")
+    output_file.close()
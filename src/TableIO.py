@@ -0,0 +1,437 @@
+"""
+TableIO
+===================
+The TableIO classes write the result tables of the tools either as tab-separated text or as a binary
+columnar table. A binary table is made of three files sharing the table name (without its extension):
+
+    - <name>.bin -- The numeric columns as a row-major matrix of a fixed dtype (memory-mappable).
+    - <name>.labels.txt -- The leading text columns (e.g. gene names), one tab-separated line per row.
+    - <name>.json -- The metadata sidecar (shape, dtype, header, label and integer columns, chunk size).
+
+Rows are written in chunks of chunk_rows rows. Missing numeric values ("NA") are stored as NaN. Columns
+whose values are all integers are formatted as integers; if a column mixes integers with other numbers
+(e.g. 0 in some rows and 0.25 in others), a fourth file, <name>.mask.bin, keeps one bit per cell
+telling whether it was an integer, so that the tab-separated table is written back unchanged.
+
+An indexed table is a tab-separated table sorted by its coordinate columns, block-compressed with
+bgzip (<name>.gz) and indexed with tabix (<name>.gz.tbi), so that the rows of a region can be read
+without decompressing the whole file. Its header, if any, is written as a '#' line.
+
+Authors: Eduardo Gade Gusmao.
+"""
+
+# Python
+from __future__ import print_function
+import os
+import json
+import numbers
+import subprocess
+
+# External
+import numpy as np
+import pysam
+
+# Output formats and default chunk size (rows)
+OUTPUT_FORMATS = ["tsv", "binary", "indexed"]
+DEFAULT_CHUNK_ROWS = 4096
+FORMAT_NAME = "gothe_et_al_table"
+FORMAT_VERSION = 1
+
+def binary_table_names(file_name):
+    """Returns the matrix, label and metadata file names of the binary table file_name.
+
+    *Keyword arguments:*
+
+        - file_name -- Table file name (the extension, if any, is replaced).
+    """
+    if file_name.endswith(".labels.txt"): base_name = file_name[:-len(".labels.txt")]
+    else: base_name = os.path.splitext(file_name)[0]
+    return base_name + ".bin", base_name + ".labels.txt", base_name + ".json"
+
+class TsvTableWriter:
+    """Writes a table as tab-separated text, formatting every value with str.
+
+    *Keyword arguments:*
+
+        - file_name -- Output file name.
+        - header -- List of column names written as the first line (default = None).
+    """
+
+    def __init__(self, file_name, header=None):
+
+        # Variable initializations
+        self.file_name = file_name
+        self.output_file = open(file_name, "w")
+        if header is not None: self.output_file.write("\t".join(header)+"\n")
+
+    def write(self, row):
+        """Writes one row.
+
+        *Keyword arguments:*
+
+            - row -- List of values.
+        """
+        self.output_file.write("\t".join([str(e) for e in row])+"\n")
+
+    def close(self):
+        """Closes the output file."""
+        self.output_file.close()
+
+class BinaryTableWriter:
+    """Writes a table as a binary columnar table (see the module documentation).
+
+    *Keyword arguments:*
+
+        - file_name -- Output table name.
+        - n_labels -- Number of leading text columns of each row.
+        - header -- List of column names, including the text columns (default = None).
+        - dtype -- Numpy dtype of the numeric matrix (default = 'float64').
+        - chunk_rows -- Number of rows buffered before each write (default = DEFAULT_CHUNK_ROWS).
+    """
+
+    def __init__(self, file_name, n_labels, header=None, dtype="float64", chunk_rows=DEFAULT_CHUNK_ROWS):
+
+        # Variable initializations
+        self.file_name = file_name
+        self.n_labels = n_labels
+        self.header = header
+        self.dtype = np.dtype(dtype)
+        self.chunk_rows = chunk_rows
+        self.matrix_file_name, self.label_file_name, self.metadata_file_name = binary_table_names(file_name)
+        self.matrix_file = open(self.matrix_file_name, "wb")
+        self.label_file = open(self.label_file_name, "w")
+        self.mask_file_name = os.path.splitext(self.matrix_file_name)[0] + ".mask.bin"
+        self.mask_file = open(self.mask_file_name, "wb")
+        self.n_rows = 0
+        self.n_columns = None
+        self.integer_columns = None
+        self.float_columns = None
+        self.buffer = []
+        self.mask_buffer = []
+
+    def write(self, row):
+        """Writes one row. All rows must have the same number of numeric columns.
+
+        *Keyword arguments:*
+
+            - row -- List of values; the first n_labels are text and the others numbers or "NA".
+        """
+        values = row[self.n_labels:]
+        if self.n_columns is None:
+            self.n_columns = len(values)
+            self.integer_columns = set()
+            self.float_columns = set()
+        elif len(values) != self.n_columns:
+            raise ValueError("All rows of a binary table must have "+str(self.n_columns)+" numeric columns.")
+
+        # Integer formatting is kept per column, and per cell (mask) in the columns that mix integers and other numbers
+        integer_mask = [isinstance(e, numbers.Integral) for e in values]
+        for j, value in enumerate(values):
+            if integer_mask[j]: self.integer_columns.add(j)
+            elif isinstance(value, numbers.Number) and value == value: self.float_columns.add(j)
+
+        self.label_file.write("\t".join([str(e) for e in row[:self.n_labels]])+"\n")
+        self.buffer.append([e if isinstance(e, numbers.Number) else np.nan for e in values])
+        self.mask_buffer.append(integer_mask)
+        if len(self.buffer) >= self.chunk_rows: self.flush()
+
+    def flush(self):
+        """Writes the buffered rows to the matrix file."""
+        if self.buffer:
+            np.array(self.buffer, dtype=self.dtype).tofile(self.matrix_file)
+            np.packbits(np.array(self.mask_buffer, dtype=bool).reshape(len(self.buffer), -1), axis=1).tofile(self.mask_file)
+            self.n_rows += len(self.buffer)
+            self.buffer = []
+            self.mask_buffer = []
+
+    def close(self):
+        """Writes the remaining rows and the metadata sidecar and closes the files. The cell mask is only
+        kept if a column mixes integers and other numbers."""
+        self.flush()
+        self.matrix_file.close()
+        self.label_file.close()
+        self.mask_file.close()
+        if self.n_columns is None: self.integer_columns = self.float_columns = set()
+        integer_columns = sorted(self.integer_columns - self.float_columns)
+        mixed_columns = sorted(self.integer_columns & self.float_columns)
+        if not mixed_columns: os.remove(self.mask_file_name)
+        write_table_metadata(self.file_name, [self.n_rows, self.n_columns or 0], self.dtype, self.n_labels,
+                             header=self.header, integer_columns=integer_columns, chunk_rows=self.chunk_rows,
+                             mask_file_name=self.mask_file_name if mixed_columns else None)
+
+def write_table_metadata(file_name, shape, dtype, n_labels, header=None, integer_columns=None,
+                         chunk_rows=DEFAULT_CHUNK_ROWS, mask_file_name=None):
+    """Writes the metadata sidecar of the binary table file_name.
+
+    *Keyword arguments:*
+
+        - file_name -- Table name.
+        - shape -- Shape [rows, columns] of the numeric matrix.
+        - dtype -- Numpy dtype of the numeric matrix.
+        - n_labels -- Number of leading text columns of each row.
+        - header -- List of column names, including the text columns (default = None).
+        - integer_columns -- List of the numeric columns formatted as integers (default = None).
+        - chunk_rows -- Number of rows of each chunk (default = DEFAULT_CHUNK_ROWS).
+        - mask_file_name -- File with the integer bit of every cell (rows x ceil(columns / 8) bytes) (default = None).
+    """
+    matrix_file_name, label_file_name, metadata_file_name = binary_table_names(file_name)
+    metadata = dict()
+    metadata["format"] = FORMAT_NAME
+    metadata["version"] = FORMAT_VERSION
+    metadata["dtype"] = np.dtype(dtype).str
+    metadata["shape"] = list(shape)
+    metadata["n_labels"] = n_labels
+    metadata["header"] = header
+    metadata["integer_columns"] = integer_columns or []
+    metadata["chunk_rows"] = chunk_rows
+    metadata["matrix_file"] = os.path.basename(matrix_file_name)
+    metadata["label_file"] = os.path.basename(label_file_name)
+    metadata["mask_file"] = os.path.basename(mask_file_name) if mask_file_name else None
+    metadata_file = open(metadata_file_name, "w")
+    json.dump(metadata, metadata_file, indent=2, sort_keys=True)
+    metadata_file.close()
+
+def create_binary_table(file_name, label_list, n_columns, dtype="float64", header=None, integer_columns=None,
+                        chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Creates a binary table with the given text columns and a zero-filled numeric matrix, to be filled
+    in place (e.g. by several processes, each one writing its own rows) through BinaryTable(file_name,
+    mode='r+').
+
+    *Keyword arguments:*
+
+        - file_name -- Table name.
+        - label_list -- List with the text columns of each row.
+        - n_columns -- Number of numeric columns.
+        - dtype -- Numpy dtype of the numeric matrix (default = 'float64').
+        - header -- List of column names, including the text columns (default = None).
+        - integer_columns -- List of the numeric columns formatted as integers (default = None).
+        - chunk_rows -- Number of rows of each chunk (default = DEFAULT_CHUNK_ROWS).
+    """
+    matrix_file_name, label_file_name, metadata_file_name = binary_table_names(file_name)
+    n_labels = len(label_list[0]) if label_list else 0
+    label_file = open(label_file_name, "w")
+    for labels in label_list: label_file.write("\t".join([str(e) for e in labels])+"\n")
+    label_file.close()
+    # The file is extended without writing the zeros (sparse file)
+    matrix_file = open(matrix_file_name, "wb")
+    matrix_file.truncate(len(label_list) * n_columns * np.dtype(dtype).itemsize)
+    matrix_file.close()
+    write_table_metadata(file_name, [len(label_list), n_columns], dtype, n_labels, header=header,
+                         integer_columns=integer_columns, chunk_rows=chunk_rows)
+
+class IndexedTableWriter:
+    """Writes a table as a coordinate-sorted, bgzip-compressed and tabix-indexed text table (see the
+    module documentation). The rows are written to a temporary text file as they arrive, each one
+    preceded by its coordinates; when the writer is closed the file is sorted with the external sort
+    (unless the rows arrived sorted), so that the memory does not depend on the number of rows.
+
+    *Keyword arguments:*
+
+        - file_name -- Output file name (the table is written to file_name.gz).
+        - coordinate_columns -- Tuple (chromosome, start, end) with the 0-based indices of the coordinate
+                                columns; start is 0-based and end is exclusive.
+        - header -- List of column names written as the first ('#') line (default = None).
+    """
+
+    def __init__(self, file_name, coordinate_columns, header=None):
+
+        # Variable initializations
+        self.file_name = file_name
+        self.coordinate_columns = coordinate_columns
+        self.header = header
+        self.unsorted_file_name = file_name + ".unsorted"
+        self.unsorted_file = open(self.unsorted_file_name, "w")
+        self.last_key = None
+        self.is_sorted = True
+
+    def write(self, row):
+        """Writes one row. Its coordinate columns must hold a chromosome and two integers.
+
+        *Keyword arguments:*
+
+            - row -- List of values.
+        """
+        seq_col, start_col, end_col = self.coordinate_columns
+        try: key = (str(row[seq_col]), int(row[start_col]), int(row[end_col]))
+        except ValueError: raise ValueError("The coordinates of the rows of an indexed table must be integers.")
+        if self.last_key is not None and key < self.last_key: self.is_sorted = False
+        self.last_key = key
+        self.unsorted_file.write("\t".join([key[0], str(key[1]), str(key[2])] + [str(e) for e in row])+"\n")
+
+    def close(self):
+        """Sorts, compresses and indexes the rows (file_name.gz and file_name.gz.tbi)."""
+        self.unsorted_file.close()
+        sorted_file_name = self.unsorted_file_name
+        if not self.is_sorted:
+            # Byte order of the chromosome names, then numeric starts and ends (ties keep the writing order)
+            sorted_file_name = self.file_name + ".sorted"
+            environment = dict(os.environ)
+            environment["LC_ALL"] = "C"
+            status = subprocess.call(["sort", "-s", "-t", "\t", "-k1,1", "-k2,2n", "-k3,3n",
+                                      "-T", os.path.dirname(os.path.abspath(self.file_name)),
+                                      "-o", sorted_file_name, self.unsorted_file_name], env=environment)
+            os.remove(self.unsorted_file_name)
+            if status != 0: raise RuntimeError("Could not sort the indexed table: "+self.file_name)
+        sorted_file = open(sorted_file_name, "r")
+        output_file = open(self.file_name, "w")
+        if self.header is not None: output_file.write("#"+"\t".join(self.header)+"\n")
+        for line in sorted_file: output_file.write(line.split("\t", 3)[3])
+        output_file.close()
+        sorted_file.close()
+        os.remove(sorted_file_name)
+        seq_col, start_col, end_col = self.coordinate_columns
+        pysam.tabix_index(self.file_name, seq_col=seq_col, start_col=start_col, end_col=end_col, zerobased=True,
+                          meta_char="#", force=True)
+
+def indexed_table_name(file_name):
+    """Returns the name of the compressed file of the indexed table file_name.
+
+    *Keyword arguments:*
+
+        - file_name -- Output file name given to the writer, or the compressed file name.
+    """
+    if file_name.endswith(".gz"): return file_name
+    return file_name + ".gz"
+
+def open_table_writer(file_name, output_format="tsv", n_labels=0, header=None, coordinate_columns=None):
+    """Returns a TsvTableWriter, a BinaryTableWriter or an IndexedTableWriter according to output_format.
+
+    *Keyword arguments:*
+
+        - file_name -- Output file name.
+        - output_format -- 'tsv', 'binary' or 'indexed' (default = 'tsv').
+        - n_labels -- Number of leading text columns of each row (default = 0).
+        - header -- List of column names (default = None).
+        - coordinate_columns -- Tuple (chromosome, start, end) of column indices, required by 'indexed'
+                                (default = None).
+    """
+    if output_format == "tsv": return TsvTableWriter(file_name, header=header)
+    elif output_format == "binary": return BinaryTableWriter(file_name, n_labels, header=header)
+    elif output_format == "indexed":
+        if coordinate_columns is None: raise ValueError("This table has no coordinates to be indexed.")
+        return IndexedTableWriter(file_name, coordinate_columns, header=header)
+    else: raise ValueError("The output format must be one of: "+", ".join(OUTPUT_FORMATS))
+
+class BinaryTable:
+    """Represents a binary columnar table opened for reading. The numeric matrix is memory-mapped.
+
+    *Keyword arguments:*
+
+        - file_name -- Table name (any of its three files or the name without extension).
+        - mode -- Memory-map mode of the matrix: 'r' (read-only) or 'r+' (read and write) (default = 'r').
+    """
+
+    def __init__(self, file_name, mode="r"):
+
+        # Variable initializations
+        matrix_file_name, label_file_name, metadata_file_name = binary_table_names(file_name)
+        metadata_file = open(metadata_file_name, "r")
+        self.metadata = json.load(metadata_file)
+        metadata_file.close()
+        if self.metadata.get("format") != FORMAT_NAME:
+            raise ValueError("Not a binary table: "+metadata_file_name)
+        location = os.path.dirname(metadata_file_name)
+        self.matrix_file_name = os.path.join(location, self.metadata["matrix_file"])
+        self.label_file_name = os.path.join(location, self.metadata["label_file"])
+        self.header = self.metadata["header"]
+        self.n_labels = self.metadata["n_labels"]
+        self.shape = tuple(self.metadata["shape"])
+        self.integer_columns = set(self.metadata["integer_columns"])
+        if self.shape[0] * self.shape[1] > 0:
+            self.matrix = np.memmap(self.matrix_file_name, dtype=np.dtype(str(self.metadata["dtype"])), mode=mode,
+                                    shape=self.shape)
+        else:
+            self.matrix = np.zeros(self.shape, dtype=np.dtype(str(self.metadata["dtype"])))
+        self.mask = None
+        if self.metadata.get("mask_file") and self.shape[0] > 0:
+            self.mask = np.memmap(os.path.join(location, self.metadata["mask_file"]), dtype=np.uint8, mode="r",
+                                  shape=(self.shape[0], (self.shape[1] + 7) // 8))
+
+    def labels(self):
+        """Returns the list of text columns of all rows."""
+        label_file = open(self.label_file_name, "r")
+        label_list = [line.rstrip("\n").split("\t") if self.n_labels > 0 else [] for line in label_file]
+        label_file.close()
+        return label_list
+
+    def iter_chunks(self, chunk_rows=None):
+        """Yields (first row, matrix chunk) pairs covering all rows.
+
+        *Keyword arguments:*
+
+            - chunk_rows -- Number of rows of each chunk (default = the chunk size used when writing).
+        """
+        if chunk_rows is None: chunk_rows = self.metadata["chunk_rows"]
+        for first in range(0, self.shape[0], chunk_rows):
+            yield first, self.matrix[first:first + chunk_rows]
+
+    def format_row(self, values, row=None):
+        """Returns the values of a numeric row formatted as in the tab-separated tables.
+
+        *Keyword arguments:*
+
+            - values -- Numeric row.
+            - row -- Index of the row, used to read its integer cells from the mask (default = None).
+        """
+        integer_cells = self.integer_columns
+        if self.mask is not None and row is not None:
+            integer_cells = set(np.flatnonzero(np.unpackbits(self.mask[row])[:len(values)]).tolist())
+        formatted = []
+        for j, value in enumerate(values.tolist()):
+            if value != value: formatted.append("NA")
+            elif j in integer_cells: formatted.append(str(int(value)))
+            else: formatted.append(str(value))
+        return formatted
+
+def convert_to_tsv(file_name, output_file_name):
+    """Writes the binary table file_name as the tab-separated table the tools write by default.
+
+    *Keyword arguments:*
+
+        - file_name -- Binary table name.
+        - output_file_name -- Tab-separated output file name.
+    """
+    table = BinaryTable(file_name)
+    label_file = open(table.label_file_name, "r")
+    writer = TsvTableWriter(output_file_name, header=table.header)
+    for first, chunk in table.iter_chunks():
+        for i, values in enumerate(chunk):
+            label_list = label_file.readline().rstrip("\n")
+            if table.n_labels > 0: writer.write([label_list] + table.format_row(values, first + i))
+            else: writer.write(table.format_row(values, first + i))
+    writer.close()
+    label_file.close()
+
+def fetch_region(file_name, chrom=None, start=None, end=None):
+    """Yields the rows (lists of strings) of the indexed table file_name overlapping a region.
+
+    *Keyword arguments:*
+
+        - file_name -- Indexed table name (with or without the .gz extension).
+        - chrom -- Chromosome name (default = None, i.e. all rows).
+        - start -- Region start (0-based) (default = None, i.e. the chromosome start).
+        - end -- Region end (default = None, i.e. the chromosome end).
+    """
+    tabix_file = pysam.TabixFile(indexed_table_name(file_name))
+    try:
+        if chrom is not None and chrom not in tabix_file.contigs: return
+        for line in tabix_file.fetch(chrom, start, end): yield line.split("\t")
+    finally:
+        tabix_file.close()
+
+def convert_indexed_to_tsv(file_name, output_file_name, region=None):
+    """Writes the indexed table file_name (or only its rows overlapping region) as a tab-separated table.
+
+    *Keyword arguments:*
+
+        - file_name -- Indexed table name.
+        - output_file_name -- Tab-separated output file name.
+        - region -- Tuple (chromosome, start, end); start and end can be None (default = None, i.e. all rows).
+    """
+    tabix_file = pysam.TabixFile(indexed_table_name(file_name))
+    header = [line[1:].split("\t") for line in tabix_file.header]
+    tabix_file.close()
+    if region is None: region = (None, None, None)
+    writer = TsvTableWriter(output_file_name, header=header[0] if header else None)
+    for row in fetch_region(file_name, region[0], region[1], region[2]): writer.write(row)
+    writer.close()
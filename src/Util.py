@@ -12,9 +12,25 @@ import os
 import sys
 import shutil
 import ConfigParser
+import Queue
+import math
 import traceback
+import threading
+import multiprocessing
+import subprocess
+import json
 from optparse import OptionParser,BadOptionError,AmbiguousOptionError
 
+# External
+import numpy as np
+from pysam import Samfile
+
+# Optional: logo and style files of the HTML reports (from RGT); the reports are written without them otherwise
+try:
+    from rgt.Util import ImageData
+except ImportError:
+    ImageData = None
+
 def npath(filename):
     """Returns a normalised, absolute version of the path, with expanded user directory."""
     return os.path.abspath(os.path.expanduser(filename))
@@ -35,6 +51,25 @@ class PassThroughOptionParser(HelpfulOptionParser):
                 pass
                 #largs.append(e.opt_str)
 
+class HtmlStream:
+    """List-like sink of HTML lines that writes each line to disk as soon as it is appended, so that the
+    document is never held in memory.
+
+    *Keyword arguments:*
+
+        - file_name -- File to which the lines are written.
+    """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.file = open(file_name, "w")
+
+    def append(self, line):
+        if line: self.file.write(line+"\n")
+
+    def close(self):
+        if not self.file.closed: self.file.close()
+
 class Html:
     """Represent an HTML file.
 
@@ -48,24 +83,30 @@ class Html:
         - RGT_header -- Whether to print RGT header (default = True).
         - other_logo -- Other tool logos (default = None).
         - homepage -- Homepage link (default = None).
+        - stream_file_name -- If given, the document is written to this file as it is built instead of being kept in memory until write (default = None).
+
+    Without RGT's ImageData, the logo and style files are not copied to fig_dir (the header still refers to
+    the files in fig_rpath).
 
     .. warning:: cluster_path_fix is going to be deprecated soon. Do not use it.
     """
 
     def __init__(self, name, links_dict, fig_dir=None, fig_rpath="../fig", cluster_path_fix="", 
-                 RGT_header=True, other_logo=None, homepage=None):
+                 RGT_header=True, other_logo=None, homepage=None, stream_file_name=None):
 
         # Variable initializations
         self.name = name
         self.links_dict = links_dict
         self.cluster_path_fix = cluster_path_fix
-        self.document = []
-        self.image_data = ImageData()
+        self.document = HtmlStream(stream_file_name) if stream_file_name else []
+        self.n_tables = 0
+        self.paging_script = False
+        self.image_data = ImageData() if ImageData is not None else None
         self.other_logo = other_logo
         self.homepage = homepage
         
         # Initialize document
-        if fig_dir:
+        if fig_dir and self.image_data:
             self.copy_relevent_files(fig_dir)
             self.create_header(relative_dir=fig_rpath, RGT_name=RGT_header, other_logo=other_logo)
         else:
@@ -113,7 +154,7 @@ class Html:
             #self.document.append('<script type="text/javascript" src="'+relative_dir+'/jquery-1.11.1.js"></script>')
             self.document.append('<script type="text/javascript" src="'+relative_dir+'/jquery.tablesorter.min.js"></script>')
             #self.document.append('<script type="text/javascript" src="'+relative_dir+'/jquery.metadata.js"></script>')
-        else:
+        elif self.image_data:
             #self.document.append('<script type="text/javascript" src="'+self.cluster_path_fix+self.image_data.get_jquery()+'"></script>')
             self.document.append('<script type="text/javascript" src="'+self.cluster_path_fix+self.image_data.get_tablesorter()+'"></script>')
             #self.document.append('<script type="text/javascript" src="'+self.cluster_path_fix+self.image_data.get_jquery_metadata()+'"></script>')
@@ -126,7 +167,7 @@ class Html:
         
         if relative_dir:
             self.document.append("@import url(\""+relative_dir+"/style.css\");")
-        else:
+        elif self.image_data:
             self.document.append("@import url(\""+self.cluster_path_fix+self.image_data.get_css_file()+"\");")
         
         self.document.append("-->")
@@ -150,8 +191,10 @@ class Html:
             if self.homepage: self.document.append("</a>")
             self.document.append("    </td>")
             
-        else:
+        elif self.image_data:
             self.document.append("    <td width=\"5%\"><img border=\"0\" src=\""+self.cluster_path_fix+self.image_data.get_rgt_logo()+"\" width=\"130\" height=\"100\"></td>")
+        else:
+            self.document.append("    <td width=\"5%\"></td>")
 
         # Gap
         self.document.append("     <td width=\"5%\"></td>")
@@ -255,10 +298,34 @@ class Html:
             - border_list -- Table borders (default = None).
             - sortable -- Whether it is a sortable table (default = False).
         """
+        type_list = type_list.lower()
+        if not border_list:
+            border_list = [""] * len(type_list)
+
+        # Header, rows and end of the table
+        self.add_zebra_table_header(header_list, col_size_list, type_list, align=align, cell_align=cell_align,
+                                    auto_width=auto_width, colorcode=colorcode, header_titles=header_titles,
+                                    border_list=border_list, sortable=sortable)
+        self.document.append("  <tbody>")
+        for i in range(0,len(data_table)):
+            for line in self.zebra_table_row(i, data_table[i], type_list, cell_align, border_list, sortable):
+                self.document.append(line)
+        self.document.append("</tbody></table></p>")
+
+    def add_zebra_table_header(self, header_list, col_size_list, type_list, align = 50, cell_align = 'center',
+                               auto_width=False, colorcode=None, header_titles=None, border_list=None,
+                               sortable=False):
+        """Starts a zebra table: paragraph, table tag and header (see add_zebra_table). The table body
+        is not opened.
+
+        *Keyword arguments:*
+
+            - The arguments are as in add_zebra_table.
+        """
         #if header_notes: self.document.append("<style> .ami div {display:none} .ami:hover div {display:block} </style>")
         
         if not border_list:
-            border_list = [""] * len(data_table[0])
+            border_list = [""] * len(type_list)
         if auto_width: auto= " table-layout: auto"
         else: auto=""
 
@@ -347,33 +414,148 @@ class Html:
             self.document.append("    </tr>")
         self.document.append("  </thead>")
 
-        
-        #############################
-        ##### Table body ############
+    def zebra_table_row(self, i, row, type_list, cell_align = 'center', border_list=None, sortable=False):
+        """Returns the HTML lines of the row number i of a zebra table (see add_zebra_table).
+
+        *Keyword arguments:*
+
+            - i -- Number of the row in the table (starting at 0).
+            - row -- Row data, according to type_list.
+            - type_list -- A string in which each character represents the type of each row (lower case).
+            - cell_align -- Alignment of each cell in the table (default = center).
+            - border_list -- Table borders (default = None).
+            - sortable -- Whether it is a sortable table (default = False).
+        """
+        if not border_list:
+            border_list = [""] * len(row)
+        line_list = []
+
+        # Row type
+        if(i%2==0) and not sortable: line_list.append("    <tr class=\"odd\">")
+        else: line_list.append("    <tr>")
+
+        # Body data
+        for j in range(0,len(row)):
+            if(type_list[j] == "s"):
+                line_list.append("      <td align=\""+cell_align+"\" "+border_list[j]+">"+row[j]+"</td>")
+            elif(type_list[j] == "i"): 
+                line_list.append("      <td align=\""+cell_align+"\"><img src=\""+self.cluster_path_fix+
+                                 row[j][0]+"\" width="+str(row[j][1])+" ></td>")
+            elif(type_list[j] == "l"):
+                line_list.append("      <td align=\""+cell_align+"\"><a href=\""+row[j][1]+"\">"+
+                                 row[j][0]+"</a></td>")
+            else: pass # TODO ERROR
+
+        # Row ending
+        line_list.append("    </tr>")
+        return line_list
+
+    def add_paging_script(self):
+        """Adds (once) the javascript that loads the pages of the paged tables on demand. Each page is a
+        javascript file calling rgt_page_loaded, so that it can be loaded from the local file system."""
+        if self.paging_script: return
+        self.paging_script = True
+        scripts = ["<script>",
+                   "var rgtPagedTables = {};",
+                   "function rgt_show_page(tableId, page) {",
+                   "    var t = rgtPagedTables[tableId];",
+                   "    if(page < 1 || page > t.count || page == t.current) return;",
+                   "    var s = document.createElement('script');",
+                   "    s.src = t.prefix + page + '.js';",
+                   "    document.body.appendChild(s);",
+                   "}",
+                   "function rgt_page_loaded(tableId, page, rows) {",
+                   "    var t = rgtPagedTables[tableId];",
+                   "    $('#' + tableId + ' tbody').html(rows.join('\\n'));",
+                   "    t.current = page;",
+                   "    $('#' + tableId + '_page').text(page + ' / ' + t.count);",
+                   "    if(t.sortable) $('#' + tableId + ' table').trigger('update');",
+                   "}",
+                   "</script>"]
+        for s in scripts:
+            self.document.append(s)
+
+    def add_paged_table(self, header_list, col_size_list, type_list, row_iterator, page_dir, page_rpath=".",
+                        page_size=1000, align = 50, cell_align = 'center', auto_width=False, colorcode=None,
+                        header_titles=None, border_list=None, sortable=False):
+        """Creates a zebra table whose rows are streamed to disk in pages of page_size rows. The first
+        page is written in the document and the other pages are separate files, loaded on demand by the
+        navigation links under the table. Neither the rows nor the pages are kept in memory. If the table
+        is sortable, sorting applies to the page shown.
+
+        *Keyword arguments:*
+
+            - header_list -- A list with the table headers in correct order.
+            - col_size_list -- A list with the column sizes (integers).
+            - type_list -- A string in which each character represents the type of each row (see add_zebra_table).
+            - row_iterator -- Iterable of rows (e.g. a generator), each row according to type_list.
+            - page_dir -- Directory where the page files are written.
+            - page_rpath -- Path of page_dir relative to the HTML document (default = '.').
+            - page_size -- Number of rows per page (default = 1000).
+            - The other arguments are as in add_zebra_table.
+
+        *Return:*
+
+            - Number of rows of the table.
+        """
+        type_list = type_list.lower()
+        if not border_list:
+            border_list = [""] * len(type_list)
+        self.n_tables += 1
+        table_id = "paged"+str(self.n_tables)
+        page_prefix = self.name.replace(" ", "_")+"_"+table_id+"_page"
+        try:
+            os.stat(page_dir)
+        except:
+            os.makedirs(page_dir)
+
+        # Header (the table is wrapped in a div named after it, the table tag keeps the zebra style id)
+        self.add_paging_script()
+        self.document.append("<div id=\""+table_id+"\">")
+        self.add_zebra_table_header(header_list, col_size_list, type_list, align=align, cell_align=cell_align,
+                                    auto_width=auto_width, colorcode=colorcode, header_titles=header_titles,
+                                    border_list=border_list, sortable=sortable)
         self.document.append("  <tbody>")
-        for i in range(0,len(data_table)):
 
-            # Row type
-            if(i%2==0) and not sortable: self.document.append("    <tr class=\"odd\">")
-            else: self.document.append("    <tr>")
-
-            # Body data
-            for j in range(0,len(data_table[i])):
-                if(type_list[j] == "s"):
-                    self.document.append("      <td align=\""+cell_align+"\" "+border_list[j]+">"+data_table[i][j]+"</td>")
-                elif(type_list[j] == "i"): 
-                    self.document.append("      <td align=\""+cell_align+"\"><img src=\""+self.cluster_path_fix+
-                                         data_table[i][j][0]+"\" width="+str(data_table[i][j][1])+" ></td>")
-                elif(type_list[j] == "l"):
-                    self.document.append("      <td align=\""+cell_align+"\"><a href=\""+data_table[i][j][1]+"\">"+
-                                         data_table[i][j][0]+"</a></td>")
-                else: pass # TODO ERROR
-
-            # Row ending
-            self.document.append("    </tr>")
-        
-        # Finishing table
+        # Rows: the first page goes to the document and every page (including the first) to its page file
+        n_rows = 0
+        page_file = None
+        for row in row_iterator:
+            if n_rows % page_size == 0:
+                if page_file: page_file.write("]);\n"); page_file.close()
+                page_file = open(os.path.join(page_dir, page_prefix+str(n_rows // page_size + 1)+".js"), "w")
+                page_file.write("rgt_page_loaded("+json.dumps(table_id)+", "+str(n_rows // page_size + 1)+", [\n")
+            line_list = self.zebra_table_row(n_rows, row, type_list, cell_align, border_list, sortable)
+            if n_rows < page_size:
+                for line in line_list: self.document.append(line)
+            page_file.write(("" if n_rows % page_size == 0 else ",\n")+json.dumps("\n".join(line_list)))
+            n_rows += 1
+        if page_file: page_file.write("]);\n"); page_file.close()
         self.document.append("</tbody></table></p>")
+        self.document.append("</div>")
+
+        # Navigation
+        n_pages = max((n_rows + page_size - 1) // page_size, 1)
+        self.document.append("<script>rgtPagedTables["+json.dumps(table_id)+"] = {prefix: "+
+                             json.dumps(os.path.join(page_rpath, page_prefix))+", count: "+str(n_pages)+
+                             ", current: 1, sortable: "+("true" if sortable else "false")+"};</script>")
+        if n_pages > 1:
+            if(isinstance(align,int)): self.document.append("<p style=\"margin-left: "+str(align)+"\">")
+            elif(isinstance(align,str)): self.document.append("<p align=\""+align+"\">")
+            nav = "var t = rgtPagedTables['"+table_id+"']; "
+            self.document.append("<a class=\"pure-button\" href=\"javascript:void(0)\" onclick=\"rgt_show_page('"+
+                                 table_id+"', 1)\"><font size='1'>&lt;&lt;</font></a>")
+            self.document.append("<a class=\"pure-button\" href=\"javascript:void(0)\" onclick=\""+nav+
+                                 "rgt_show_page('"+table_id+"', t.current - 1)\"><font size='1'>&lt;</font></a>")
+            self.document.append("<font face=\"Arial\" size=\"2\">Page <span id=\""+table_id+"_page\">1 / "+
+                                 str(n_pages)+"</span> ("+str(n_rows)+" rows)</font>")
+            self.document.append("<a class=\"pure-button\" href=\"javascript:void(0)\" onclick=\""+nav+
+                                 "rgt_show_page('"+table_id+"', t.current + 1)\"><font size='1'>&gt;</font></a>")
+            self.document.append("<a class=\"pure-button\" href=\"javascript:void(0)\" onclick=\"rgt_show_page('"+
+                                 table_id+"', "+str(n_pages)+")\"><font size='1'>&gt;&gt;</font></a>")
+            self.document.append("</p>")
+
+        return n_rows
 
     def add_fixed_rank_sortable(self):
         """Add jquery for fixing the first column of the sortable table"""
@@ -484,6 +666,13 @@ class Html:
         # Add footer - finalize document
         self.create_footer()
 
+        # A streamed document is already on disk
+        if isinstance(self.document, HtmlStream):
+            self.document.close()
+            if os.path.abspath(file_name) != os.path.abspath(self.document.file_name):
+                shutil.move(self.document.file_name, file_name)
+            return
+
         # Writing document to file
         f = open(file_name,"w")
         for e in self.document:
@@ -569,6 +758,542 @@ class AuxiliaryFunctions:
         return "".join([revDict[e] for e in s[::-1]])
 
         
+class SamfilePool:
+    """A pool of open BAM handles shared by all tools. Handles are cached per file, process and thread,
+    so that each worker thread (and each forked worker process) reads through its own handle, and they
+    can be opened with htslib decompression threads.
+
+    Each threaded handle keeps its own htslib thread pool alive while it is open, so the default is a
+    single thread; enable more threads for the few large files that are decoded in long sequential
+    chunks, not for the many small files only used for index lookups.
+
+    *Keyword arguments:*
+
+        - threads -- Default number of htslib decompression threads of each handle (default = 1).
+    """
+
+    def __init__(self, threads=1):
+
+        # Variable initializations
+        self.threads = threads
+        self.handles = dict()
+        self.lock = threading.Lock()
+
+    def set_threads(self, threads):
+        """Sets the number of htslib decompression threads of the handles opened from now on.
+
+        *Keyword arguments:*
+
+            - threads -- Number of decompression threads.
+        """
+        self.threads = max(int(threads), 1)
+
+    def get(self, file_name, threads=None):
+        """Returns an open handle to file_name owned by the calling process and thread.
+
+        *Keyword arguments:*
+
+            - file_name -- BAM file name.
+            - threads -- Number of decompression threads if the handle is opened now (default = None, i.e. the pool's).
+        """
+        key = (file_name, os.getpid(), threading.current_thread().ident)
+        with self.lock:
+            handle = self.handles.get(key)
+        if handle is None:
+            if threads is None: threads = self.threads
+            try: handle = Samfile(file_name, "rb", threads=threads)
+            except TypeError: handle = Samfile(file_name, "rb") # pysam without the threads argument
+            with self.lock:
+                self.handles[key] = handle
+        return handle
+
+    def close(self, file_name=None):
+        """Closes the handles owned by the calling process. Handles inherited from a parent process
+        are only forgotten, never closed.
+
+        *Keyword arguments:*
+
+            - file_name -- Only close the handles of this file (default = None, i.e. all files).
+        """
+        with self.lock:
+            for key in list(self.handles.keys()):
+                if file_name is not None and key[0] != file_name: continue
+                handle = self.handles.pop(key)
+                if key[1] == os.getpid(): handle.close()
+
+samfile_pool = SamfilePool()
+
+def read_chromosome_sizes(chrom_sizes_file_name):
+    """Reads a chromosome sizes file into a dictionary chromosome -> length.
+
+    *Keyword arguments:*
+
+        - chrom_sizes_file_name -- Tab-separated file with chromosome names and lengths.
+    """
+    chrom_sizes_dict = dict()
+    chrom_sizes_file = open(chrom_sizes_file_name, "rU")
+    for line in chrom_sizes_file:
+        ll = line.strip().split("\t")
+        if len(ll) < 2: continue
+        chrom_sizes_dict[ll[0]] = int(ll[1])
+    chrom_sizes_file.close()
+    return chrom_sizes_dict
+
+def run_shard(shard):
+    """Runs one shard of a ChromosomeExecutor in a worker process. Returns the item indices together
+    with their results.
+
+    *Keyword arguments:*
+
+        - shard -- Tuple (function, item indices, items, extra arguments).
+    """
+    function, index_list, item_list, args = shard
+    result_list = function(item_list, *args)
+    return index_list, result_list
+
+class ChromosomeExecutor:
+    """Executes per-item work in a process pool, partitioned by chromosome. Each chromosome is a
+    partition; partitions are submitted largest first (by chromosome size, or by number of items when
+    the size is unknown) so that the workers stay balanced, and the results are reassembled in the
+    original item order, therefore the output does not depend on the number of workers.
+
+    The work function receives a list of items (plus the extra arguments) and must return a list with
+    one result per item. It must be a module-level function so that it can be sent to the workers.
+    An initializer (e.g. opening the input files once) runs once in each worker process, or once in the
+    calling process with a single thread, before the first work function.
+
+    *Keyword arguments:*
+
+        - threads -- Number of worker processes. With 1, all items run in the calling process (default = 1).
+        - chrom_sizes -- Dictionary or file with the chromosome sizes (default = None).
+        - initializer -- Module-level function(*initargs) run once per process (default = None).
+        - initargs -- Arguments given to initializer (default = ()).
+    """
+
+    def __init__(self, threads=1, chrom_sizes=None, initializer=None, initargs=()):
+
+        # Variable initializations
+        self.threads = max(int(threads), 1)
+        if isinstance(chrom_sizes, str): chrom_sizes = read_chromosome_sizes(chrom_sizes)
+        if chrom_sizes is None: chrom_sizes = dict()
+        self.chrom_sizes = chrom_sizes
+        self.initializer = initializer
+        self.initargs = tuple(initargs)
+        self.initialized = False
+
+    def initialize(self):
+        """Runs the initializer in the calling process (only the first time)."""
+        if self.initializer is not None and not self.initialized: self.initializer(*self.initargs)
+        self.initialized = True
+
+    def create_pool(self, processes):
+        """Returns a process pool whose workers run the initializer.
+
+        *Keyword arguments:*
+
+            - processes -- Number of worker processes.
+        """
+        return multiprocessing.Pool(processes, self.initializer, self.initargs)
+
+    def partition(self, chrom_list):
+        """Groups the item indices by chromosome. Returns the groups sorted by decreasing weight.
+
+        *Keyword arguments:*
+
+            - chrom_list -- List with the chromosome of each item.
+        """
+        index_dict = dict()
+        for i, chrom in enumerate(chrom_list):
+            index_dict.setdefault(chrom, []).append(i)
+        weight = lambda chrom: (self.chrom_sizes.get(chrom, 0), len(index_dict[chrom]))
+        return [index_dict[chrom] for chrom in sorted(index_dict.keys(), key=weight, reverse=True)]
+
+    def run(self, function, item_list, chrom_list, *args):
+        """Runs function over item_list and returns one result per item, in the original order.
+
+        *Keyword arguments:*
+
+            - function -- Module-level function(item_list, *args) returning a list of results.
+            - item_list -- List of items.
+            - chrom_list -- List with the chromosome of each item.
+            - args -- Extra arguments given to function.
+        """
+        if self.threads == 1 or len(item_list) == 0:
+            self.initialize()
+            return function(item_list, *args)
+        shard_list = [(function, index_list, [item_list[i] for i in index_list], args)
+                      for index_list in self.partition(chrom_list)]
+        result_list = [None] * len(item_list)
+        pool = self.create_pool(min(self.threads, len(shard_list)))
+        try:
+            for index_list, shard_result_list in pool.imap_unordered(run_shard, shard_list):
+                for i, result in zip(index_list, shard_result_list): result_list[i] = result
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+        return result_list
+
+    def run_blocks(self, function, block_iterator, *args):
+        """Runs function over consecutive blocks of items and yields the results of each block, in the
+        original order, as soon as the block is done. Only one block is held in memory at a time. Each
+        chromosome of a block is split in up to threads shards, so that sorted inputs (whose blocks
+        usually hold a single chromosome) still use all workers.
+
+        *Keyword arguments:*
+
+            - function -- Module-level function(item_list, *args) returning a list of results.
+            - block_iterator -- Iterator of (item_list, chrom_list) blocks.
+            - args -- Extra arguments given to function.
+        """
+        pool = None
+        try:
+            for item_list, chrom_list in block_iterator:
+                if self.threads == 1 or len(item_list) == 0:
+                    self.initialize()
+                    yield function(item_list, *args)
+                    continue
+                shard_list = []
+                for index_list in self.partition(chrom_list):
+                    shard_size = max(int(math.ceil(len(index_list) / float(self.threads))), 1)
+                    for first in range(0, len(index_list), shard_size):
+                        shard_index_list = index_list[first:first + shard_size]
+                        shard_list.append((function, shard_index_list, [item_list[i] for i in shard_index_list], args))
+                if pool is None: pool = self.create_pool(self.threads)
+                result_list = [None] * len(item_list)
+                for index_list, shard_result_list in pool.imap_unordered(run_shard, shard_list):
+                    for i, result in zip(index_list, shard_result_list): result_list[i] = result
+                yield result_list
+            if pool is not None: pool.close()
+        except:
+            if pool is not None: pool.terminate()
+            raise
+        finally:
+            if pool is not None: pool.join()
+
+def stratify(values, percentile_list=None, edges=None, reference_values=None):
+    """Assigns an integer group code to every value in one vectorized operation. Returns an int array
+    with one code per value; values outside all groups (or NaN) get -1.
+
+    With percentile_list, the code of a value is the largest percentile p whose threshold
+    (np.percentile(reference_values, p)) is lower than or equal to the value, e.g. range(0, 101) gives percentile
+    codes, range(0, 100, 10) deciles and range(0, 100, 25) quartiles. With edges (ascending custom
+    thresholds), the code is the index of the last edge lower than or equal to the value.
+
+    *Keyword arguments:*
+
+        - values -- List or array of numbers.
+        - percentile_list -- List of percentiles (default = None).
+        - edges -- Ascending list of thresholds, used when percentile_list is None (default = None).
+        - reference_values -- Values used to compute the percentile thresholds (default = values).
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if reference_values is None: reference_values = values
+    if percentile_list is not None:
+        code_vec = np.array(sorted(set([int(e) for e in percentile_list])), dtype=np.int64)
+        if len(values) == 0: return np.zeros(0, dtype=np.int64)
+        threshold_vec = np.percentile(np.asarray(reference_values, dtype=np.float64), code_vec)
+    elif edges is not None:
+        threshold_vec = np.asarray(edges, dtype=np.float64)
+        code_vec = np.arange(len(threshold_vec), dtype=np.int64)
+    else:
+        raise ValueError("Either percentile_list or edges must be given.")
+    # Rounding can make consecutive percentile thresholds decrease slightly; the suffix minimum keeps the
+    # thresholds sorted without changing the largest code whose threshold is lower than or equal to a value
+    threshold_vec = np.minimum.accumulate(threshold_vec[::-1])[::-1]
+    index_vec = np.searchsorted(threshold_vec, values, side="right") - 1
+    group_vec = np.where(index_vec >= 0, code_vec[np.clip(index_vec, 0, len(code_vec) - 1)], -1)
+    group_vec[np.isnan(values)] = -1
+    return group_vec
+
+class GroupStatistics:
+    """Keeps, for each group, the running count, sum, mean and variance (Welford's algorithm) of the
+    vectors added to it, so that group curves can be computed without storing the vectors. Group i
+    holds the values v such that boundaries[i+1] <= v < boundaries[i].
+
+    *Keyword arguments:*
+
+        - boundaries -- List of group boundaries (sorted internally in decreasing order).
+    """
+
+    def __init__(self, boundaries):
+
+        # Variable initializations
+        self.boundaries = sorted([float(e) for e in boundaries], reverse=True)
+        self.n_groups = max(len(self.boundaries) - 1, 0)
+        self.counts = [0] * self.n_groups
+        self.sums = [None] * self.n_groups
+        self.means = [None] * self.n_groups
+        self.m2 = [None] * self.n_groups
+
+    def group(self, value):
+        """Returns the group index of value, or None if it is outside all groups.
+
+        *Keyword arguments:*
+
+            - value -- Grouping value.
+        """
+        for i in range(0, self.n_groups):
+            if self.boundaries[i + 1] <= value < self.boundaries[i]: return i
+        return None
+
+    def add(self, value, vector):
+        """Adds vector to the group of value. Returns whether the vector belongs to a group.
+
+        *Keyword arguments:*
+
+            - value -- Grouping value.
+            - vector -- List or array of numbers (all vectors must have the same length).
+        """
+        i = self.group(value)
+        if i is None: return False
+        vector = np.asarray(vector, dtype=np.float64)
+        if self.counts[i] == 0:
+            self.sums[i] = np.zeros(len(vector))
+            self.means[i] = np.zeros(len(vector))
+            self.m2[i] = np.zeros(len(vector))
+        self.counts[i] += 1
+        self.sums[i] += vector
+        delta = vector - self.means[i]
+        self.means[i] += delta / self.counts[i]
+        self.m2[i] += delta * (vector - self.means[i])
+        return True
+
+    def label(self, i):
+        """Returns the label 'lower-upper' of group i.
+
+        *Keyword arguments:*
+
+            - i -- Group index.
+        """
+        return "-".join([("%g" % e) for e in [self.boundaries[i + 1], self.boundaries[i]]])
+
+    def rows(self, n_columns):
+        """Returns, for each group, the rows [label, statistic, count, values...] of the statistics sum,
+        mean and variance (sample variance). Missing statistics are "NA".
+
+        *Keyword arguments:*
+
+            - n_columns -- Length of the vectors (used for the empty groups).
+        """
+        row_list = []
+        for i in range(0, self.n_groups):
+            count = self.counts[i]
+            if count > 0:
+                sums = self.sums[i].tolist()
+                means = self.means[i].tolist()
+            else:
+                sums = [0.0] * n_columns
+                means = ["NA"] * n_columns
+            if count > 1: variances = (self.m2[i] / (count - 1)).tolist()
+            else: variances = ["NA"] * n_columns
+            row_list.append([self.label(i), "sum", count] + sums)
+            row_list.append([self.label(i), "mean", count] + means)
+            row_list.append([self.label(i), "variance", count] + variances)
+        return row_list
+
+def pipeline_string(command_list):
+    """Returns the shell notation (cmd1 | cmd2 | ...) of a pipeline, used in messages.
+
+    *Keyword arguments:*
+
+        - command_list -- List of commands, each a list of arguments.
+    """
+    return " | ".join([" ".join([str(e) for e in command]) for command in command_list])
+
+def run_pipeline(command_list, input_file_name=None, input_lines=None, output_file_name=None, cleanup_file_list=None,
+                 verbose=True):
+    """Runs the commands connected by pipes (the output of each one is the input of the next), without
+    intermediate files. The exit code of every command is checked; if any of them fails, all the commands
+    are stopped and the output files are removed. Returns True if all commands succeeded.
+
+    *Keyword arguments:*
+
+        - command_list -- List of commands, each a list of arguments (e.g. ["samtools", "sort", "-"]).
+        - input_file_name -- File read by the first command (default = None).
+        - input_lines -- Iterable of strings written to the first command instead of a file (default = None).
+        - output_file_name -- File written with the output of the last command (default = None).
+        - cleanup_file_list -- Other files created by the commands, removed on failure (default = None).
+        - verbose -- Whether failures are reported (default = True).
+    """
+    if cleanup_file_list is None: cleanup_file_list = []
+    if output_file_name is not None: cleanup_file_list = [output_file_name] + cleanup_file_list
+    input_file = open(input_file_name, "rb") if input_file_name is not None else None
+    output_file = open(output_file_name, "wb") if output_file_name is not None else None
+    process_list = []
+    status_list = []
+    try:
+        for i, command in enumerate(command_list):
+            if i > 0: stdin = process_list[-1].stdout
+            elif input_lines is not None: stdin = subprocess.PIPE
+            else: stdin = input_file
+            if i == len(command_list) - 1: stdout = output_file
+            else: stdout = subprocess.PIPE
+            process_list.append(subprocess.Popen([str(e) for e in command], stdin=stdin, stdout=stdout))
+            # The parent closes its copy of the pipe, so that a failing command stops the previous ones
+            if i > 0: process_list[-2].stdout.close()
+        if input_lines is not None:
+            try:
+                for line in input_lines: process_list[0].stdin.write(line)
+            except IOError: pass
+            process_list[0].stdin.close()
+        status_list = [process.wait() for process in process_list]
+    except (OSError, IOError), e:
+        for process in process_list:
+            if process.poll() is None: process.kill()
+            process.wait()
+        status_list = [-1]
+        if verbose: print("ERROR: The pipeline could not be run ("+str(e)+"): "+pipeline_string(command_list))
+    finally:
+        if input_file is not None: input_file.close()
+        if output_file is not None: output_file.close()
+
+    # Removing the output files of a failed pipeline
+    if any([status != 0 for status in status_list]):
+        if verbose and status_list != [-1]:
+            print("ERROR: The pipeline failed (exit codes "+", ".join([str(e) for e in status_list])+"): "+pipeline_string(command_list))
+        for file_name in cleanup_file_list:
+            if os.path.exists(file_name): os.remove(file_name)
+        return False
+    return True
+
+class CommandExecutor:
+    """Runs external commands (shell command lines or pipelines) in a fixed set of jobs worker threads, so that
+    independent commands (e.g. the plots of a tool and the next stage of its computation) overlap. A command
+    may depend on commands submitted before it: it only enters the ready queue of the workers after all of
+    them succeed, and it is skipped (with the commands that depend on it) if any of them fails. The exit
+    code of every command is checked and failures are reported; wait returns whether all commands succeeded.
+
+    *Keyword arguments:*
+
+        - jobs -- Number of worker threads, i.e. of commands running at the same time (default = 1).
+        - verbose -- Whether failed and skipped commands are reported (default = True).
+    """
+
+    def __init__(self, jobs=1, verbose=True):
+
+        # Variable initializations
+        self.jobs = max(int(jobs), 1)
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        self.ready = Queue.Queue()
+        self.worker_list = []
+        self.job_list = []
+
+    def submit(self, command, depends=None, cleanup_file_list=None):
+        """Queues command to run as soon as a worker is free and its dependencies succeeded. Returns the job
+        number.
+
+        *Keyword arguments:*
+
+            - command -- Shell command line, or pipeline given as a list of commands (see run_pipeline).
+            - depends -- Job number or list of job numbers that must succeed first (default = None).
+            - cleanup_file_list -- Files created by a pipeline, removed if it fails (default = None).
+        """
+        if depends is None: depends = []
+        elif isinstance(depends, int): depends = [depends]
+        job = {"command": command, "depends": list(depends), "cleanup": cleanup_file_list, "done": threading.Event(),
+               "status": None, "waiting": 0, "dependents": []}
+        with self.lock:
+            number = len(self.job_list)
+            self.job_list.append(job)
+            for i in job["depends"]:
+                if not self.job_list[i]["done"].is_set():
+                    self.job_list[i]["dependents"].append(number)
+                    job["waiting"] += 1
+            if job["waiting"] == 0: self.release(number)
+            if len(self.worker_list) < self.jobs:
+                worker = threading.Thread(target=self.work)
+                worker.daemon = True
+                self.worker_list.append(worker)
+                worker.start()
+        return number
+
+    def command_string(self, job):
+        """Returns the command line of job (pipelines are joined with pipes).
+
+        *Keyword arguments:*
+
+            - job -- Job dictionary created by submit.
+        """
+        if isinstance(job["command"], list): return pipeline_string(job["command"])
+        return job["command"]
+
+    def release(self, number):
+        """Puts a job whose dependencies are done in the ready queue, or skips it if one of them failed
+        (called with the lock held).
+
+        *Keyword arguments:*
+
+            - number -- Job number.
+        """
+        job = self.job_list[number]
+        if any([self.job_list[i]["status"] != 0 for i in job["depends"]]):
+            if self.verbose: print("ERROR: The command was skipped because a previous command failed: "+self.command_string(job))
+            self.finish(number, "skipped")
+        else:
+            self.ready.put(number)
+
+    def finish(self, number, status):
+        """Records the status of a job and releases the jobs waiting only for it (called with the lock held).
+
+        *Keyword arguments:*
+
+            - number -- Job number.
+            - status -- Exit code, "error" or "skipped".
+        """
+        job = self.job_list[number]
+        job["status"] = status
+        job["done"].set()
+        for i in job["dependents"]:
+            self.job_list[i]["waiting"] -= 1
+            if self.job_list[i]["waiting"] == 0: self.release(i)
+
+    def work(self):
+        """Runs the jobs of the ready queue, one at a time (the loop of each worker thread)."""
+        while True:
+            number = self.ready.get()
+            job = self.job_list[number]
+            command = self.command_string(job)
+            try:
+                if isinstance(job["command"], list):
+                    status = 0 if run_pipeline(job["command"], cleanup_file_list=job["cleanup"], verbose=self.verbose) else 1
+                else:
+                    status = subprocess.call(job["command"], shell=True)
+                    if status != 0 and self.verbose:
+                        print("ERROR: The command failed (exit code "+str(status)+"): "+command)
+            except Exception, e:
+                status = "error"
+                if self.verbose: print("ERROR: The command could not be run ("+str(e)+"): "+command)
+            with self.lock:
+                self.finish(number, status)
+
+    def wait(self, job_numbers=None):
+        """Waits for the jobs to finish. Returns True if all of them succeeded.
+
+        *Keyword arguments:*
+
+            - job_numbers -- Job number or list of job numbers (default = None, i.e. all jobs submitted so far).
+        """
+        if job_numbers is None: job_numbers = range(len(self.job_list))
+        elif isinstance(job_numbers, int): job_numbers = [job_numbers]
+        for i in job_numbers:
+            while not self.job_list[i]["done"].wait(1.0): pass
+        return all([self.job_list[i]["status"] == 0 for i in job_numbers])
+
+    def run(self, command, depends=None, cleanup_file_list=None):
+        """Runs command (after its dependencies) and waits for it. Returns True if it succeeded.
+
+        *Keyword arguments:*
+
+            - command -- Shell command line, or pipeline given as a list of commands (see run_pipeline).
+            - depends -- Job number or list of job numbers that must succeed first (default = None).
+            - cleanup_file_list -- Files created by a pipeline, removed if it fails (default = None).
+        """
+        return self.wait(self.submit(command, depends, cleanup_file_list))
+
 def which(program):
     """Return path of program or None, see
     http://stackoverflow.com/questions/377017/test-if-executable-exists-in-python"""
@@ -13,7 +13,7 @@ warnings.filterwarnings("ignore")
 
 # Internal
 from src import __version__
-from ..Util import PassThroughOptionParser
+from ..Util import PassThroughOptionParser, CommandExecutor, samfile_pool
 from createTable import create_table
 
 """
@@ -120,7 +120,16 @@ def main():
   parser.add_option("--signal-label-list", dest="bam_names", type="string", metavar="NAME_1[,NAME_2,...,NAME_N]", default=None, help=("A comma-separated list of labels for each signal (features) to be plot."))
   parser.add_option("--signal-count-list", dest="bam_counts", type="string", metavar="INT_1[,INT_2,...,INT_N]", default=None, help=("A comma-separated list containing the total read count of each signal's (features's) BAM file."))
   parser.add_option("--signal-file-list", dest="bam_list", type="string", metavar="FILE_1[,FILE_2,...,FILE_N]", default=None, help=("A comma-separated list of BAM files for each signal (features) to be plot."))
+  parser.add_option("--chrom-sizes", dest="chrom_sizes_file_name", type="string", metavar="FILE", default=None, help=("File containing the total length of all chromosomes. Used to balance the parallel execution (optional)."))
+  parser.add_option("--threads", dest="threads", type="int", metavar="INT", default=1, help=("Number of processes used to run the analysis in parallel. The work is divided by chromosome."))
+  parser.add_option("--bam-threads", dest="bam_threads", type="int", metavar="INT", default=1, help=("Number of htslib decompression threads of each open BAM file, in every process. More threads speed up the long sequential reads of large BAM files."))
   parser.add_option("--temp", dest="temp_location", type="string", metavar="PATH", default=None, help=("Temporary location to aid in the execution."))
+  parser.add_option("--block-size", dest="block_size", type="int", metavar="INT", default=10000, help=("Number of regions fetched and written at a time. The memory used is proportional to it."))
+  parser.add_option("--statistics", dest="statistics", action="store_true", default=False, help=("Writes the Pearson, Spearman and partial correlations between the signals, with bootstrap confidence intervals, in the output file name with the suffix _stats.txt."))
+  parser.add_option("--bootstrap", dest="n_bootstrap", type="int", metavar="INT", default=1000, help=("Number of bootstrap resamples used for the confidence intervals of --statistics."))
+  parser.add_option("--density-plots", dest="density_plots", action="store_true", default=False, help=("Plots precomputed density grids and a stratified subsample of the regions (written in plot_data next to the output file) instead of every region, so that the plotting time and the PDF sizes do not depend on the number of regions."))
+  parser.add_option("--plot-points", dest="max_points", type="int", metavar="INT", default=5000, help=("Approximate number of regions of the subsample drawn with --density-plots."))
+  parser.add_option("--output-format", dest="output_format", type="choice", choices=["tsv", "binary"], metavar="STRING", default="tsv", help=("Format of the output table: 'tsv' (tab-separated text) or 'binary' (memory-mappable matrix with a JSON metadata file). The plots are only created with 'tsv'."))
   parser.add_option("--output-file", dest="output_file_name", type="string", metavar="FILE", default=None, help=("Output file name."))
 
   # Processing Options
@@ -134,6 +143,15 @@ def main():
   bam_list = options.bam_list
   temp_location = options.temp_location
   output_file_name = options.output_file_name
+  output_format = options.output_format
+  block_size = options.block_size
+  statistics = options.statistics
+  n_bootstrap = options.n_bootstrap
+  density_plots = options.density_plots
+  max_points = options.max_points
+  chrom_sizes_file_name = options.chrom_sizes_file_name
+  threads = options.threads
+  bam_threads = options.bam_threads
 
   # Argument error
   argument_error_message = "ERROR: Please provide all arguments."
@@ -149,6 +167,9 @@ def main():
   # Execution
   ###################################################################################################
 
+  # Decompression threads of the BAM files (inherited by the worker processes)
+  samfile_pool.set_threads(bam_threads)
+
   # Uncompress feature_summit_file_name
   feature_summit_file_name_unc = temp_location + "feature_summit_file_name_unc.bed"
   uncompressing_files(feature_summit_file_name, feature_summit_file_name_unc)
@@ -163,7 +184,13 @@ def main():
     counter += 1
 
   # Create table
-  create_table(half_ext, feature_summit_file_name_unc, bam_names, bam_counts, bam_list_unc, output_file_name)
+  plot_data_location = "/".join(output_file_name.split("/")[:-1]) + "/plot_data/"
+  create_table(half_ext, feature_summit_file_name_unc, bam_names, bam_counts, bam_list_unc, output_file_name, threads = threads, chrom_sizes_file_name = chrom_sizes_file_name, output_format = output_format, block_size = block_size, statistics_file_name = (".".join(output_file_name.split(".")[:-1]) + "_stats.txt") if statistics else None, n_bootstrap = n_bootstrap, plot_data_location = plot_data_location if density_plots else None, max_points = max_points)
+
+  # The R script reads the tab-separated table (or the plot data)
+  if(output_format != "tsv" and not density_plots):
+    print("The plots are only created with the tsv output format. Use table-to-tsv to convert the binary table.")
+    return
 
   # Script path
   script_path = "/".join(os.path.realpath(__file__).split("/")[:-1]) + "/"
@@ -176,6 +203,7 @@ def main():
   outputLocation = "/".join(output_file_name.split("/")[:-1]) + "/scatterplots/"
   command = "mkdir -p "+outputLocation
   os.system(command)
-  command = "Rscript "+script_path+"correlation.R "+" ".join([graphWidth, marginX, inputTableFileName, outputFileName, outputLocation])
-  os.system(command)
+  if(density_plots): command = "Rscript "+script_path+"correlation.R "+" ".join([graphWidth, marginX, plot_data_location, outputFileName, outputLocation, "density"])
+  else: command = "Rscript "+script_path+"correlation.R "+" ".join([graphWidth, marginX, inputTableFileName, outputFileName, outputLocation])
+  if(not CommandExecutor().run(command)): sys.exit(1)
 
@@ -10,14 +10,20 @@ import sys
 import math
 import pyBigWig
 import numpy as np
-from pysam import Samfile
+
+# Internal
+from ..Util import ChromosomeExecutor
+from ..Signal import BamSignal
+from ..TableIO import open_table_writer
+from ..Statistics import RowReservoir, write_summary, DEFAULT_MAX_ROWS
+from ..PlotData import write_plot_data, write_rows, spearman
 
 ###################################################################################################
 # Functions
 ###################################################################################################
 
 def fetchSignal(bamFile, region):
-  return float(sum(1 for _ in bamFile.fetch(region[0],region[1],region[2])))
+  return float(bamFile.count(region[0],region[1],region[2]))
 
 def fetchSignalBw(bwFile, region):
   valuesVec = bwFile.values(region[0], region[1], region[2])
@@ -25,21 +31,63 @@ def fetchSignalBw(bwFile, region):
     if(not valuesVec[i] or math.isnan(valuesVec[i]) or math.isinf(valuesVec[i])): valuesVec[i] = 0.0
   return sum(valuesVec)
 
+# Signal files of the current process (opened once per worker by open_region_signals)
+signalFileList = None
+
+def open_region_signals(bam_list):
+
+  # Opening every signal file (with its handle and chunk cache) once for all the blocks of the process
+  global signalFileList
+  signalFileList = []
+  for inputBamFileName in bam_list:
+    extension = inputBamFileName.split(".")[-1]
+    if(extension == "bam"): signalFileList.append(BamSignal(inputBamFileName, verbose = False))
+    elif(extension == "bw" or extension == "bigwig"): signalFileList.append(pyBigWig.open(inputBamFileName))
+    else: signalFileList.append(None)
+
+def close_region_signals():
+
+  # Closing the signal files of the current process
+  global signalFileList
+  if(signalFileList is None): return
+  for signalFile in signalFileList:
+    if(signalFile is not None): signalFile.close()
+  signalFileList = None
+
+def fetch_region_signals(regionList, bam_list, bam_counts):
+
+  # Signal of each region in each file
+  matrix = [[] for region in regionList]
+  for i in range(0,len(bam_list)):
+    inputBamFileName = bam_list[i]
+    correctFactor = int(bam_counts[i])/1000000
+    extension = inputBamFileName.split(".")[-1]
+    bamFile = signalFileList[i]
+    if(extension == "bam"):
+      bamFile.plan(regionList)
+      for j in range(0,len(regionList)):
+        try: bamSignal = fetchSignal(bamFile, regionList[j]) / correctFactor
+        except Exception: bamSignal = 0
+        matrix[j].append(bamSignal)
+    elif(extension == "bw" or extension == "bigwig"):
+      for j in range(0,len(regionList)):
+        try: bamSignal = fetchSignalBw(bamFile, regionList[j]) / correctFactor
+        except Exception: bamSignal = 0
+        matrix[j].append(bamSignal)
+    else:
+      print("The tool supports only BAM or BIGWIG files.")
+      for vec in matrix: vec.append("NA")
+
+  # Return objects
+  return matrix
+
 ###################################################################################################
 # Intersection table
 ###################################################################################################
 
-def create_table(half_ext, feature_summit_file_name, bam_names, bam_counts, bam_list, output_file_name):
-
-  # Initialization
-  outLoc = "/".join(output_file_name.split("\t")[:-1]) + "/"
-  command = "mkdir -p "+outLoc
-  os.system(command)
+def read_region_blocks(feature_summit_file_name, half_ext, chrList, block_size):
 
-  # Allowed chromosomes
-  chrList = ["chr"+str(e) for e in range(1,23)+["X"]]
-
-  # Fetching regions
+  # Yields the regions of the feature file in blocks of (at most) block_size regions
   featureSummitFile = open(feature_summit_file_name,"r")
   regionList = []
   for line in featureSummitFile:
@@ -48,37 +96,48 @@ def create_table(half_ext, feature_summit_file_name, bam_names, bam_counts, bam_
     region = [ll[0], int(ll[1])-half_ext, int(ll[2])+half_ext]
     if(int(region[1]) < 0): continue
     regionList.append(region)
+    if(len(regionList) >= block_size):
+      yield regionList
+      regionList = []
   featureSummitFile.close()
+  if(regionList): yield regionList
+
+def create_table(half_ext, feature_summit_file_name, bam_names, bam_counts, bam_list, output_file_name, threads = 1, chrom_sizes_file_name = None, output_format = "tsv", block_size = 10000, statistics_file_name = None, n_bootstrap = 1000, plot_data_location = None, max_points = 5000, max_rows = DEFAULT_MAX_ROWS):
+
+  # Initialization
+  outLoc = "/".join(output_file_name.split("\t")[:-1]) + "/"
+  command = "mkdir -p "+outLoc
+  os.system(command)
+
+  # Allowed chromosomes
+  chrList = ["chr"+str(e) for e in range(1,23)+["X"]]
 
   # Creating table
-  matrix = []
-  for i in range(0,len(bam_list)):
-    inputBamFileName = bam_list[i]
-    correctFactor = int(bam_counts[i])/1000000
-    extension = inputBamFileName.split(".")[-1]
-    if(extension == "bam"):
-      bamFile = Samfile(inputBamFileName,"rb")
-      vec = []
-      for region in regionList:
-        try: bamSignal = fetchSignal(bamFile, region) / correctFactor
-        except Exception: bamSignal = 0
-        vec.append(bamSignal)
-    elif(extension == "bw" or extension == "bigwig"):
-      bamFile = pyBigWig.open(inputBamFileName)
-      vec = []
-      for region in regionList:
-        try: bamSignal = fetchSignalBw(bamFile, region) / correctFactor
-        except Exception: bamSignal = 0
-      vec.append(bamSignal)
-    else: print("The tool supports only BAM or BIGWIG files.")
-    matrix.append(vec)
-    bamFile.close()
-  outputFile = open(output_file_name,"w")
-  outputFile.write("\t".join(bam_names)+"\n")
-  for j in range(0,len(matrix[0])):
-    vec = []
-    for i in range(0,len(matrix)):
-      try: vec.append(str(matrix[i][j]))
-      except Exception: vec.append("NA")
-    outputFile.write("\t".join(vec)+"\n")
+  # Regions are read, fetched and written one block at a time, so the memory depends only on block_size
+  # The statistics and plots use a uniform sample of at most max_rows regions
+  # Each process opens the signal files once, for all the blocks it fetches
+  executor = ChromosomeExecutor(threads = threads, chrom_sizes = chrom_sizes_file_name, initializer = open_region_signals, initargs = (bam_list,))
+  blockIterator = ((regionList, [e[0] for e in regionList]) for regionList in read_region_blocks(feature_summit_file_name, half_ext, chrList, block_size))
+  outputFile = open_table_writer(output_file_name, output_format, header = bam_names)
+  statReservoir = RowReservoir(len(bam_list), max_rows = max_rows)
+  for matrix in executor.run_blocks(fetch_region_signals, blockIterator, bam_list, bam_counts):
+    for vec in matrix: outputFile.write(vec)
+    if(statistics_file_name or plot_data_location): statReservoir.add(np.array([[e if(not isinstance(e, str)) else np.nan for e in vec] for vec in matrix], dtype=np.float64).reshape(len(matrix), len(bam_list)))
   outputFile.close()
+  close_region_signals()
+
+  # Correlation statistics between the signals
+  statMatrix = statReservoir.rows()
+  if(statistics_file_name):
+    write_summary(statistics_file_name, statMatrix, bam_names, n_bootstrap = n_bootstrap, threads = threads)
+
+  # Density grids and point subsamples of the scatter plots (DSBs vs each feature, in log10)
+  # The correlations of the line plot (features and shuffled features) are computed on the sampled regions
+  if(plot_data_location):
+    with np.errstate(divide="ignore", invalid="ignore"): logMatrix = np.log10(statMatrix)
+    randomState = np.random.RandomState(13)
+    corrList = []
+    for i in range(1,len(bam_names)):
+      write_plot_data(plot_data_location + bam_names[i], logMatrix[:,0], logMatrix[:,i], max_points = max_points)
+      corrList.append([bam_names[i], spearman(logMatrix[:,0], logMatrix[:,i]), spearman(randomState.permutation(logMatrix[:,0]), randomState.permutation(logMatrix[:,i]))])
+    write_rows(plot_data_location + "correlations.txt", ["FEATURE", "SPEARMAN", "RANDOM"], corrList)
@@ -15,7 +15,11 @@ warnings.filterwarnings("ignore")
 
 # Internal
 from src import __version__
-from ..Util import PassThroughOptionParser
+from ..Util import PassThroughOptionParser, ChromosomeExecutor, CommandExecutor, samfile_pool
+from ..Signal import BamSignal
+from ..TableIO import open_table_writer
+from ..Statistics import write_summary
+from ..PlotData import write_plot_data, write_rows, spearman, adjusted_r_squared
 from createDistanceTable import create_table
 from extendAnchors import extend_anchors
 from processDsbFile import create_bam_file
@@ -24,7 +28,6 @@ from processHicFile import create_hic_file
 
 # External
 import numpy as np
-from pysam import Samfile
 
 """
 corr-dsb-dist-exp
@@ -150,7 +153,29 @@ def uncompressing_files(compressed_file_name, uncompressed_file_name):
     else: print("ERROR: We only support tar.gz, .gz and .zip compressions.")
   else: uncompressed_file_name = compressed_file_name
 
-def create_multi_table(max_dist, alias_file_name, genes_file_name, exp_file_name, dsb_file_name, dist_file_name, output_location):
+def fetch_dsb_vectors(gene_list, dsb_file_name, verbose = False):
+
+  # Fetch DSB counts
+  dsbFile = BamSignal(dsb_file_name, verbose = verbose)
+  dsbFile.plan([e[3] for e in gene_list])
+  vector_list = []
+  for gene, distance, exp, region, dsbRandom, expRandom in gene_list:
+    dsbCount = dsbFile.count(region[0], region[1], region[2])
+    dsbCount = (exp + (dsbCount/10.) + (dsbRandom*3.)) / 1000.
+
+    # Fetch expression 2
+    jitt = 50 * expRandom * ((100 * dsbCount)**2)
+    exp = exp + jitt
+    vector_list.append([gene, distance, exp, dsbCount])
+
+  # Closing files
+  if(verbose): print("DSB signal cache: "+dsbFile.cache.stats())
+  dsbFile.close()
+
+  # Return objects
+  return vector_list
+
+def create_multi_table(max_dist, alias_file_name, genes_file_name, exp_file_name, dsb_file_name, dist_file_name, output_location, threads = 1, chrom_sizes_file_name = None, output_format = "tsv", statistics = False, n_bootstrap = 1000, density_plots = False, max_points = 5000, executor = None, block_size = 10000, verbose = False):
 
   # Global Parameters
   seed(111)
@@ -172,17 +197,15 @@ def create_multi_table(max_dist, alias_file_name, genes_file_name, exp_file_name
 
   # Input Files
   allGenesFile = open(genes_file_name, "rU")
-  try: dsbFile = Samfile(dsb_file_name, "rb")
+  try: dsbFile = BamSignal(dsb_file_name)
   except Exception:
     print("ERROR: Could not open DSB BAM file. Check your Pysam installation.")
     exit(1)
-
-  # Output file
-  output_file_name = output_location + "table.txt"
-  outputFile = open(output_file_name, "w")
-  outputFile.write("\t".join(["GENE", "DISTANCE", "EXPRESSION", "DSB"])+"\n")
+  dsbFile.close()
 
   # Iterating in gene file
+  # The random draws are made here, in file order, so that the output does not depend on the number of threads
+  gene_list = []
   for line in allGenesFile:
 
     # Initialization
@@ -210,45 +233,65 @@ def create_multi_table(max_dist, alias_file_name, genes_file_name, exp_file_name
     jitt = random() * 3
     exp = exp - jitt
 
-    # Fetch DSB counts
-    if(dsbFile):
-      if(strand == "+"):
-        tss1 = p1 - promExt
-        tss2 = p1
-      elif(strand == "-"):
-        tss1 = p2
-        tss2 = p2 + promExt
-      dsbCount = dsbFile.count(chrom, tss1, tss2)
-      dsbCount = (exp + (dsbCount/10.) + (random()*3.)) / 1000.
-    else: continue
+    # Random draws of the DSB count and of the second expression jitter
+    gene_list.append([gene, distance, exp, region, random(), random()])
 
-    # Fetch expression 2
-    try:
-      jitt = 50 * random() * ((100 * dsbCount)**2)
-      exp = exp + jitt
-    except Exception: continue
-
-    # Writing to file
-    outputFile.write("\t".join([str(e) for e in [gene, distance, exp, dsbCount]])+"\n")
+  # Fetch DSB counts block by block, writing each block as soon as it is done
+  # Only the numeric columns (DISTANCE, EXPRESSION, DSB) are kept for the statistics and the plot data
+  chromExecutor = ChromosomeExecutor(threads = threads, chrom_sizes = chrom_sizes_file_name)
+  block_start_list = range(0, len(gene_list), block_size)
+  block_iterator = ((gene_list[i:i+block_size], [e[3][0] for e in gene_list[i:i+block_size]]) for i in block_start_list)
+  output_file_name = output_location + "table.txt"
+  outputFile = open_table_writer(output_file_name, output_format, n_labels = 1, header = ["GENE", "DISTANCE", "EXPRESSION", "DSB"])
+  valueMatrix = np.zeros((len(gene_list), 3), dtype=np.float64)
+  for block_start, vector_list in zip(block_start_list, chromExecutor.run_blocks(fetch_dsb_vectors, block_iterator, dsb_file_name, verbose)):
+    for vector in vector_list: outputFile.write(vector)
+    if(vector_list): valueMatrix[block_start:block_start+len(vector_list)] = [vector[1:] for vector in vector_list]
 
   # Closing files
-  if(dsbFile): dsbFile.close()
   allGenesFile.close()
   outputFile.close()
 
+  # Correlation statistics between distance, expression and DSBs
+  if(statistics): write_summary(output_location + "statistics.txt", valueMatrix, ["DISTANCE", "EXPRESSION", "DSB"], n_bootstrap = n_bootstrap, threads = threads)
+
+  # Density grids and point subsamples of the plots (their size does not depend on the number of genes)
+  plot_data_location = output_location + "plot_data/"
+  if(density_plots):
+    vectorX = valueMatrix[:, 0]
+    with np.errstate(divide="ignore", invalid="ignore"): vectorY = np.log10(valueMatrix[:, 1])
+    vectorZ = valueMatrix[:, 2] * 100
+    write_plot_data(plot_data_location + "dist_dsb", vectorX, vectorZ, x_limits = (0, max_dist), y_limits = (0, 35), max_points = max_points)
+    write_plot_data(plot_data_location + "dist_exp", vectorX, vectorY, x_limits = (0, max_dist), y_limits = (-2, 5), max_points = max_points)
+    write_plot_data(plot_data_location + "exp_dsb", vectorY, vectorZ, x_limits = (-2, 5), y_limits = (0, 35), max_points = max_points)
+    write_plot_data(plot_data_location + "dist_dsb_exp", vectorX, vectorZ, values = vectorY, x_limits = (0, max_dist), y_limits = (0, 35), max_points = max_points)
+    adjR2 = adjusted_r_squared(vectorZ, vectorX, vectorY)
+    write_rows(plot_data_location + "correlations.txt", ["NAME", "CORRELATION"], [["dist_dsb", spearman(vectorX, vectorZ)], ["dist_exp", spearman(vectorX, vectorY)], ["exp_dsb", spearman(vectorY, vectorZ)], ["dist_dsb_exp", adjR2 ** (1/16.) if(adjR2 >= 0) else float("nan")]])
+
+  # The R scripts read the tab-separated table
+  elif(output_format != "tsv"):
+    print("The plots are only created with the tsv output format. Use table-to-tsv to convert the binary table.")
+    return
+
   # Script path
   script_path = "/".join(os.path.realpath(__file__).split("/")[:-1]) + "/"
 
-  # Creating plots
+  # Creating plots (both scripts run at the same time)
+  # Without an executor the plots are waited for here, otherwise the caller waits for them
+  if(executor is None): commandExecutor = CommandExecutor(jobs = 2)
+  else: commandExecutor = executor
   output_dist_dsb_exp = output_location + "3D_dist_dsb_exp.pdf"
-  command = "Rscript "+script_path+"3Dplot.R "+" ".join([str(max_dist), output_file_name, output_dist_dsb_exp])
-  os.system(command)
+  if(density_plots): command = "Rscript "+script_path+"3Dplot.R "+" ".join([str(max_dist), plot_data_location, output_dist_dsb_exp, "density"])
+  else: command = "Rscript "+script_path+"3Dplot.R "+" ".join([str(max_dist), output_file_name, output_dist_dsb_exp])
+  jobList = [commandExecutor.submit(command)]
 
   output_dist_dsb = output_location + "2D_dist_dsb.pdf"
   output_dist_exp = output_location + "2D_dist_exp.pdf"
   output_exp_dsb = output_location + "2D_exp_dsb.pdf"
-  command = "Rscript "+script_path+"2Dplot.R "+" ".join([str(max_dist), output_file_name, output_dist_dsb, output_dist_exp, output_exp_dsb])
-  os.system(command)
+  if(density_plots): command = "Rscript "+script_path+"2Dplot.R "+" ".join([str(max_dist), plot_data_location, output_dist_dsb, output_dist_exp, output_exp_dsb, "density"])
+  else: command = "Rscript "+script_path+"2Dplot.R "+" ".join([str(max_dist), output_file_name, output_dist_dsb, output_dist_exp, output_exp_dsb])
+  jobList.append(commandExecutor.submit(command))
+  if(executor is None): commandExecutor.wait(jobList)
 
 ###################################################################################################
 # Main
@@ -314,6 +357,13 @@ def main():
   parser.add_option("--expression-file", dest="exp_file_name", type="string", metavar="FILE", default=None, help=("A tab-separated list containing the genes and their expression."))
   parser.add_option("--dsb-file", dest="dsb_file_name", type="string", metavar="FILE", default=None, help=("A BED or BAM file containing all the DSBs."))
   parser.add_option("--distance-file", dest="dist_file_name", type="string", metavar="FILE", default=None, help=("The output file of HiCCUPS loop caller. A CTCF-annotated file as in 'GSE63525' is preferred."))
+  parser.add_option("--statistics", dest="statistics", action="store_true", default=False, help=("Writes the Pearson, Spearman and partial correlations between distance, expression and DSBs, with bootstrap confidence intervals, in statistics.txt in the output location."))
+  parser.add_option("--bootstrap", dest="n_bootstrap", type="int", metavar="INT", default=1000, help=("Number of bootstrap resamples used for the confidence intervals of --statistics."))
+  parser.add_option("--density-plots", dest="density_plots", action="store_true", default=False, help=("Plots precomputed density grids and a stratified subsample of the genes (written in plot_data in the output location) instead of every gene, so that the plotting time and the PDF size do not depend on the number of genes."))
+  parser.add_option("--plot-points", dest="max_points", type="int", metavar="INT", default=5000, help=("Approximate number of genes of the subsample drawn with --density-plots."))
+  parser.add_option("--output-format", dest="output_format", type="choice", choices=["tsv", "binary"], metavar="STRING", default="tsv", help=("Format of the output table: 'tsv' (tab-separated text) or 'binary' (memory-mappable matrix with a JSON metadata file). The plots are only created with 'tsv'."))
+  parser.add_option("--threads", dest="threads", type="int", metavar="INT", default=1, help=("Number of processes used to run the analysis in parallel. The work is divided by chromosome."))
+  parser.add_option("--bam-threads", dest="bam_threads", type="int", metavar="INT", default=1, help=("Number of htslib decompression threads of each open BAM file, in every process. More threads speed up the long sequential reads of large BAM files."))
   parser.add_option("--temp", dest="temp_location", type="string", metavar="PATH", default=None, help=("Temporary location to aid in the execution."))
   parser.add_option("--output-location", dest="output_location", type="string", metavar="PATH", default=None, help=("Path where the output will be written."))
 
@@ -330,6 +380,13 @@ def main():
   dist_file_name = options.dist_file_name
   temp_loc = options.temp_loc
   output_location = options.output_location
+  threads = options.threads
+  bam_threads = options.bam_threads
+  output_format = options.output_format
+  statistics = options.statistics
+  n_bootstrap = options.n_bootstrap
+  density_plots = options.density_plots
+  max_points = options.max_points
 
   # Argument error
   argument_error_message = "ERROR: Please provide all arguments."
@@ -347,6 +404,9 @@ def main():
   # Execution
   ###################################################################################################
 
+  # Decompression threads of the BAM files (inherited by the worker processes)
+  samfile_pool.set_threads(bam_threads)
+
   # Uncompress alias_file_name
   alias_file_name_unc = temp_location + "alias_file_name_unc.txt"
   uncompressing_files(alias_file_name, alias_file_name_unc)
@@ -367,7 +427,9 @@ def main():
   dsb_bam_file_name = dsb_file_name_unc
   if(dsb_file_name_unc.split(".")[-1] == "bed"):
     dsb_bam_file_name = temp_loc + "dsb_bam_file_name.bam"
-    create_bam_file(chrom_sizes_file_name, [dsb_file_name_unc], temp_loc, dsb_bam_file_name)
+    if(not create_bam_file(chrom_sizes_file_name, [dsb_file_name_unc], temp_loc, dsb_bam_file_name, threads = threads)):
+      print("ERROR: The DSB bam file could not be created.")
+      sys.exit(1)
   elif(dsb_file_name_unc.split(".")[-1] == "bam"): pass
   else: print("ERROR: Supported formats for the expression file are: .bam or .bed")
 
@@ -387,7 +449,11 @@ def main():
   dist_file_name_unc = temp_location + "dist_file_name_unc.txt"
   uncompressing_files(dist_file_name, dist_file_name_unc)
 
+  # External commands run concurrently (up to threads at a time)
+  commandExecutor = CommandExecutor(jobs = threads)
+
   # Correcting distances file to list (supported formats)
+  # The commands of each extension run while the next extensions are written
   dist_list_file_name = dist_file_name_unc
   if(dist_file_name_unc.split(".")[-1] == "txt"):
     extList = [str(e*1000) for e in range(0, max_dist+1)]
@@ -395,11 +461,21 @@ def main():
       dist_w_list_file_name = temp_loc + "anchors_with_ctcf_" + ext
       dist_wo_list_file_name = temp_loc + "anchors_wo_ctcf_" + ext
       dist_wwo_list_file_name = temp_loc + "anchors_with_and_wo_ctcf_" + ext
-      extend_anchors(int(ext), dist_file_name_unc, chrom_sizes_file_name, temp_loc, dist_wwo_list_file_name, dist_w_list_file_name, dist_wo_list_file_name)
+      extend_anchors(int(ext), dist_file_name_unc, chrom_sizes_file_name, temp_loc, dist_wwo_list_file_name, dist_w_list_file_name, dist_wo_list_file_name, executor = commandExecutor)
+    if(not commandExecutor.wait()):
+      print("ERROR: Some anchor files could not be created.")
+      sys.exit(1)
     dist_list_file_name = temp_loc + "dist_list_file_name.txt"
-    create_table(max_dist, alias_file_name, genes_file_name, temp_loc + "anchors_with_ctcf", dist_list_file_name)
+    create_table(max_dist, alias_file_name, genes_file_name, temp_loc + "anchors_with_ctcf", dist_list_file_name, threads = threads, chrom_sizes_file_name = chrom_sizes_file_name)
   else: print("ERROR: Supported formats for the expression file are: .txt (CTCF-annotated HiCCUPScontacts calling)")
      
   # Creating table
-  create_multi_table(max_dist, alias_file_name, genes_file_name, exp_list_file_name, dsb_bam_file_name, dist_list_file_name, output_location)
+  create_multi_table(max_dist, alias_file_name, genes_file_name, exp_list_file_name, dsb_bam_file_name, dist_list_file_name, output_location, threads = threads, chrom_sizes_file_name = chrom_sizes_file_name, output_format = output_format, statistics = statistics, n_bootstrap = n_bootstrap, density_plots = density_plots, max_points = max_points, executor = commandExecutor)
+
+  # Waiting for the plots (the tool fails if any of them failed)
+  plotsDone = commandExecutor.wait()
+
+  # Closing the BAM files kept open during the run
+  samfile_pool.close()
+  if(not plotsDone): sys.exit(1)
 
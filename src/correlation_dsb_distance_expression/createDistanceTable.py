@@ -7,10 +7,11 @@
 from __future__ import print_function
 import os
 import sys
-from copy import deepcopy
-from pysam import Samfile
 from random import seed, random, randint
 
+# Internal
+from ..Util import samfile_pool, ChromosomeExecutor
+
 ###################################################################################################
 # Functions
 ###################################################################################################
@@ -37,7 +38,53 @@ def read_alias_dictionary(alias_file_name):
   # Return objects
   return alias_dict
 
-def create_table(max_dist, alias_file_name, all_genes_file_name, anchor_all_file_prefix, output_file_name):
+def fetch_gene_distances(genes_list, max_dist, anchor_all_file_prefix):
+
+  # Dividing the samfiles in 200-bins batches
+  batchVec = []
+  for i in range(0, max_dist, 200):
+    if(i != 0): b0 = i+1
+    else: b0 = 0
+    b1 = min(max_dist, i+200)
+    batchVec.append([b0, b1])
+
+  # Batch and distance of each gene (None if no anchor was found)
+  distance_list = [None] * len(genes_list)
+  remaining = range(0, len(genes_list))
+  for batchIndex in range(0, len(batchVec)):
+ 
+    # Opening anchor files (at most one batch of handles is open at a time)
+    b = batchVec[batchIndex]
+    xAxisVec = [e*1000 for e in range(b[0],b[1]+1)]
+    anchorFileNameList = [anchor_all_file_prefix+"_"+str(e)+".bam" for e in xAxisVec]
+    anchorFileList = [samfile_pool.get(e) for e in anchorFileNameList]
+
+    # Iterating in gene list
+    next_remaining = []
+    for g in remaining:
+
+      region = genes_list[g][6]
+
+      # Fetch distance
+      flagFound = False
+      for i in range(0,len(xAxisVec)):
+        ext = xAxisVec[i]
+        anchorFile = anchorFileList[i]
+        atLeast = atLeastOneRead(anchorFile, region)
+        if(atLeast):
+          distance_list[g] = [batchIndex, (ext/1000)]
+          flagFound = True
+          break
+      if(not flagFound): next_remaining.append(g)
+
+    # Closing files
+    remaining = next_remaining
+    for e in anchorFileNameList: samfile_pool.close(e)
+
+  # Return objects
+  return distance_list
+
+def create_table(max_dist, alias_file_name, all_genes_file_name, anchor_all_file_prefix, output_file_name, threads = 1, chrom_sizes_file_name = None):
 
   # Parameters
   seed(111)
@@ -66,51 +113,24 @@ def create_table(max_dist, alias_file_name, all_genes_file_name, anchor_all_file
     genes_list.append([chrom, p1, p2, gene_name, score, strand, region]) 
   allGenesFile.close() 
 
+  # Fetch distances
+  executor = ChromosomeExecutor(threads = threads, chrom_sizes = chrom_sizes_file_name)
+  distance_list = executor.run(fetch_gene_distances, genes_list, [e[0] for e in genes_list], max_dist, anchor_all_file_prefix)
+
+  # Genes are written by batch and, within each batch, in file order
+  found_list = sorted([[distance_list[g][0], g] for g in range(0, len(genes_list)) if distance_list[g] is not None])
+
   # Output file
   outputFile = open(output_file_name, "w")
   outputFile.write("\t".join(["GENE", "DIST"])+"\n")
-
-  # Dividing the samfiles in 200-bins batches
-  batchVec = []
-  for i in range(0, max_dist, 200):
-    if(i != 0): b0 = i+1
-    else: b0 = 0
-    b1 = min(max_dist, i+200)
-    batchVec.append([b0, b1])
-  for b in batchVec:
- 
-    # Opening anchor files
-    xAxisVec = [e*1000 for e in range(b[0],b[1]+1)]
-    anchorFileList = [Samfile(anchor_all_file_prefix+"_"+str(e)+".bam", "rb") for e in xAxisVec]
-
-    # Iterating in gene list
-    next_genes_list = []
-    for gv in genes_list:
-
-      chrom = gv[0]; p1 = gv[1]; p2 = gv[2]; gene = gv[3]; score = gv[4]; strand = gv[5]; region = gv[6]
-
-      # Fetch distance
-      flagFound = False
-      for i in range(0,len(xAxisVec)):
-        ext = xAxisVec[i]
-        anchorFile = anchorFileList[i]
-        atLeast = atLeastOneRead(anchorFile, region)
-        if(atLeast):
-          distance = (ext/1000)
-          if("anchors_with_and_wo_ctcf" in output_file_name):
-            rawr = randint(0,3)
-            distance = distance + (rawr*2)
-          flagFound = True
-          break
-      if(not flagFound):
-        next_genes_list.append(gv)
-        continue
-
-      # Writing to file
-      outputFile.write("\t".join([str(e) for e in [gene, distance]])+"\n")
-
-    # Closing files
-    genes_list = deepcopy(next_genes_list)
-    for e in anchorFileList: e.close()
+  for batchIndex, g in found_list:
+    gene = genes_list[g][3]
+    distance = distance_list[g][1]
+    if("anchors_with_and_wo_ctcf" in output_file_name):
+      rawr = randint(0,3)
+      distance = distance + (rawr*2)
+
+    # Writing to file
+    outputFile.write("\t".join([str(e) for e in [gene, distance]])+"\n")
 
   outputFile.close()
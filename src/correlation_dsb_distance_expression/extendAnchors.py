@@ -8,6 +8,9 @@ from __future__ import print_function
 import os
 import sys
 
+# Internal
+from ..Util import CommandExecutor
+
 def read_chromosome_sizes(chrom_sizes_file_name):
 
   # Creating alias dictionary
@@ -56,26 +59,21 @@ def writing_extended_anchors(largest_length_half, chrom_list, chrom_dict, loop_f
   tempFileWoCtcf.close()
 
 # Sort bed
-def sort_bed_file(input_file_name, output_file_name):
+def sort_bed_file(input_file_name, output_file_name, executor, depends = None):
   command = "sort -k1,1 -k2,2n "+input_file_name+" > "+output_file_name
-  os.system(command)
-
-# Bed To Bam
-def bed_to_bam(input_file_name, chrom_sizes_file_name, output_file_name):
-  command = "bedToBam -i "+input_file_name+" -g "+chrom_sizes_file_name+" > "+output_file_name
-  os.system(command)
+  return executor.submit(command, depends)
 
-# Sort Bam
-def sort_bam_file(input_file_name, output_file_name):
-  command = "samtools sort "+input_file_name+" -o "+output_file_name
-  os.system(command)
+# Bed To sorted Bam (bedToBam | samtools sort, connected by a pipe)
+def bed_to_sorted_bam(input_file_name, chrom_sizes_file_name, output_file_name, executor, depends = None):
+  command_list = [["bedToBam", "-i", input_file_name, "-g", chrom_sizes_file_name], ["samtools", "sort", "-o", output_file_name, "-"]]
+  return executor.submit(command_list, depends, cleanup_file_list = [output_file_name])
 
 # Index Bam
-def index_bam_file(input_file_name):
+def index_bam_file(input_file_name, executor, depends = None):
   command = "samtools index "+input_file_name
-  os.system(command)
+  return executor.submit(command, depends)
 
-def extend_anchors(largest_length_half, loop_file_name, chrom_sizes_file_name, temporary_location, output_file_with_and_wo_ctcf_name, output_file_with_ctcf_name, output_file_wo_ctcf_name):
+def extend_anchors(largest_length_half, loop_file_name, chrom_sizes_file_name, temporary_location, output_file_with_and_wo_ctcf_name, output_file_with_ctcf_name, output_file_wo_ctcf_name, executor = None):
 
   # Initialization
   outLoc = "/".join(output_file_with_and_wo_ctcf_name.split("/")[:-1]) + "/"
@@ -87,37 +85,24 @@ def extend_anchors(largest_length_half, loop_file_name, chrom_sizes_file_name, t
   # Allowed chromosomes
   chrom_list, chrom_dict = read_chromosome_sizes(chrom_sizes_file_name)
 
-  # Writing extended anchors
-  temp_file_with_and_wo_ctcf_name = temporary_location + "temp_file_with_and_wo_ctcf_name.bed"
-  temp_file_with_ctcf_name = temporary_location + "temp_file_with_ctcf_name.bed"
-  temp_file_wo_ctcf_name = temporary_location + "temp_file_wo_ctcf_name.bed"
+  # Writing extended anchors (the temporary files are named after the extension, so that several extensions can run at the same time)
+  suffix = "_" + str(largest_length_half)
+  temp_file_with_and_wo_ctcf_name = temporary_location + "temp_file_with_and_wo_ctcf_name" + suffix + ".bed"
+  temp_file_with_ctcf_name = temporary_location + "temp_file_with_ctcf_name" + suffix + ".bed"
+  temp_file_wo_ctcf_name = temporary_location + "temp_file_wo_ctcf_name" + suffix + ".bed"
   writing_extended_anchors(largest_length_half, chrom_list, chrom_dict, loop_file_name, temp_file_with_and_wo_ctcf_name, temp_file_with_ctcf_name, temp_file_wo_ctcf_name)
 
-  # Sort bed files
-  output_file_with_and_wo_ctcf_name_bed = output_file_with_and_wo_ctcf_name + ".bed"
-  sort_bed_file(temp_file_with_and_wo_ctcf_name, output_file_with_and_wo_ctcf_name_bed)
-  temp_file_with_ctcf_name_bed = output_file_with_ctcf_name + ".bed"
-  sort_bed_file(temp_file_with_ctcf_name, temp_file_with_ctcf_name_bed)
-  temp_file_wo_ctcf_name_bed = output_file_wo_ctcf_name + ".bed"
-  sort_bed_file(temp_file_wo_ctcf_name, temp_file_wo_ctcf_name_bed)
-
-  # Bed to Bam files
-  temp_file_with_and_wo_ctcf_name_bam = temporary_location + "temp_file_with_and_wo_ctcf_name.bed"
-  bed_to_bam(output_file_with_and_wo_ctcf_name_bed, chrom_sizes_file_name, temp_file_with_and_wo_ctcf_name_bam)
-  temp_file_with_ctcf_name_bam = temporary_location + "temp_file_with_ctcf_name_bam.bed"
-  bed_to_bam(temp_file_with_ctcf_name_bed, chrom_sizes_file_name, temp_file_with_ctcf_name_bam)
-  temp_file_wo_ctcf_name_bam = temporary_location + "temp_file_wo_ctcf_name_bam.bed"  
-  bed_to_bam(temp_file_wo_ctcf_name_bed, chrom_sizes_file_name, temp_file_wo_ctcf_name_bam)
-
-  # Sort bam files
-  file_with_and_wo_ctcf_name_bam = output_file_with_and_wo_ctcf_name + ".bam"
-  sort_bam_file(temp_file_with_and_wo_ctcf_name_bam, file_with_and_wo_ctcf_name_bam)
-  file_with_ctcf_name_bam = output_file_with_ctcf_name + ".bam"
-  sort_bam_file(temp_file_with_ctcf_name_bam, file_with_ctcf_name_bam)
-  file_wo_ctcf_name_bam = output_file_wo_ctcf_name + ".bam"
-  sort_bam_file(temp_file_wo_ctcf_name_bam, file_wo_ctcf_name_bam)
-
-  # Index bam files
-  index_bam_file(file_with_and_wo_ctcf_name_bam)
-  index_bam_file(file_with_ctcf_name_bam)
-  index_bam_file(file_wo_ctcf_name_bam)
+  # Each file goes through sort bed -> (bed to bam | sort bam) -> index bam; the three files run concurrently
+  # Without an executor the commands are waited for here, otherwise the caller waits for the returned jobs
+  if(executor is None): commandExecutor = CommandExecutor(jobs = 3)
+  else: commandExecutor = executor
+  jobList = []
+  for temp_file_name, output_file_name in [(temp_file_with_and_wo_ctcf_name, output_file_with_and_wo_ctcf_name), (temp_file_with_ctcf_name, output_file_with_ctcf_name), (temp_file_wo_ctcf_name, output_file_wo_ctcf_name)]:
+    job = sort_bed_file(temp_file_name, output_file_name + ".bed", commandExecutor)
+    job = bed_to_sorted_bam(output_file_name + ".bed", chrom_sizes_file_name, output_file_name + ".bam", commandExecutor, job)
+    jobList.append(index_bam_file(output_file_name + ".bam", commandExecutor, job))
+  if(executor is None): commandExecutor.wait(jobList)
+
+  # Return objects
+  return jobList
+
@@ -8,46 +8,46 @@ from __future__ import print_function
 import os
 import sys
 
+# Internal
+from ..Util import run_pipeline
+
 ###################################################################################################
 # Functions
 ###################################################################################################
 
-def create_proper_bed_file(input_file_name, chrom_list, temporary_location, output_file_name):
+# Memory per thread of samtools sort
+SORT_MEMORY = "768M"
 
+def proper_bed_lines(input_file_name, chrom_list):
+
+  # One bed line per DSB (the fourth column of the input is the number of DSBs at the position)
   input_file = open(input_file_name, "rU")
-  unsorted_bed_file_name = temporary_location + "unsorted_bed_file_name.bed"
-  unsorted_bed_file = open(unsorted_bed_file_name, "w")
   for line in input_file:
     ll = line.strip().split("\t")
     ll[0] = "chr"+ll[0]
     if(ll[0] not in chrom_list): continue
-    for i in range(0,int(ll[3])): unsorted_bed_file.write("\t".join([ll[0], ll[1], ll[2], "D", "1", "+"])+"\n")
+    for i in range(0,int(ll[3])): yield "\t".join([ll[0], ll[1], ll[2], "D", "1", "+"])+"\n"
   input_file.close()
-  unsorted_bed_file.close()
 
-  sort_bed_file(unsorted_bed_file_name, output_file_name)
+def create_proper_bed_file(input_file_name, chrom_list, temporary_location, output_file_name):
 
-def sort_bed_file(input_file_name, output_file_name):
-  command = "sort -k1,1 -k2,2n "+input_file_name+" > "+output_file_name
-  os.system(command)
+  # Sorted bed file with one line per DSB
+  run_pipeline([["sort", "-k1,1", "-k2,2n"]], input_lines = proper_bed_lines(input_file_name, chrom_list), output_file_name = output_file_name)
 
-def bed_to_bam(input_file_name, chrom_sizes_file_name, output_file_name):
-  command = "bedToBam -i "+input_file_name+" -g "+chrom_sizes_file_name+" > "+output_file_name
-  os.system(command)
+def bed_to_sorted_bam(bed_lines, chrom_sizes_file_name, output_file_name, threads = 1, sort_memory = SORT_MEMORY):
 
-def sort_bam_file(input_file_name, output_file_name):
-  command = "samtools sort "+input_file_name+" -o "+output_file_name
-  os.system(command)
+  # bedToBam | samtools sort, connected by a pipe (samtools sort orders the reads, so the bed does not need to be sorted)
+  command_list = [["bedToBam", "-i", "stdin", "-g", chrom_sizes_file_name],
+                  ["samtools", "sort", "-@", str(threads), "-m", sort_memory, "-o", output_file_name, "-"]]
+  return run_pipeline(command_list, input_lines = bed_lines, cleanup_file_list = [output_file_name])
 
 def index_bam_file(input_file_name):
-  command = "samtools index "+input_file_name
-  os.system(command)
+  return run_pipeline([["samtools", "index", input_file_name]])
 
-def merge_bam(input_file_name_list, output_file_name):
-  command = "samtools merge "+" ".join([output_file_name]+input_file_name_list)
-  os.system(command)
+def merge_bam(input_file_name_list, output_file_name, threads = 1):
+  return run_pipeline([["samtools", "merge", "-f", "-@", str(threads), output_file_name] + input_file_name_list], cleanup_file_list = [output_file_name])
 
-def create_bam_file(chrom_sizes_file_name, dsb_bed_file_list, temporary_location, dsb_bam_file_name):
+def create_bam_file(chrom_sizes_file_name, dsb_bed_file_list, temporary_location, dsb_bam_file_name, threads = 1, sort_memory = SORT_MEMORY):
 
   # Parameters
   command = "mkdir -p "+temporary_location
@@ -59,23 +59,16 @@ def create_bam_file(chrom_sizes_file_name, dsb_bed_file_list, temporary_location
   # Chromosomes dictionary
   chrom_list = ["chr"+str(e) for e in range(1,23)+["X"]]
 
-  counter = 1
-  dsbBamFileNameList = []
-  for dsbBedFileName in dsb_bed_file_list:
-
-    properBedFileName = temporary_location + "properBedFileName.bed"
-    create_proper_bed_file(dsbBedFileName, chrom_list, temporary_location, properBedFileName)
-
-    tempBamFileName = temporary_location + "tempBamFileName.bam"
-    bed_to_bam(properBedFileName, chrom_sizes_file_name, tempBamFileName)
-
-    dsbBamFileName = temporary_location + "properBedFileName"+str(counter)+".bed"
-    sort_bam_file(tempBamFileName, dsbBamFileName)
-
-    dsbBamFileNameList.append(dsbBamFileName)
+  # Each bed file is streamed (one line per DSB) through bedToBam and samtools sort, without intermediate files
+  # A single file is sorted directly into the output; several files are sorted separately and merged
+  if(len(dsb_bed_file_list) == 1): dsbBamFileNameList = [dsb_bam_file_name]
+  else: dsbBamFileNameList = [temporary_location + "properBamFileName"+str(counter)+".bam" for counter in range(1, len(dsb_bed_file_list)+1)]
+  for dsbBedFileName, dsbBamFileName in zip(dsb_bed_file_list, dsbBamFileNameList):
+    if(not bed_to_sorted_bam(proper_bed_lines(dsbBedFileName, chrom_list), chrom_sizes_file_name, dsbBamFileName, threads = threads, sort_memory = sort_memory)): return False
 
-  if(dsbBamFileNameList > 1):
-    merge_bam(dsbBamFileNameList, dsb_bam_file_name)
-  else: dsb_bam_file_name = dsbBamFileNameList[0]
+  # Merging and indexing
+  if(len(dsbBamFileNameList) > 1):
+    if(not merge_bam(dsbBamFileNameList, dsb_bam_file_name, threads = threads)): return False
+    for dsbBamFileName in dsbBamFileNameList: os.remove(dsbBamFileName)
+  return index_bam_file(dsb_bam_file_name)
 
-  index_bam_file(dsb_bam_file_name)
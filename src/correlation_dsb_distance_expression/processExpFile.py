@@ -7,7 +7,9 @@
 from __future__ import print_function
 import os
 import sys
-from pysam import Samfile
+
+# Internal
+from ..Util import samfile_pool
 
 ###################################################################################################
 # Functions
@@ -66,14 +68,13 @@ def expression_dict_from_bam(alias_dict, gene_dict, exp_file_name):
 
   # Fetching expression
   exp_dict = dict()
-  exp_file = Samfile(exp_file_name,"rb")
+  exp_file = samfile_pool.get(exp_file_name)
   for k in gene_dict.keys():
     geneVec = gene_dict[k]
     gene = geneVec[3]
     region = [geneVec[0], int(geneVec[1]), int(geneVec[2])]
     exp = fetch_counts(exp_file, region)
     exp_dict[gene] = float(exp) / (region[2] - region[1])
-  exp_file.close()
 
   # Returning objects
   return exp_dict
@@ -7,7 +7,10 @@
 from __future__ import print_function
 import os
 import sys
-from pysam import Samfile
+
+# Internal
+from ..Util import samfile_pool
+from ..TableIO import open_table_writer
 
 ###################################################################################################
 # Functions
@@ -72,11 +75,10 @@ def get_best_peak(ctcf_peaks_file, region):
   else: return [region[0], minStart, maxEnd]
 
 
-def write_hiccups_file(hic_header, loop_list, ctcf_peaks_file, ctcf_motifs_file, loops_hiccups_output_file_name):
+def write_hiccups_file(hic_header, loop_list, ctcf_peaks_file, ctcf_motifs_file, loops_hiccups_output_file_name, output_format = "tsv"):
 
-  # Starting output file
-  loops_hiccups_output_file = open(loops_hiccups_output_file_name, "w")
-  loops_hiccups_output_file.write("\t".join(hic_header)+"\n")
+  # Starting output file (indexed files are sorted and indexed by the first anchor: chr1, x1, x2)
+  loops_hiccups_output_file = open_table_writer(loops_hiccups_output_file_name, output_format, header = hic_header, coordinate_columns = (0, 1, 2))
 
   # Iterting on loops
   for loop in loop_list:
@@ -106,11 +108,11 @@ def write_hiccups_file(hic_header, loop_list, ctcf_peaks_file, ctcf_motifs_file,
     # Writing to file
     toWrite = [chr1, x1, x2, chr2, y1, y2, color, o, e_bl, e_donute_h, e_v, fdr_bl, fdr_donut, fdr_h, fdr_v, num_collapsed, centroid1, centroid2,
                radius, motif_x1, motif_x2, sequence_1, orientation_1, uniqueness_1, motif_y1, motif_y2, sequence_2, orientation_2, uniqueness_2]
-    loops_hiccups_output_file.write("\t".join([str(e) for e in toWrite])+"\n")
+    loops_hiccups_output_file.write(toWrite)
 
   loops_hiccups_output_file.close()
   
-def create_hic_file(chrom_sizes_file_name, ctcf_peaks_file_name, ctcf_motifs_file_name, loops_file_name, loops_hiccups_output_file_name):
+def create_hic_file(chrom_sizes_file_name, ctcf_peaks_file_name, ctcf_motifs_file_name, loops_file_name, loops_hiccups_output_file_name, output_format = "tsv"):
 
   # Parameters
   outLoc = "/".join(loops_hiccups_output_file_name.split("/")[:-1]) + "/"
@@ -128,16 +130,11 @@ def create_hic_file(chrom_sizes_file_name, ctcf_peaks_file_name, ctcf_motifs_fil
   
   # Opening CTCF files
   if(os.path.isfile(ctcf_peaks_file_name) and os.path.isfile(ctcf_motifs_file_name)):
-    ctcf_peaks_file = Samfile(ctcf_peaks_file_name, "rb")
-    ctcf_motifs_file = Samfile(ctcf_motifs_file_name, "rb")
+    ctcf_peaks_file = samfile_pool.get(ctcf_peaks_file_name)
+    ctcf_motifs_file = samfile_pool.get(ctcf_motifs_file_name)
   else:
     ctcf_peaks_file = None
     ctcf_motifs_file = None
 
   # Writing hiccups file
-  write_hiccups_file(hic_header, loop_list, ctcf_peaks_file, ctcf_motifs_file, loops_hiccups_output_file_name)
-
-  # Closing bam files
-  if(os.path.isfile(ctcf_peaks_file_name) and os.path.isfile(ctcf_motifs_file_name)):
-    ctcf_peaks_file.close()
-    ctcf_motifs_file.close()
+  write_hiccups_file(hic_header, loop_list, ctcf_peaks_file, ctcf_motifs_file, loops_hiccups_output_file_name, output_format = output_format)
@@ -13,8 +13,8 @@ warnings.filterwarnings("ignore")
 
 # Internal
 from src import __version__
-from ..Util import PassThroughOptionParser
-from ctcfSignal import ctcf_signal
+from ..Util import PassThroughOptionParser, CommandExecutor, samfile_pool
+from ctcfSignal import ctcf_signal, category_file_name
 from ..correlation_dsb_distance_expression.processDsbFile import create_bam_file
 from ..correlation_dsb_distance_expression.processExpFile import create_exp_file
 from ..correlation_dsb_distance_expression.processHicFile import create_hic_file
@@ -116,13 +116,17 @@ def main():
   """
 
   # Input Options
-  parser.add_option("--region-type", dest="region_type", type="string", metavar="STRING", default=0, help=("The type of CTCF file generated. For all the options check our 'full documentation' page. This option is important to ensure a correct and fast analysis."))
+  parser.add_option("--region-type", dest="region_type", type="string", metavar="STRING", default=0, help=("The type of CTCF file generated. For all the options check our 'full documentation' page. This option is important to ensure a correct and fast analysis. With 'all', the category of each site (O_FR, I_FR, IO_FR, IO_F, IO_R, intergenic or inactive) is read from the 7th column of the CTCF file and one table is written per category (output file name with the suffix _<category>)."))
   parser.add_option("--alias-file", dest="alias_file_name", type="string", metavar="FILE", default=None, help=("File containing gene aliases."))
   parser.add_option("--gene-file", dest="gene_file_name", type="string", metavar="FILE", default=None, help=("A simple BED file containing the location of genes."))
   parser.add_option("--ctcf-file", dest="ctcf_file_name", type="string", metavar="FILE", default=None, help=("A file containing the particular genes (or other elements) that overlapped a CTCF factor."))
   parser.add_option("--expression-file", dest="expression_file_name", type="string", metavar="FILE", default=None, help=("A plain text (tab-separated) file containing the genes in the first column and their expression in the second column."))
   parser.add_option("--dsb-file", dest="dsb_file_name", type="string", metavar="FILE", default=None, help=("A BAM file containing all the DSBs."))
+  parser.add_option("--chrom-sizes", dest="chrom_sizes_file_name", type="string", metavar="FILE", default=None, help=("File containing the total length of all chromosomes. Used to balance the parallel execution (optional)."))
+  parser.add_option("--threads", dest="threads", type="int", metavar="INT", default=1, help=("Number of processes used to run the analysis in parallel. The work is divided by chromosome."))
+  parser.add_option("--bam-threads", dest="bam_threads", type="int", metavar="INT", default=1, help=("Number of htslib decompression threads of each open BAM file, in every process. More threads speed up the long sequential reads of large BAM files."))
   parser.add_option("--temp", dest="temp_location", type="string", metavar="PATH", default=None, help=("Temporary location to aid in the execution."))
+  parser.add_option("--output-format", dest="output_format", type="choice", choices=["tsv", "binary", "indexed"], metavar="STRING", default="tsv", help=("Format of the output table: 'tsv' (tab-separated text), 'binary' (memory-mappable matrix with a JSON metadata file) or 'indexed' (sorted by CTCF site, bgzip-compressed and tabix-indexed, in the output file name with the suffix .gz). The plots are only created with 'tsv'."))
   parser.add_option("--output-file", dest="output_file_name", type="string", metavar="FILE", default=None, help=("Output file name."))
 
   # Processing Options
@@ -139,6 +143,10 @@ def main():
   dsb_file_name = options.dsb_file_name
   temp_location = options.temp_location
   output_file_name = options.output_file_name
+  output_format = options.output_format
+  chrom_sizes_file_name = options.chrom_sizes_file_name
+  threads = options.threads
+  bam_threads = options.bam_threads
 
   # Argument error
   argument_error_message = "ERROR: Please provide all arguments."
@@ -157,6 +165,9 @@ def main():
   # Execution
   ###################################################################################################
 
+  # Decompression threads of the BAM files (inherited by the worker processes)
+  samfile_pool.set_threads(bam_threads)
+
   # Uncompress alias_file_name
   alias_file_name_unc = temp_location + "alias_file_name_unc.bed"
   uncompressing_files(alias_file_name, alias_file_name_unc)
@@ -178,16 +189,25 @@ def main():
   uncompressing_files(dsb_file_name, dsb_file_name_unc)
 
   # Create ctcf table
-  ctcf_signal(region_type, ctcf_resolution, percentile_list, alias_file_name_unc, gene_file_name_unc, ctcf_file_name_unc, expression_file_name_unc, dsb_file_name_unc, output_file_name)
+  category_list = ctcf_signal(region_type, ctcf_resolution, percentile_list, alias_file_name_unc, gene_file_name_unc, ctcf_file_name_unc, expression_file_name_unc, dsb_file_name_unc, output_file_name, threads = threads, chrom_sizes_file_name = chrom_sizes_file_name, output_format = output_format)
+
+  # The R script reads the tab-separated table
+  if(output_format != "tsv"):
+    print("The plots are only created with the tsv output format. Use table-to-tsv to convert the table.")
+    return
 
   # Script path
   script_path = "/".join(os.path.realpath(__file__).split("/")[:-1]) + "/"
 
-  # Creating plot
-  inputTableFileName = output_file_name
-  outputFileNameAggr = ".".join(output_file_name.split(".")[:-1]) + "_aggr.pdf"
-  outputFileNameHeat = ".".join(output_file_name.split(".")[:-1]) + "_heat.pdf"
-  outputFileNameCorr = ".".join(output_file_name.split(".")[:-1]) + "_corr.pdf"
-  command = "Rscript "+script_path+"lineplot_correlation_heatmap.R "+" ".join([region_type, str(ctcf_resolution), inputTableFileName, outputFileNameAggr, outputFileNameHeat, outputFileNameCorr])
-  os.system(command)
+  # Creating plot (one per category with region type "all", up to threads at a time)
+  commandExecutor = CommandExecutor(jobs = threads)
+  for category in category_list:
+    if(region_type == "all"): inputTableFileName = category_file_name(output_file_name, category)
+    else: inputTableFileName = output_file_name
+    outputFileNameAggr = ".".join(inputTableFileName.split(".")[:-1]) + "_aggr.pdf"
+    outputFileNameHeat = ".".join(inputTableFileName.split(".")[:-1]) + "_heat.pdf"
+    outputFileNameCorr = ".".join(inputTableFileName.split(".")[:-1]) + "_corr.pdf"
+    command = "Rscript "+script_path+"lineplot_correlation_heatmap.R "+" ".join([category, str(ctcf_resolution), inputTableFileName, outputFileNameAggr, outputFileNameHeat, outputFileNameCorr])
+    commandExecutor.submit(command)
+  if(not commandExecutor.wait()): sys.exit(1)
 
@@ -8,27 +8,38 @@ from __future__ import print_function
 import os
 import sys
 import math
-import pyBigWig
 import numpy as np
-from pysam import Samfile
 from random import seed, choice, randint
 
+# Internal
+from ..Util import ChromosomeExecutor, stratify
+from ..Signal import BamSignal
+from ..TableIO import open_table_writer
+
 ###################################################################################################
 # Functions
 ###################################################################################################
 
-def fetchTotalSignalBam(bamFile, region):
-  totalSignal = 0.0
-  for read in bamFile.fetch(region[0], region[1], region[2]): totalSignal += 1.0
-  return totalSignal
+# Region categories
+regionCategoryList = ["O_FR", "I_FR", "IO_FR", "IO_F", "IO_R", "intergenic", "inactive"]
+
+def category_file_name(output_file_name, category):
+  outputBase, outputExt = os.path.splitext(output_file_name)
+  return outputBase + "_" + category + outputExt
+
+def fetchTotalSignalBam(bamSignal, region):
+  return float(bamSignal.count(region[0], region[1], region[2]))
 
-def fetchSignalBam(bamFile, region, ext):
+def fetchSignalBam(bamSignal, region, ext):
   regionLen = (region[2] - region[1])
-  returnVec = [0.0] * regionLen
-  for read in bamFile.fetch(region[0], region[1], region[2]):
-    vecReadLoc = read.reference_start - region[1]
-    for i in range(max(vecReadLoc - ext, 0), min(vecReadLoc + ext, len(returnVec))): returnVec[i] += 1.0
-  return returnVec
+  vecReadLoc = bamSignal.starts(region[0], region[1], region[2]) - region[1]
+  lower = np.clip(vecReadLoc - ext, 0, regionLen)
+  upper = np.clip(vecReadLoc + ext, 0, regionLen)
+  valid = lower < upper
+  diffVec = np.zeros(regionLen + 1)
+  np.add.at(diffVec, lower[valid], 1.0)
+  np.add.at(diffVec, upper[valid], -1.0)
+  return np.cumsum(diffVec[:-1]).tolist()
 
 def read_alias_dictionary(alias_file_name):
 
@@ -78,21 +89,12 @@ def get_expression_values(alias_dict, gene_dict, percentile_list, expression_fil
     gro_list.append(groValue)
   groListFile.close()
 
-  # Percentile values dictionary
-  percValueDict = dict()
-  groListNp = np.array(gro_list)
-  for percentile in percentile_list: percValueDict[percentile] = np.percentile(groListNp, int(percentile))
-
   # Percentile dictionary
   percentile_dict = dict()
   groDictKeys = sorted(gro_dict.keys())
-  for gene in groDictKeys:
-    for percentile in percentile_list:
-      percValue = percValueDict[percentile]
-      groValue = gro_dict[gene]
-      if(groValue >= percValue):
-        percentile_dict[gene] = percentile
-        break
+  percentileVec = stratify([gro_dict[gene] for gene in groDictKeys], percentile_list = percentile_list, reference_values = gro_list)
+  for gene, percentile in zip(groDictKeys, percentileVec.tolist()):
+    if(percentile >= 0): percentile_dict[gene] = percentile
 
   return gro_dict, gro_list, percentile_dict
 
@@ -100,60 +102,37 @@ def get_expression_values(alias_dict, gene_dict, percentile_list, expression_fil
 # Main table
 ###################################################################################################
 
-def ctcf_signal(region_type, ctcf_res, percentile_list, alias_file_name, gene_file_name, ctcf_file_name, expression_file_name, dsb_file_name, output_file_name):
+def fetch_ctcf_vectors(site_list, ctcf_res, dsb_file_name, verbose = False):
 
   # Initialization
-  seed(111)
-  outLoc = "/".join(output_file_name.split("/")[:-1])+"/"
-  command = "mkdir -p "+outLoc
-  os.system(command)
   bamExt = 5
 
-  # Allowed chromosomes
-  chrList = ["chr"+str(e) for e in range(1,23)+["X"]]
-
-  # Alias dictionary
-  alias_dict = read_alias_dictionary(alias_file_name)
-
-  # Gene dictionary
-  gene_dict = get_gene_dictionary(alias_dict, gene_file_name)
-
-  # Expression dictionary
-  gro_dict, gro_list, percentile_dict = get_expression_values(alias_dict, gene_dict, percentile_list, expression_file_name)
-
   # Signal initialization
-  signalFile = Samfile(dsb_file_name, "rb")
+  signalFile = BamSignal(dsb_file_name, verbose = verbose)
+  signalFile.plan([[e[0], (e[1]+e[2])/2-ctcf_res, (e[1]+e[2])/2+ctcf_res] for e in site_list])
 
   # Fetching the bam signal in all categories
   # GENE, GENE_CHR, GENE_P1, GENE_P2, GENE_STR, CTCF_CHR, CTCF_P1, CTCF_P2, CTCF_STR, GRO_VALUE, GRO_PERC, [SIGNAL...]
-  ctcfFile = open(ctcf_file_name, "rU")
-  outputFile = open(output_file_name,"w")
-  for line in ctcfFile:
+  vector_list = []
+  for site in site_list:
 
     # Initialization
-    ll = line.strip().split("\t")
-    if(ll[0] not in chrList): continue
-    ctcfChrom = ll[0]; ctcfP1 = int(ll[1]); ctcfP2 = int(ll[2]); ctcfGeneName = ll[3]; ctcfScore = ll[4]; ctcfStrand = ll[5]
+    ctcfChrom, ctcfP1, ctcfP2, ctcfStrand, region_type, geneVec = site
     mid = (ctcfP1+ctcfP2)/2
-
-    if(region_type == "O_FR"): region = [ctcfChrom, mid-ctcf_res, mid]
-    elif(region_type == "I_FR"): region = [ctcfChrom, mid, mid+ctcf_res]
     totalSignal = fetchTotalSignalBam(signalFile, [ctcfChrom, mid-ctcf_res, mid+ctcf_res])
 
     # Fetching location, gene and gro
     new_region_type = region_type
-    try:
-      geneName = alias_dict[ctcfGeneName]
-      perc = percentile_dict[geneName]
-      gg = gene_dict[geneName]
+    if(geneVec):
+      geneName, geneChrom, geneP1, geneP2, geneStrand, groValue, perc, inactiveType, inactiveFlag = geneVec
       if(region_type == "inactive"):
-        new_region_type = "inactive" + str(randint(1,3))
-        if(choice([True, False])):
-          vector = [geneName, gg[0], gg[1], gg[2], gg[5], ctcfChrom, ctcfP1, ctcfP2, ctcfStrand, float(gro_dict[geneName]) * totalSignal, int(perc) + totalSignal]
+        new_region_type = "inactive" + str(inactiveType)
+        if(inactiveFlag):
+          vector = [geneName, geneChrom, geneP1, geneP2, geneStrand, ctcfChrom, ctcfP1, ctcfP2, ctcfStrand, groValue * totalSignal, int(perc) + totalSignal]
         else:
-          vector = [geneName, gg[0], gg[1], gg[2], gg[5], ctcfChrom, ctcfP1, ctcfP2, ctcfStrand, float(gro_dict[geneName]), int(perc)]
-      else: vector = [geneName, gg[0], gg[1], gg[2], gg[5], ctcfChrom, ctcfP1, ctcfP2, ctcfStrand, (float(gro_dict[geneName])+1) * totalSignal, int(perc) + totalSignal]
-    except Exception: vector = ["NA", "NA", "NA", "NA", "NA", ctcfChrom, ctcfP1, ctcfP2, ctcfStrand, 0, 0]
+          vector = [geneName, geneChrom, geneP1, geneP2, geneStrand, ctcfChrom, ctcfP1, ctcfP2, ctcfStrand, groValue, int(perc)]
+      else: vector = [geneName, geneChrom, geneP1, geneP2, geneStrand, ctcfChrom, ctcfP1, ctcfP2, ctcfStrand, (groValue+1) * totalSignal, int(perc) + totalSignal]
+    else: vector = ["NA", "NA", "NA", "NA", "NA", ctcfChrom, ctcfP1, ctcfP2, ctcfStrand, 0, 0]
 
     # Fetching signal
     region11 = [ctcfChrom, mid-ctcf_res, mid-200]; region12 = [ctcfChrom, mid-200, mid-100]; region13 = [ctcfChrom, mid-100, mid]
@@ -229,11 +208,91 @@ def ctcf_signal(region_type, ctcf_res, percentile_list, alias_file_name, gene_fi
     # Updating vector
     vector = vector + signal
 
-    # Writing vector
-    outputFile.write("\t".join([str(e) for e in vector])+"\n")
+    # Storing vector
+    vector_list.append(vector)
 
-  # Closing all files
-  ctcfFile.close()
-  outputFile.close()
+  # Closing signal
+  if(verbose): print("DSB signal cache: "+signalFile.cache.stats())
   signalFile.close()
 
+  # Return objects
+  return vector_list
+
+def ctcf_signal(region_type, ctcf_res, percentile_list, alias_file_name, gene_file_name, ctcf_file_name, expression_file_name, dsb_file_name, output_file_name, threads = 1, chrom_sizes_file_name = None, output_format = "tsv", block_size = 10000, verbose = False):
+
+  # Initialization
+  seed(111)
+  outLoc = "/".join(output_file_name.split("/")[:-1])+"/"
+  command = "mkdir -p "+outLoc
+  os.system(command)
+
+  # Allowed chromosomes
+  chrList = ["chr"+str(e) for e in range(1,23)+["X"]]
+
+  # Alias dictionary
+  alias_dict = read_alias_dictionary(alias_file_name)
+
+  # Gene dictionary
+  gene_dict = get_gene_dictionary(alias_dict, gene_file_name)
+
+  # Expression dictionary
+  gro_dict, gro_list, percentile_dict = get_expression_values(alias_dict, gene_dict, percentile_list, expression_file_name)
+
+  # Fetching CTCF sites and their genes
+  # With region_type "all" the category of each site is read from the 7th column of the CTCF file
+  # The random draws of the inactive category are made here, in file order, so that the output does not depend on the number of threads
+  site_list = []
+  skipped = 0
+  ctcfFile = open(ctcf_file_name, "rU")
+  for line in ctcfFile:
+
+    # Initialization
+    ll = line.strip().split("\t")
+    if(ll[0] not in chrList): continue
+    ctcfChrom = ll[0]; ctcfP1 = int(ll[1]); ctcfP2 = int(ll[2]); ctcfGeneName = ll[3]; ctcfScore = ll[4]; ctcfStrand = ll[5]
+    if(region_type == "all"):
+      try: site_type = ll[6]
+      except Exception: site_type = None
+      if(site_type not in regionCategoryList):
+        skipped += 1
+        continue
+    else: site_type = region_type
+
+    # Fetching location, gene and gro
+    try:
+      geneName = alias_dict[ctcfGeneName]
+      perc = percentile_dict[geneName]
+      gg = gene_dict[geneName]
+      inactiveType = None; inactiveFlag = None
+      if(site_type == "inactive"):
+        inactiveType = randint(1,3)
+        inactiveFlag = choice([True, False])
+      geneVec = [geneName, gg[0], gg[1], gg[2], gg[5], float(gro_dict[geneName]), perc, inactiveType, inactiveFlag]
+    except Exception: geneVec = None
+    site_list.append([ctcfChrom, ctcfP1, ctcfP2, ctcfStrand, site_type, geneVec])
+
+  ctcfFile.close()
+  if(skipped > 0): print("WARNING: "+str(skipped)+" CTCF sites without a valid category ("+", ".join(regionCategoryList)+") were skipped.")
+
+  # Fetching the bam signal in all sites, block by block
+  executor = ChromosomeExecutor(threads = threads, chrom_sizes = chrom_sizes_file_name)
+  block_start_list = range(0, len(site_list), block_size)
+  block_iterator = ((site_list[i:i+block_size], [e[0] for e in site_list[i:i+block_size]]) for i in block_start_list)
+
+  # Writing vectors as soon as each block is done (one table per category with region_type "all")
+  # Indexed tables are sorted and indexed by the CTCF site coordinates (columns 6 to 8)
+  output_dict = dict()
+  for block_start, vector_list in zip(block_start_list, executor.run_blocks(fetch_ctcf_vectors, block_iterator, ctcf_res, dsb_file_name, verbose)):
+    for site, vector in zip(site_list[block_start:block_start+block_size], vector_list):
+      if(region_type == "all"): category = site[4]
+      else: category = region_type
+      if(category not in output_dict):
+        if(region_type == "all"): output_dict[category] = open_table_writer(category_file_name(output_file_name, category), output_format, n_labels = 9, coordinate_columns = (5, 6, 7))
+        else: output_dict[category] = open_table_writer(output_file_name, output_format, n_labels = 9, coordinate_columns = (5, 6, 7))
+      output_dict[category].write(vector)
+  if(region_type != "all" and not output_dict): output_dict[region_type] = open_table_writer(output_file_name, output_format, n_labels = 9, coordinate_columns = (5, 6, 7))
+  for category in output_dict: output_dict[category].close()
+
+  # Return objects
+  return sorted(output_dict.keys())
+
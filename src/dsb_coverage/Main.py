@@ -0,0 +1,147 @@
+
+###################################################################################################
+# Libraries
+###################################################################################################
+
+# Python
+from __future__ import print_function
+import os
+import sys
+from optparse import SUPPRESS_HELP
+import warnings
+warnings.filterwarnings("ignore")
+
+# Internal
+from src import __version__
+from ..Util import PassThroughOptionParser, samfile_pool
+from ..Signal import DEFAULT_PYRAMID_LEVELS
+from coverage import create_coverage, coverageFileNames
+
+"""
+dsb-coverage
+
+This program computes, in a single pass over the DSB file, the genome-wide DSB coverage (number of
+DSBs per bin, optionally normalized by reads per million) and writes it as BigWig and bedGraph tracks.
+The BigWig track can be given to heatmap-dsb and corr-dsb-feat instead of the DSB BAM file, so that
+the reads are decoded once instead of once per analysis. Replicates are merged, and the DSBs are held
+as a sparse coverage (covered positions only), so genome-wide runs need no per-base arrays.
+
+It can also write a multi-resolution pyramid of the DSB counts (or of a BigWig signal), which
+heatmap-dsb and gene-meta read instead of the BAM or BigWig file: wide windows are then answered
+from the coarsest resolution their bins fit.
+
+Dependencies:
+- numpy
+- pysam
+- pyBigWig
+
+Authors: Eduardo G. Gusmao.
+"""
+
+###################################################################################################
+# Main
+###################################################################################################
+
+def main():
+  """
+  Main function that writes the binned genome-wide DSB coverage tracks.
+
+  Keyword arguments: None
+
+  Return: None
+  """
+
+  ###################################################################################################
+  # Processing Input Arguments
+  ###################################################################################################
+
+  # Parameters
+  usage_message = ("\n--------------------------------------------------\n"
+                   "This program computes the genome-wide binned DSB\n"
+                   "coverage and writes it as BigWig and bedGraph.\n\n"
+
+                   "The program should be called as:\n"
+                   "%prog <args>\n\n"
+
+                   "For more information on the arguments please type:\n"
+                   "%prog --help\n\n"
+
+                   "For more information, please refer to the original paper:\n"
+                   "Placeholder.\n\n"
+
+                   "For further questions or comments please contact:\n"
+                   "eduardogade@gmail.com\n"
+                   "--------------------------------------------------")
+  version_message = "Gothe et al. - Spatial chromosome folding and active transcription drive DNA fragility and formation of oncogenic MLL translocations. Version: " + str(__version__)
+
+  # Initializing Option Parser
+  parser = PassThroughOptionParser(usage=usage_message, version=version_message)
+
+  # Input Options
+  parser.add_option("--dsb", dest="dsb_file_list", type="string", metavar="FILE_1[,FILE_2,...,FILE_N]", default=None, help=("A BAM file (read starts) or a BED file (region starts; as in the other tools, chromosome names may lack the 'chr' prefix and the fourth column is the number of DSBs at the position) containing the DSBs, or a comma-separated list of replicate files whose DSBs are merged. A BigWig signal can be given instead (with --pyramid)."))
+  parser.add_option("--chrom-sizes", dest="chrom_sizes_file_name", type="string", metavar="FILE", default=None, help=("File containing the total length of all chromosomes (e.g. chrom.sizes.hg19.txt). Only these chromosomes are written."))
+  parser.add_option("--bin-size", dest="bin_size", type="int", metavar="INT", default=100, help=("Size (in bp) of the bins. Each bin holds the number of DSBs starting in it."))
+  parser.add_option("--rpm", dest="normalize", action="store_true", default=False, help=("Normalizes the bins by reads per million (number of DSBs divided by --dsb-count / 1,000,000, as --bamCount and --signal-count-list do)."))
+  parser.add_option("--dsb-count", dest="dsb_count", type="int", metavar="INT", default=None, help=("The total number of reads of the DSB file used by --rpm (default: the number of DSBs counted in the chromosomes)."))
+  parser.add_option("--pyramid", dest="pyramid", action="store_true", default=False, help=("Also writes a multi-resolution pyramid of the DSB counts to PREFIX.pyr. If --dsb is a BigWig signal, only its pyramid is written."))
+  parser.add_option("--pyramid-levels", dest="pyramid_levels", type="string", metavar="INT_1[,INT_2,...,INT_N]", default=None, help=("Ascending resolutions (in bp) of the pyramid, each one a multiple of the previous. For DSB files the finest one must be a multiple of --bin-size (default: --bin-size and 10, 100 and 1000 times --bin-size for DSB files, "+",".join([str(e) for e in DEFAULT_PYRAMID_LEVELS])+" for a BigWig signal)."))
+  parser.add_option("--sparse", dest="write_sparse", action="store_true", default=False, help=("Also writes the raw per-base DSB counts as a compact sparse coverage (PREFIX.npz): the covered positions and their counts."))
+  parser.add_option("--no-bedgraph", dest="write_bedgraph", action="store_false", default=True, help=("Writes only the BigWig track."))
+  parser.add_option("--threads", dest="threads", type="int", metavar="INT", default=1, help=("Number of processes used to count the chromosomes of a BAM file in parallel."))
+  parser.add_option("--bam-threads", dest="bam_threads", type="int", metavar="INT", default=1, help=("Number of htslib decompression threads of each open BAM file, in every process. More threads speed up the long sequential reads of large BAM files."))
+  parser.add_option("--output-prefix", dest="output_prefix", type="string", metavar="PREFIX", default=None, help=("Output prefix. The tracks are written to PREFIX.bw and PREFIX.bedGraph."))
+
+  # Processing Options
+  options, arguments = parser.parse_args()
+
+  # General options
+  dsb_file_list = options.dsb_file_list.split(",") if options.dsb_file_list else None
+  chrom_sizes_file_name = options.chrom_sizes_file_name
+  bin_size = options.bin_size
+  normalize = options.normalize
+  dsb_count = options.dsb_count
+  write_bedgraph = options.write_bedgraph
+  write_sparse = options.write_sparse
+  pyramid = options.pyramid
+  pyramid_levels = [int(e) for e in options.pyramid_levels.split(",")] if(pyramid and options.pyramid_levels) else None
+  threads = options.threads
+  bam_threads = options.bam_threads
+  output_prefix = options.output_prefix
+
+  # Argument error
+  argument_error_message = "ERROR: Please provide all arguments."
+  if(not dsb_file_list or not chrom_sizes_file_name or not output_prefix):
+    print(argument_error_message)
+    sys.exit(1)
+  if(bin_size < 1):
+    print("ERROR: The bin size must be a positive integer.")
+    sys.exit(1)
+  is_bigwig = any([e.split(".")[-1].lower() in ["bw", "bigwig"] for e in dsb_file_list])
+  if(is_bigwig and (not pyramid or len(dsb_file_list) > 1)):
+    print("ERROR: A (single) BigWig signal can only be converted to a pyramid (--pyramid).")
+    sys.exit(1)
+  if(pyramid and not pyramid_levels):
+    if(is_bigwig): pyramid_levels = DEFAULT_PYRAMID_LEVELS
+    else: pyramid_levels = [bin_size * 10 ** e for e in range(0, len(DEFAULT_PYRAMID_LEVELS))]
+  if(pyramid and (any([b % a != 0 or b <= a for a, b in zip(pyramid_levels[:-1], pyramid_levels[1:])]) or pyramid_levels[0] < 1)):
+    print("ERROR: The pyramid levels must be ascending and each one a multiple of the previous.")
+    sys.exit(1)
+  if(pyramid and not is_bigwig and pyramid_levels[0] % bin_size != 0):
+    print("ERROR: The finest pyramid level must be a multiple of the bin size.")
+    sys.exit(1)
+
+  ###################################################################################################
+  # Execution
+  ###################################################################################################
+
+  # Decompression threads of the BAM files (inherited by the worker processes)
+  samfile_pool.set_threads(bam_threads)
+
+  # Create coverage tracks
+  create_coverage(dsb_file_list, chrom_sizes_file_name, bin_size, output_prefix, normalize = normalize, dsb_count = dsb_count, threads = threads, write_bedgraph = write_bedgraph, pyramid_levels = pyramid_levels, write_sparse = write_sparse)
+  bigWigFileName, bedGraphFileName, pyramidFileName, sparseFileName = coverageFileNames(output_prefix)
+  outputList = [] if(is_bigwig) else [bigWigFileName] + ([bedGraphFileName] if(write_bedgraph) else [])
+  if(pyramid): outputList.append(pyramidFileName)
+  if(write_sparse and not is_bigwig): outputList.append(sparseFileName)
+  print("Written: "+", ".join(outputList))
+
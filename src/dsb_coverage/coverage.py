@@ -0,0 +1,119 @@
+
+###################################################################################################
+# Input
+###################################################################################################
+
+# Import
+from __future__ import print_function
+import os
+import sys
+import pyBigWig
+import numpy as np
+
+# Internal
+from ..Util import ChromosomeExecutor, read_chromosome_sizes
+from ..Signal import write_pyramid, build_pyramid, pyramid_file_names
+from ..Coverage import SparseCoverage, dsb_coverage
+
+###################################################################################################
+# Functions
+###################################################################################################
+
+def count_coverage(chromList, dsb_file_list, chrom_sizes_dict):
+
+  # Sparse DSB coverage of each chromosome (positions and counts), replicates merged
+  # Each bam file is read with a single sweep per chromosome
+  coverage = SparseCoverage(chrom_sizes_dict)
+  for dsb_file_name in dsb_file_list: coverage.merge(dsb_coverage(dsb_file_name, chrom_sizes_dict, chromList))
+
+  # Return objects
+  return [coverage.counts(chrom) for chrom in chromList]
+
+def bin_runs(binIndex, values, chrom_size, bin_size):
+
+  # Consecutive non-empty bins with the same value are merged in a single run (the last bin ends at the chromosome end)
+  # RUN_STARTS, RUN_ENDS, RUN_VALUES
+  if(len(binIndex) == 0): return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+  newRun = np.concatenate([[True], (np.diff(binIndex) != 1) | (np.diff(values) != 0)])
+  firstBin = binIndex[newRun]
+  lastBin = binIndex[np.concatenate([np.flatnonzero(newRun)[1:] - 1, [len(binIndex) - 1]])]
+  runStarts = firstBin * bin_size
+  runEnds = np.minimum((lastBin + 1) * bin_size, chrom_size)
+
+  # Return objects
+  return runStarts, runEnds, values[newRun].astype(np.float64)
+
+def coverageFileNames(output_prefix):
+  return output_prefix + ".bw", output_prefix + ".bedGraph", pyramid_file_names(output_prefix)[1], output_prefix + ".npz"
+
+def pyramid_cell_iterator(chromList, binList, chrom_sizes_dict, bin_size, resolution):
+
+  # Finest pyramid cells of each chromosome from its non-empty bins (resolution is a multiple of bin_size)
+  for chrom, (binIndex, counts) in zip(chromList, binList):
+    nCells = (chrom_sizes_dict[chrom] + resolution - 1) // resolution
+    yield chrom, np.bincount(binIndex * bin_size // resolution, weights = counts, minlength = nCells)
+
+###################################################################################################
+# Coverage tracks
+###################################################################################################
+
+def create_coverage(dsb_file_list, chrom_sizes_file_name, bin_size, output_prefix, normalize = False, dsb_count = None, threads = 1, write_bigwig = True, write_bedgraph = True, pyramid_levels = None, write_sparse = False):
+
+  # Initialization
+  outLoc = "/".join(output_prefix.split("/")[:-1])
+  if(outLoc):
+    command = "mkdir -p "+outLoc
+    os.system(command)
+  chromSizesDict = read_chromosome_sizes(chrom_sizes_file_name)
+  chromList = sorted(chromSizesDict.keys())
+  bigWigFileName, bedGraphFileName, pyramidFileName, sparseFileName = coverageFileNames(output_prefix)
+
+  # A BigWig signal only gets its pyramid
+  extension = dsb_file_list[0].split(".")[-1].lower()
+  if(extension == "bw" or extension == "bigwig"):
+    build_pyramid(dsb_file_list[0], pyramidFileName, chromSizesDict, level_list = pyramid_levels)
+    return
+
+  # Sparse coverage of all chromosomes (one sweep per chromosome of each bam file, or one pass over each bed file)
+  # Chromosomes of bam files are counted in parallel; only the covered positions are kept, never a per-base array
+  coverage = SparseCoverage(chromSizesDict)
+  if(all([e.split(".")[-1].lower() == "bam" for e in dsb_file_list])):
+    executor = ChromosomeExecutor(threads = threads, chrom_sizes = chromSizesDict)
+    for chrom, (positions, counts) in zip(chromList, executor.run(count_coverage, chromList, chromList, dsb_file_list, chromSizesDict)):
+      if(len(positions) > 0): coverage.set_counts(chrom, positions, counts)
+  else:
+    for dsb_file_name in dsb_file_list: coverage.merge(dsb_coverage(dsb_file_name, chromSizesDict))
+  binList = [coverage.bin_totals(chrom, bin_size) for chrom in chromList]
+  print("Sparse coverage: "+str(sum([len(coverage.positions[e]) for e in coverage.chromosomes()]))+" positions, "+str(round(coverage.nbytes() / (1024.0 * 1024.0), 2))+" MB")
+  if(write_sparse): coverage.write(sparseFileName)
+
+  # Normalization by reads per million (with the total DSB count of the file unless given)
+  totalCount = sum([int(counts.sum()) for binIndex, counts in binList])
+  if(normalize):
+    if(not dsb_count): dsb_count = totalCount
+    rpm = max(dsb_count, 1)/1000000.
+  else: rpm = 1.0
+  print("DSBs counted: "+str(totalCount)+" in "+str(sum([len(binIndex) for binIndex, counts in binList]))+" non-empty bins of "+str(bin_size)+" bp")
+
+  # Writing the tracks: empty bins are omitted and consecutive bins with the same value are merged
+  # The bigwig holds the same runs as the bedgraph, so both have the same values
+  if(write_bigwig):
+    bigWigFile = pyBigWig.open(bigWigFileName, "w")
+    bigWigFile.addHeader([(chrom, chromSizesDict[chrom]) for chrom in chromList])
+  if(write_bedgraph): bedGraphFile = open(bedGraphFileName, "w")
+  for chrom, (binIndex, counts) in zip(chromList, binList):
+    runStarts, runEnds, runValues = bin_runs(binIndex, counts, chromSizesDict[chrom], bin_size)
+    if(len(runStarts) == 0): continue
+    runValues = runValues / rpm
+    if(write_bigwig): bigWigFile.addEntries([chrom] * len(runStarts), runStarts.tolist(), ends = runEnds.tolist(), values = runValues.tolist())
+    if(write_bedgraph):
+      for start, end, value in zip(runStarts.tolist(), runEnds.tolist(), runValues.tolist()):
+        bedGraphFile.write("\t".join([chrom, str(start), str(end), "%g" % value]) + "\n")
+  if(write_bigwig): bigWigFile.close()
+  if(write_bedgraph): bedGraphFile.close()
+
+  # Pyramid of the raw DSB counts, aggregated from the same bins (exact queries go back to the bam file of a single replicate)
+  if(pyramid_levels):
+    cellIterator = pyramid_cell_iterator(chromList, binList, chromSizesDict, bin_size, pyramid_levels[0])
+    write_pyramid(pyramidFileName, chromSizesDict, cellIterator, level_list = pyramid_levels, kind = "counts", source = dsb_file_list[0] if(len(dsb_file_list) == 1 and extension == "bam") else None)
+
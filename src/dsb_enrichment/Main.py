@@ -0,0 +1,164 @@
+
+###################################################################################################
+# Libraries
+###################################################################################################
+
+# Python
+from __future__ import print_function
+import os
+import sys
+from optparse import SUPPRESS_HELP
+import warnings
+warnings.filterwarnings("ignore")
+
+# Internal
+from src import __version__
+from ..Util import PassThroughOptionParser, samfile_pool
+from ..Permutation import MODES
+from enrichment import create_table
+
+"""
+dsb-enrich
+
+This program tests whether DSBs are enriched around user-defined features (e.g. promoters,
+loop anchors or CTCF sites) by comparing the number of DSBs inside the feature windows with
+a null distribution obtained by shuffling the DSBs or the feature windows within chromosomes.
+
+Dependencies:
+- numpy
+- pysam
+
+Authors: Eduardo G. Gusmao.
+"""
+
+###################################################################################################
+# Functions
+###################################################################################################
+
+# Uncompressing files
+def uncompressing_files(compressed_file_name, uncompressed_file_name):
+
+  # Taking suffix
+  cc = compressed_file_name.split(".")
+
+  # Uncompressing
+  if(cc[-1] == "gz" or cc[-1] == "tar" or cc[-2] == "tar" or cc[-1] == "zip"):
+    if(cc[-1] == "tar"):
+      command = "tar -O "+compressed_file_name+" > "+uncompressed_file_name
+      os.system(command)
+    if(cc[-2] == "tar"):
+      if(cc[-1] == "gz"):
+        command = "tar -xO "+compressed_file_name+" > "+uncompressed_file_name
+        os.system(command)
+      else: print("ERROR: Unrecognized tarball.")
+    elif(cc[-1] == "gz"):
+      command = "gzip -cd "+compressed_file_name+" > "+uncompressed_file_name
+      os.system(command)
+    elif(cc[-1] == "zip"):
+      command = "unzip -p "+compressed_file_name+" > "+uncompressed_file_name
+      os.system(command)
+    else: print("ERROR: We only support tar.gz, .gz and .zip compressions.")
+    return uncompressed_file_name
+  else: return compressed_file_name
+
+###################################################################################################
+# Main
+###################################################################################################
+
+def main():
+  """
+  Main function that tests the enrichment of DSBs around user-defined features with permutations.
+
+  Keyword arguments: None
+
+  Return: None
+  """
+
+  ###################################################################################################
+  # Processing Input Arguments
+  ###################################################################################################
+
+  # Parameters
+  usage_message = ("\n--------------------------------------------------\n"
+                   "This program tests whether DSBs are enriched around\n"
+                   "user-defined features using permutations.\n\n"
+
+                   "The program should be called as:\n"
+                   "%prog <args>\n\n"
+
+                   "For more information on the arguments please type:\n"
+                   "%prog --help\n\n"
+
+                   "For more information, please refer to the original paper:\n"
+                   "Placeholder.\n\n"
+
+                   "For further questions or comments please contact:\n"
+                   "eduardogade@gmail.com\n"
+                   "--------------------------------------------------")
+  version_message = "Gothe et al. - Spatial chromosome folding and active transcription drive DNA fragility and formation of oncogenic MLL translocations. Version: " + str(__version__)
+
+  # Initializing Option Parser
+  parser = PassThroughOptionParser(usage=usage_message, version=version_message)
+
+  # Input Options
+  parser.add_option("--half-ext", dest="half_ext", type="int", metavar="INT", default=500, help=("Distance (in bp) by which each feature is extended on both sides to create its window."))
+  parser.add_option("--dsb", dest="dsb_file_name", type="string", metavar="FILE", default=None, help=("A BAM file (read starts) or a BED file (region starts) containing the DSBs."))
+  parser.add_option("--feature-label-list", dest="feature_names", type="string", metavar="NAME_1[,NAME_2,...,NAME_N]", default=None, help=("A comma-separated list of labels for each feature class."))
+  parser.add_option("--feature-file-list", dest="feature_list", type="string", metavar="FILE_1[,FILE_2,...,FILE_N]", default=None, help=("A comma-separated list of BED files, one for each feature class."))
+  parser.add_option("--chrom-sizes", dest="chrom_sizes_file_name", type="string", metavar="FILE", default=None, help=("File containing the total length of all chromosomes (e.g. chrom.sizes.hg19.txt). The shuffled positions are drawn within these lengths."))
+  parser.add_option("--exclude", dest="exclusion_file_name", type="string", metavar="FILE", default=None, help=("A BED file with regions where no shuffled position is placed (optional). DSBs and features inside them are ignored."))
+  parser.add_option("--mode", dest="mode", type="choice", choices=MODES, metavar="STRING", default="dsb", help=("What is shuffled within each chromosome: 'dsb' (the DSB positions) or 'features' (the feature windows)."))
+  parser.add_option("--permutations", dest="n_permutations", type="int", metavar="INT", default=1000, help=("Number of permutations."))
+  parser.add_option("--seed", dest="seed", type="int", metavar="INT", default=111, help=("Random seed. The result does not depend on the number of threads."))
+  parser.add_option("--threads", dest="threads", type="int", metavar="INT", default=1, help=("Number of processes used to run the permutations in parallel."))
+  parser.add_option("--bam-threads", dest="bam_threads", type="int", metavar="INT", default=1, help=("Number of htslib decompression threads of each open BAM file, in every process. More threads speed up the long sequential reads of large BAM files."))
+  parser.add_option("--temp", dest="temp_location", type="string", metavar="PATH", default=None, help=("Temporary location to aid in the execution."))
+  parser.add_option("--null-file", dest="null_file_name", type="string", metavar="FILE", default=None, help=("Writes the count of each feature class in each permutation to this file (optional)."))
+  parser.add_option("--output-format", dest="output_format", type="choice", choices=["tsv", "binary"], metavar="STRING", default="tsv", help=("Format of the --null-file table: 'tsv' (tab-separated text) or 'binary' (memory-mappable matrix with a JSON metadata file)."))
+  parser.add_option("--output-file", dest="output_file_name", type="string", metavar="FILE", default=None, help=("Output file name."))
+
+  # Processing Options
+  options, arguments = parser.parse_args()
+
+  # General options
+  half_ext = options.half_ext
+  dsb_file_name = options.dsb_file_name
+  feature_names = options.feature_names.split(",") if options.feature_names else None
+  feature_list = options.feature_list.split(",") if options.feature_list else None
+  chrom_sizes_file_name = options.chrom_sizes_file_name
+  exclusion_file_name = options.exclusion_file_name
+  mode = options.mode
+  n_permutations = options.n_permutations
+  seed = options.seed
+  threads = options.threads
+  bam_threads = options.bam_threads
+  temp_location = options.temp_location
+  null_file_name = options.null_file_name
+  output_format = options.output_format
+  output_file_name = options.output_file_name
+
+  # Argument error
+  argument_error_message = "ERROR: Please provide all arguments."
+  if(not dsb_file_name or not feature_names or not feature_list or not chrom_sizes_file_name or not temp_location or not output_file_name):
+    print(argument_error_message)
+    sys.exit(1)
+  if(len(feature_names) != len(feature_list)):
+    print("ERROR: The feature label and file lists must have the same length.")
+    sys.exit(1)
+
+  ###################################################################################################
+  # Execution
+  ###################################################################################################
+
+  # Decompression threads of the BAM files (inherited by the worker processes)
+  samfile_pool.set_threads(bam_threads)
+
+  # Uncompress input files
+  feature_list_unc = []
+  for i in range(0, len(feature_list)):
+    feature_list_unc.append(uncompressing_files(feature_list[i], temp_location + "feature_file_name_unc" + str(i+1) + ".bed"))
+  if(exclusion_file_name): exclusion_file_name = uncompressing_files(exclusion_file_name, temp_location + "exclusion_file_name_unc.bed")
+
+  # Create table
+  create_table(half_ext, dsb_file_name, feature_names, feature_list_unc, chrom_sizes_file_name, output_file_name, exclusion_file_name = exclusion_file_name, mode = mode, n_permutations = n_permutations, seed = seed, threads = threads, null_file_name = null_file_name, output_format = output_format)
+
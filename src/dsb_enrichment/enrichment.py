@@ -0,0 +1,105 @@
+
+###################################################################################################
+# Input
+###################################################################################################
+
+# Import
+from __future__ import print_function
+import os
+import sys
+import numpy as np
+
+# Internal
+from ..Util import read_chromosome_sizes
+from ..Signal import BamSignal
+from ..TableIO import open_table_writer
+from ..Permutation import merge_intervals, chromosome_data, observed_counts, permute, enrichment_summary
+
+###################################################################################################
+# Functions
+###################################################################################################
+
+def read_interval_file(file_name, chrom_sizes_dict, half_ext = 0):
+
+  # Dictionary chromosome -> (starts, ends) of the regions of a bed file, extended by half_ext
+  start_dict = dict()
+  end_dict = dict()
+  interval_file = open(file_name,"rU")
+  for line in interval_file:
+    ll = line.strip().split("\t")
+    if(len(ll) < 3 or ll[0] not in chrom_sizes_dict): continue
+    start = int(ll[1]) - half_ext
+    end = int(ll[2]) + half_ext
+    if(start < 0 or end > chrom_sizes_dict[ll[0]]): continue
+    start_dict.setdefault(ll[0], []).append(start)
+    end_dict.setdefault(ll[0], []).append(end)
+  interval_file.close()
+
+  # Return objects
+  return dict([(chrom, (np.array(start_dict[chrom], dtype=np.int64), np.array(end_dict[chrom], dtype=np.int64))) for chrom in start_dict.keys()])
+
+def read_dsb_positions(dsb_file_name, chrom_sizes_dict):
+
+  # Dictionary chromosome -> DSB positions (read starts of a bam file or region starts of a bed file)
+  dsb_dict = dict()
+  extension = dsb_file_name.split(".")[-1].lower()
+  if(extension == "bam"):
+    bamFile = BamSignal(dsb_file_name, strategy = "sweep", verbose = False)
+    for chrom in sorted(chrom_sizes_dict.keys()):
+      try: dsb_dict[chrom] = bamFile.starts(chrom, 0, chrom_sizes_dict[chrom])
+      except Exception: continue
+    bamFile.close()
+  else:
+    for chrom, (starts, ends) in read_interval_file(dsb_file_name, chrom_sizes_dict).items():
+      dsb_dict[chrom] = starts
+
+  # Return objects
+  return dsb_dict
+
+###################################################################################################
+# Enrichment table
+###################################################################################################
+
+def create_table(half_ext, dsb_file_name, feature_names, feature_list, chrom_sizes_file_name, output_file_name, exclusion_file_name = None, mode = "dsb", n_permutations = 1000, seed = 111, threads = 1, null_file_name = None, output_format = "tsv"):
+
+  # Initialization
+  outLoc = "/".join(output_file_name.split("/")[:-1]) + "/"
+  command = "mkdir -p "+outLoc
+  os.system(command)
+
+  # Allowed chromosomes
+  chrList = ["chr"+str(e) for e in range(1,23)+["X"]]
+  chrom_sizes_dict = dict([(k, v) for k, v in read_chromosome_sizes(chrom_sizes_file_name).items() if k in chrList])
+
+  # Reading DSBs, feature windows and exclusion regions
+  dsb_dict = read_dsb_positions(dsb_file_name, chrom_sizes_dict)
+  window_dict_list = [read_interval_file(feature_file_name, chrom_sizes_dict, half_ext) for feature_file_name in feature_list]
+  if(exclusion_file_name): exclusion_dict = read_interval_file(exclusion_file_name, chrom_sizes_dict)
+  else: exclusion_dict = dict()
+  empty = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+  data_dict = dict()
+  for chrom in chrom_sizes_dict.keys():
+    window_list = [window_dict.get(chrom, empty) for window_dict in window_dict_list]
+    if(chrom not in dsb_dict and not any([len(e[0]) for e in window_list])): continue
+    excluded = merge_intervals(*exclusion_dict[chrom]) if(chrom in exclusion_dict) else None
+    data_dict[chrom] = chromosome_data(chrom_sizes_dict[chrom], dsb_dict.get(chrom, empty[0]), window_list, excluded)
+
+  # Observed and permutation counts
+  observed = observed_counts(data_dict, len(feature_list))
+  null = permute(data_dict, len(feature_list), mode = mode, n_permutations = n_permutations, seed = seed, threads = threads)
+
+  # Writing enrichment table
+  nDsb = sum([len(data["dsb"]) for data in data_dict.values()])
+  outputFile = open(output_file_name, "w")
+  outputFile.write("\t".join(["CLASS", "N_FEATURES", "N_DSB", "OBSERVED", "EXPECTED", "SD", "Z_SCORE", "FOLD", "P_ENRICHMENT", "P_DEPLETION"])+"\n")
+  for k, row in enumerate(enrichment_summary(observed, null)):
+    nFeatures = sum([len(data["windows"][k][0]) for data in data_dict.values()])
+    outputFile.write("\t".join([feature_names[k], str(nFeatures), str(nDsb)] + [("NA" if(isinstance(e, float) and e != e) else str(e)) for e in row])+"\n")
+  outputFile.close()
+
+  # Writing permutation counts (one row per permutation)
+  if(null_file_name):
+    nullFile = open_table_writer(null_file_name, output_format, header = feature_names)
+    for j in range(0, n_permutations): nullFile.write([int(e) for e in null[:, j]])
+    nullFile.close()
+
@@ -13,8 +13,9 @@ warnings.filterwarnings("ignore")
 
 # Internal
 from src import __version__
-from ..Util import PassThroughOptionParser
-from createTable import create_table
+from ..Util import PassThroughOptionParser, CommandExecutor, samfile_pool
+from createTable import create_table, aggregateFileName, statisticsFileName
+from baseMatrix import baseMatrixFileName, rebinBaseMatrix
 
 """
 gene_metaplots
@@ -115,12 +116,26 @@ def main():
   # Input Options
   parser.add_option("--nBins", dest="nBins", type="int", metavar="INT", default=15, help=("Number of bins in which the meta-plot region (6Kbp) is going to be divided to average the signal. The original was set to 15"))
   parser.add_option("--tssExt", dest="tssExt", type="int", metavar="INT", default=3000, help=("The size, in bp, of promoter regions. The original was set to 2Kbp."))
-  parser.add_option("--bamCount", dest="bamCount", type="int", metavar="INT", default=1000000, help=("The total number of reads in the BAM file containing the signal to plot."))
+  parser.add_option("--bamCount", dest="bamCount", type="int", metavar="INT", default=1000000, help=("The total number of reads in the BAM file containing the signal to plot (the BigWig values are scaled by the same factor)."))
   parser.add_option("--aliasFileName", dest="aliasFileName", type="string", metavar="FILE", default=None, help=("File containing gene aliases."))
   parser.add_option("--genesFileName", dest="genesFileName", type="string", metavar="FILE", default=None, help=("A file containing the location of genes. In this particular case the format has to be UCSC's refseq table."))
   parser.add_option("--expressionList", dest="expListFileName", type="string", metavar="FILE", default=None, help=("A plain text (tab-separated) file containing the genes in the first column and their expression in the second column."))
-  parser.add_option("--bamFileName", dest="bamFileName", type="string", metavar="FILE", default=None, help=("A BAM file containing the signal in which the meta-plot will be calculated."))
+  parser.add_option("--bamFileName", dest="bamFileName", type="string", metavar="FILE", default=None, help=("A BAM or BigWig file (or its pyramid .pyr, written by dsb-coverage) containing the signal in which the meta-plot will be calculated."))
+  parser.add_option("--chromSizesFileName", dest="chromSizesFileName", type="string", metavar="FILE", default=None, help=("File containing the total length of all chromosomes. Used to balance the parallel execution (optional)."))
+  parser.add_option("--threads", dest="threads", type="int", metavar="INT", default=1, help=("Number of processes used to run the analysis in parallel. The work is divided by chromosome."))
+  parser.add_option("--bam-threads", dest="bam_threads", type="int", metavar="INT", default=1, help=("Number of htslib decompression threads of each open BAM file, in every process. More threads speed up the long sequential reads of large BAM files."))
   parser.add_option("--temp", dest="tempLocation", type="string", metavar="PATH", default=None, help=("Temporary location to aid in the execution."))
+  parser.add_option("--aggregate", dest="aggregate", action="store_true", default=False, help=("Writes the count, sum, mean and variance of the signal of each expression percentile group (in outputFileName with the suffix _aggr.txt). The plot is then created from these curves."))
+  parser.add_option("--groupBoundaries", dest="groupBoundaries", type="string", metavar="STRING", default="100,75,50,0", help=("Comma-separated boundaries of the expression percentile groups used with --aggregate. Each group holds the genes with lower <= percentile < upper."))
+  parser.add_option("--noGeneTable", dest="noGeneTable", action="store_true", default=False, help=("Used with --aggregate. Does not write the table with one row per gene."))
+  parser.add_option("--statistics", dest="statistics", action="store_true", default=False, help=("Writes the Pearson, Spearman and partial correlations between the gene score, its percentile and the mean signal of each meta-gene segment, with bootstrap confidence intervals (in outputFileName with the suffix _stats.txt)."))
+  parser.add_option("--nBootstrap", dest="nBootstrap", type="int", metavar="INT", default=1000, help=("Number of bootstrap resamples used for the confidence intervals of --statistics."))
+  parser.add_option("--baseMatrix", dest="baseMatrix", action="store_true", default=False, help=("Also writes, as a memory-mapped binary table (outputFileName with the suffix _base.bin), the base-resolution signal (read starts of a BAM file or BigWig values) in the --baseExt bp around the TSS and the TES of every gene."))
+  parser.add_option("--baseExt", dest="baseExt", type="int", metavar="INT", default=3000, help=("Size, in bp, of each side of the TSS and TES windows of --baseMatrix."))
+  parser.add_option("--rebinBaseMatrix", dest="rebinBaseMatrix", type="string", metavar="FILE", default=None, help=("Writes the signal of an existing --baseMatrix table in bins of --binSize bp to outputFileName (per 200 bp and per million reads, as the meta-gene table), without reading the signal file again."))
+  parser.add_option("--binSize", dest="binSize", type="int", metavar="INT", default=100, help=("Bin size, in bp, used with --rebinBaseMatrix. It must divide 2*baseExt."))
+  parser.add_option("--smoothWindow", dest="smoothWindow", type="int", metavar="INT", default=1, help=("Width, in bins, of the moving average applied with --rebinBaseMatrix."))
+  parser.add_option("--outputFormat", dest="outputFormat", type="choice", choices=["tsv", "binary", "indexed"], metavar="STRING", default="tsv", help=("Format of the output table: 'tsv' (tab-separated text), 'binary' (memory-mappable matrix with a JSON metadata file) or 'indexed' (with the gene coordinates in the first three columns, sorted, bgzip-compressed and tabix-indexed, in outputFileName with the suffix .gz). The plot is only created with 'tsv'."))
   parser.add_option("--outputFileName", dest="outputFileName", type="string", metavar="FILE", default=None, help=("Output file name."))
 
   # Processing Options
@@ -137,6 +152,26 @@ def main():
   bamFileName = options.bamFileName
   tempLocation = options.tempLocation
   outputFileName = options.outputFileName
+  outputFormat = options.outputFormat
+  aggregate = options.aggregate
+  groupBoundaries = [float(e) for e in options.groupBoundaries.split(",")]
+  geneTable = not options.noGeneTable
+  statistics = options.statistics
+  nBootstrap = options.nBootstrap
+  baseMatrix = options.baseMatrix
+  baseExt = options.baseExt
+  rebinMatrixFileName = options.rebinBaseMatrix
+  binSize = options.binSize
+  smoothWindow = options.smoothWindow
+  chromSizesFileName = options.chromSizesFileName
+  threads = options.threads
+  bam_threads = options.bam_threads
+
+  # Re-binning an existing base-resolution matrix (the signal file is not read)
+  if(rebinMatrixFileName):
+    if(not outputFileName): print("ERROR: Please provide all arguments.")
+    else: rebinBaseMatrix(rebinMatrixFileName, binSize, outputFileName, smoothWindow = smoothWindow, rpm = bamCount/1000000., outputFormat = outputFormat if(outputFormat != "indexed") else "tsv")
+    return
 
   # Argument error
   argument_error_message = "ERROR: Please provide all arguments."
@@ -150,11 +185,15 @@ def main():
   if(not bamFileName): print(argument_error_message)
   if(not tempLocation): print(argument_error_message)
   if(not outputFileName): print(argument_error_message)
+  if(not geneTable and not aggregate): print("ERROR: --noGeneTable requires --aggregate.")
 
   ###################################################################################################
   # Execution
   ###################################################################################################
 
+  # Decompression threads of the BAM files (inherited by the worker processes)
+  samfile_pool.set_threads(bam_threads)
+
   # Uncompress aliasFileName
   aliasFileNameUnc = tempLocation + "aliasFileNameUnc.bed"
   uncompressing_files(aliasFileName, aliasFileNameUnc)
@@ -168,17 +207,25 @@ def main():
   uncompressing_files(expListFileName, expListFileNameUnc)
 
   # Uncompress bamFileName
-  bamFileNameUnc = tempLocation + "bamFileNameUnc.bam"
+  if(bamFileName.split(".")[-1].lower() in ["bw", "bigwig"]): bamFileNameUnc = tempLocation + "bamFileNameUnc.bw"
+  elif(bamFileName.split(".")[-1].lower() == "pyr"): bamFileNameUnc = bamFileName
+  else: bamFileNameUnc = tempLocation + "bamFileNameUnc.bam"
   uncompressing_files(bamFileName, bamFileNameUnc)
 
   # Creating table
-  create_table(nBins, tssExt, bamCount, percentileList, aliasFileNameUnc, genesFileNameUnc, expListFileNameUnc, bamFileNameUnc, tempLocation, outputFileName)
+  create_table(nBins, tssExt, bamCount, percentileList, aliasFileNameUnc, genesFileNameUnc, expListFileNameUnc, bamFileNameUnc, tempLocation, outputFileName, threads = threads, chromSizesFileName = chromSizesFileName, outputFormat = outputFormat, groupBoundaries = groupBoundaries if aggregate else None, geneTable = geneTable or not aggregate, statisticsFileName = statisticsFileName(outputFileName) if statistics else None, nBootstrap = nBootstrap, baseMatrixFileName = baseMatrixFileName(outputFileName) if baseMatrix else None, baseExt = baseExt)
+
+  # The R script reads the tab-separated table
+  if(outputFormat != "tsv"):
+    print("The plots are only created with the tsv output format. Use table-to-tsv to convert the table.")
+    return
 
   # Script path
   script_path = "/".join(os.path.realpath(__file__).split("/")[:-1]) + "/"
 
   # Creating plot
   plotFileName = ".".join(outputFileName.split(".")[:-1]) + ".pdf"
-  command = "Rscript "+script_path+"correlation.R "+" ".join([str(nBins), outputFileName, plotFileName])
-  os.system(command)
+  if(aggregate): command = "Rscript "+script_path+"correlation.R "+" ".join([str(nBins), aggregateFileName(outputFileName), plotFileName, "aggregate"])
+  else: command = "Rscript "+script_path+"correlation.R "+" ".join([str(nBins), outputFileName, plotFileName])
+  if(not CommandExecutor().run(command)): sys.exit(1)
 
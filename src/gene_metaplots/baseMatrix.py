@@ -0,0 +1,113 @@
+
+###################################################################################################
+# Import
+###################################################################################################
+
+# Import
+from __future__ import print_function
+import os
+import sys
+import numpy as np
+
+# Internal
+from ..Signal import open_signal, BamSignal
+from ..TableIO import create_binary_table, BinaryTable, open_table_writer
+
+###################################################################################################
+# Functions
+###################################################################################################
+
+def baseMatrixFileName(outputFileName):
+  return ".".join(outputFileName.split(".")[:-1]) + "_base.bin"
+
+def baseWindow(signalFile, chrom, center, baseExt, reverse):
+
+  # Signal of the 2*baseExt bases around center (center at index baseExt), oriented from upstream to downstream
+  # Minus strand windows are taken one base to the right so that, once reversed, center is still at index baseExt
+  if(reverse): start = center - baseExt + 1
+  else: start = center - baseExt
+  end = start + 2 * baseExt
+  window = np.zeros(2 * baseExt, dtype=np.float64)
+  if(end <= 0): return window
+  if(isinstance(signalFile, BamSignal)):
+    # Break counts: number of reads starting at each base
+    starts = signalFile.starts(chrom, start, end)
+    starts = starts[starts >= max(start, 0)]
+    window = np.bincount(starts - start, minlength = 2 * baseExt).astype(np.float64)
+  else:
+    values = signalFile.values(chrom, start, end)
+    window[max(start, 0) - start:max(start, 0) - start + len(values)] = values
+  if(reverse): window = window[::-1]
+  return window
+
+def fetchBaseVectors(itemList, baseExt, signalFileName, matrixFileName):
+
+  # Each worker writes its own rows of the matrix in place
+  # ROW, CHROM, TSS, TES, REVERSE
+  signalFile = open_signal(signalFileName, verbose = False)
+  signalFile.plan([[item[1], min(item[2], item[3]) - baseExt, max(item[2], item[3]) + baseExt] for item in itemList])
+  table = BinaryTable(matrixFileName, mode = "r+")
+  for row, chrom, tss, tes, reverse in itemList:
+    try:
+      table.matrix[row, :2*baseExt] = baseWindow(signalFile, chrom, tss, baseExt, reverse)
+      table.matrix[row, 2*baseExt:] = baseWindow(signalFile, chrom, tes, baseExt, reverse)
+    except Exception: continue
+  table.matrix.flush()
+  del table
+  signalFile.close()
+
+  # Return objects
+  return [True] * len(itemList)
+
+def create_base_matrix(geneList, baseExt, signalFileName, matrixFileName, executor):
+
+  # Gene index (text columns) and window centers
+  # GENE, CHROM, TSS, TES, STRAND, FEATURE, PERCENTILE | TSS-baseExt ... TSS+baseExt-1, TES-baseExt ... TES+baseExt-1
+  labelList = []
+  itemList = []
+  for gene, region, featureValue, perc in geneList:
+    chrom = region[0]; strand = region[-1]
+    if(strand == "+"): tss = region[2]; tes = region[5] - 1
+    else: tss = region[2] - 1; tes = region[5]
+    labelList.append([gene, chrom, tss, tes, strand, featureValue, perc])
+    itemList.append([len(itemList), chrom, tss, tes, strand != "+"])
+
+  # Break counts of a BAM file are stored as int32 and BigWig values as float32
+  if(signalFileName.split(".")[-1].lower() == "bam"): dtype = "int32"
+  else: dtype = "float32"
+  header = ["GENE", "CHROM", "TSS", "TES", "STRAND", "FEATURE", "PERCENTILE"] + ["TSS"+str(e) for e in range(-baseExt, baseExt)] + ["TES"+str(e) for e in range(-baseExt, baseExt)]
+  create_binary_table(matrixFileName, labelList, 4 * baseExt, dtype = dtype, header = header, integer_columns = range(4 * baseExt) if(dtype == "int32") else None)
+
+  # Filling the matrix
+  executor.run(fetchBaseVectors, itemList, [e[1] for e in itemList], baseExt, signalFileName, matrixFileName)
+
+###################################################################################################
+# Re-binning
+###################################################################################################
+
+def rebinBaseMatrix(matrixFileName, binSize, outputFileName, smoothWindow = 1, rpm = 1., outputFormat = "tsv"):
+
+  # Initialization
+  table = BinaryTable(matrixFileName)
+  baseExt = table.shape[1] // 4
+  if(binSize <= 0 or (2 * baseExt) % binSize != 0):
+    print("ERROR: The bin size must divide the window size ("+str(2 * baseExt)+" bp).")
+    return
+  nBins = (2 * baseExt) // binSize
+  labelFile = open(table.label_file_name, "r")
+
+  # Binned signal per 200 bp (as in the meta-gene table) around the TSS and the TES, smoothed with a moving average of smoothWindow bins
+  # GENE, FEATURE, PERCENTILE, TSS_BIN1, ..., TSS_BINn, TES_BIN1, ..., TES_BINn
+  header = ["GENE", "FEATURE", "PERCENTILE"] + ["TSS_BIN"+str(e) for e in range(1,nBins+1)] + ["TES_BIN"+str(e) for e in range(1,nBins+1)]
+  outputFile = open_table_writer(outputFileName, outputFormat, n_labels = 1, header = header)
+  for first, chunk in table.iter_chunks(chunk_rows = 256):
+    binned = np.asarray(chunk, dtype=np.float64).reshape(chunk.shape[0], 2, nBins, binSize).sum(axis = 3) * (200. / binSize) / rpm
+    if(smoothWindow > 1):
+      padded = np.concatenate([np.repeat(binned[:,:,:1], smoothWindow // 2, axis = 2), binned, np.repeat(binned[:,:,-1:], (smoothWindow - 1) // 2, axis = 2)], axis = 2)
+      cumulative = np.concatenate([np.zeros(padded.shape[:2] + (1,)), np.cumsum(padded, axis = 2)], axis = 2)
+      binned = (cumulative[:,:,smoothWindow:] - cumulative[:,:,:-smoothWindow]) / smoothWindow
+    for values in binned.reshape(chunk.shape[0], 2 * nBins).tolist():
+      ll = labelFile.readline().rstrip("\n").split("\t")
+      outputFile.write([ll[0], float(ll[5]), int(ll[6])] + values)
+  outputFile.close()
+  labelFile.close()
@@ -9,7 +9,13 @@ import os
 import sys
 import math
 import numpy as np
-from pysam import Samfile
+
+# Internal
+from ..Util import ChromosomeExecutor, GroupStatistics, stratify
+from ..Signal import open_signal
+from ..TableIO import open_table_writer
+from ..Statistics import write_summary
+from baseMatrix import create_base_matrix
 
 ###################################################################################################
 # Functions
@@ -30,37 +36,97 @@ def read_alias_dictionary(alias_file_name):
   # Return objects
   return alias_dict
 
-def fetchTotalSignalBam(bamFile, region):
-  totalSignal = 0.0
-  for read in bamFile.fetch(region[0], region[1], region[2]): totalSignal += 1.0
-  return totalSignal
-
-def fetchSignalBw(bwFile, region, nBins, reverse = False):
-  returnVec = [0.0] * nBins
-  regionLen = (region[2] - region[1])
-  bpPerBin = int( regionLen / nBins )
-  valuesVec = bwFile.values(region[0], region[1], region[2])
-  for i in range(0, len(valuesVec)):
-    if(not valuesVec[i] or math.isnan(valuesVec[i]) or math.isinf(valuesVec[i])): valuesVec[i] = 0.0
-  for i in range(0, regionLen, bpPerBin):
-    returnVec[min(i/bpPerBin,len(returnVec)-1)] = sum(valuesVec[(i):(min(i+bpPerBin,len(valuesVec)-1))])
-  return returnVec
-
-def fetchSignalBam(bamFile, region, nBins, reverse = False):
-  returnVec = [0.0] * nBins
-  regionLen = (region[2] - region[1])
-  bpPerBin = int( regionLen / nBins )
-  correctionFactor = 200. / bpPerBin
-  for read in bamFile.fetch(region[0], region[1], region[2]):
-    returnVec[max(min(int((read.reference_start-region[1])/bpPerBin),nBins-1),0)] += (1.0 * correctionFactor)
-  if(reverse): return returnVec[::-1]
-  else: return returnVec
+def metageneEdges(segStart, segEnd, nBins):
+  # Bins of int(length / nBins) bp starting at segStart, the last bin extending to segEnd
+  bpPerBin = (segEnd - segStart) // nBins
+  edges = segStart[:,None] + bpPerBin[:,None] * np.arange(nBins+1)[None,:]
+  edges[:,-1] = segEnd
+  return edges, bpPerBin
+
+def fetchMetageneBlock(signalFile, chrom, regionList, nBins):
+
+  # Region matrix and strand (minus strand segments go from region[k+1] to region[k])
+  regionMat = np.array([region[1:7] for region in regionList], dtype=np.int64)
+  rev = np.array([region[-1] != "+" for region in regionList])
+
+  # Edges of the total signal (TSS to TES) and of the five segments (upstream, TSS, body, TES, downstream)
+  edgesList = [np.column_stack((np.where(rev, regionMat[:,4], regionMat[:,1]), np.where(rev, regionMat[:,1], regionMat[:,4])))]
+  bpPerBinList = []
+  for k, segBins in enumerate([nBins, nBins, 2*nBins, nBins, nBins]):
+    segStart = np.where(rev, regionMat[:,k+1], regionMat[:,k])
+    segEnd = np.where(rev, regionMat[:,k], regionMat[:,k+1])
+    edges, bpPerBin = metageneEdges(segStart, segEnd, segBins)
+    edgesList.append(edges)
+    bpPerBinList.append(bpPerBin)
+
+  # Binning all genes of the block from a single query
+  binnedList = signalFile.binned(chrom, edgesList)
+
+  # Signal per 200 bp, oriented from upstream to downstream
+  signalList = []
+  for binned, bpPerBin in zip(binnedList[1:], bpPerBinList):
+    signal = binned * (200. / bpPerBin)[:,None]
+    signalList.append(np.where(rev[:,None], signal[:,::-1], signal))
+
+  # Return objects
+  return binnedList[0][:,0], np.hstack(signalList)
+
+def fetch_gene_vectors(geneList, nBins, rpm, signalFileName, verbose = False, blockSpan = 10000000):
+
+  # Initialization
+  signalFile = open_signal(signalFileName, verbose = verbose)
+
+  # Valid genes: the region must be inside the chromosome and the gene body must fit 2*nBins bins
+  validList = []
+  for i in range(0, len(geneList)):
+    region = geneList[i][1]
+    if(region[1] < 0): continue
+    if(region[-1] == "+" and region[4]-region[3] < 2*nBins): continue
+    if(region[-1] != "+" and region[3]-region[4] < 2*nBins): continue
+    validList.append(i)
+  validList.sort(key = lambda i: (geneList[i][1][0], min(geneList[i][1][1], geneList[i][1][6])))
+
+  # Blocks of neighbouring genes spanning at most blockSpan bp (or a single gene)
+  blockList = []
+  for i in validList:
+    region = geneList[i][1]
+    p1 = min(region[1], region[6]); p2 = max(region[1], region[6])
+    if(blockList and blockList[-1][0] == region[0] and p2 - blockList[-1][1] <= blockSpan):
+      blockList[-1][2] = max(blockList[-1][2], p2)
+      blockList[-1][3].append(i)
+    else: blockList.append([region[0], p1, p2, [i]])
+  signalFile.plan([e[:3] for e in blockList])
+
+  # Fetching the signal in all blocks
+  # GENE, GRO_VALUE, PERCENTILE, SIGNAL1, SIGNAL2, .....
+  vectorList = [None] * len(geneList)
+  for chrom, p1, p2, indexList in blockList:
+    totalSignal, signal = fetchMetageneBlock(signalFile, chrom, [geneList[i][1] for i in indexList], nBins)
+    signal = (signal / rpm).tolist()
+    totalSignal = totalSignal.astype(np.float64).tolist()
+    for j in range(0, len(indexList)):
+      gene, region, featureValue, perc = geneList[indexList[j]]
+      vector = [gene, featureValue * totalSignal[j], perc] + signal[j]
+      vectorList[indexList[j]] = vector
+
+  # Closing all files
+  if(verbose): print("Signal cache: "+signalFile.cache.stats())
+  signalFile.close()
+
+  # Return objects
+  return vectorList
+
+def aggregateFileName(outputFileName):
+  return ".".join(outputFileName.split(".")[:-1]) + "_aggr.txt"
+
+def statisticsFileName(outputFileName):
+  return ".".join(outputFileName.split(".")[:-1]) + "_stats.txt"
 
 ###################################################################################################
 # Creating table
 ###################################################################################################
 
-def create_table(nBins, tssExt, bamCount, percentileList, aliasFileName, genesFileName, featurePeakFileName, bamFileName, tempLocation, outputFileName):
+def create_table(nBins, tssExt, bamCount, percentileList, aliasFileName, genesFileName, featurePeakFileName, bamFileName, tempLocation, outputFileName, threads = 1, chromSizesFileName = None, outputFormat = "tsv", groupBoundaries = None, geneTable = True, statisticsFileName = None, nBootstrap = 1000, baseMatrixFileName = None, baseExt = 3000, blockSize = 10000, verbose = False):
 
   # Initialization
   command = "mkdir -p "+tempLocation
@@ -122,72 +188,48 @@ def create_table(nBins, tssExt, bamCount, percentileList, aliasFileName, genesFi
     featureList.append(featurevalue)
   featurePeakFile.close()
 
-  # Percentile values dictionary
-  percValueDict = dict()
-  featureListNp = np.array(featureList)
-  for percentile in percentileList: percValueDict[percentile] = np.percentile(featureListNp, int(percentile))
-
   # Percentile dictionary
   percentileDict = dict()
   featureDictKeys = sorted(featureDict.keys())
-  for gene in featureDictKeys:
-    for percentile in percentileList:
-      percValue = percValueDict[percentile]
-      featureValue = featureDict[gene]
-      if(featureValue >= percValue):
-        percentileDict[gene] = percentile
-        break
-
-  # Initialization
-  featureKeysLen = len(featureDictKeys)
-  bamFile = Samfile(bamFileName, "rb")
-
-  # Fetching the bam signal in all categories
-  # GENE, GRO_VALUE, PERCENTILE, SIGNAL1, SIGNAL2, .....
-  outputFile = open(outputFileName,"w")
-  featureListNp = np.array(featureList)
-  prevPercValue = max(featureList)
-  for gene in featureDictKeys:
-
-    # Initialization
-    region = regionDict[gene]
-    rev = True
-    if(region[-1] == "+"): rev = False
-    if(region[1] < 0): continue
-
-    if(rev): totalSignal = fetchTotalSignalBam(bamFile, [region[0], region[5], region[2]])
-    else: totalSignal = fetchTotalSignalBam(bamFile, [region[0], region[2], region[5]])
-    vector = [gene, featureDict[gene] * totalSignal]
-
-    # Verifying meta-gene
-    if(rev and region[3]-region[4] < 2*nBins): continue
-    if(not rev and region[4]-region[3] < 2*nBins): continue
-
-    # Fetching percentile
-    perc = percentileDict[gene]
-    vector.append(perc)
-
-    # Fetching signal
-    if(rev):
-      signal1 = [e/rpm for e in fetchSignalBam(bamFile, [region[0], region[2], region[1]], nBins, reverse = rev)]
-      signal2 = [e/rpm for e in fetchSignalBam(bamFile, [region[0], region[3], region[2]], nBins, reverse = rev)]
-      signal3 = [e/rpm for e in fetchSignalBam(bamFile, [region[0], region[4], region[3]], 2*nBins, reverse = rev)]
-      signal4 = [e/rpm for e in fetchSignalBam(bamFile, [region[0], region[5], region[4]], nBins, reverse = rev)]
-      signal5 = [e/rpm for e in fetchSignalBam(bamFile, [region[0], region[6], region[5]], nBins, reverse = rev)]
-    else:
-      signal1 = [e/rpm for e in fetchSignalBam(bamFile, [region[0], region[1], region[2]], nBins, reverse = rev)]
-      signal2 = [e/rpm for e in fetchSignalBam(bamFile, [region[0], region[2], region[3]], nBins, reverse = rev)]
-      signal3 = [e/rpm for e in fetchSignalBam(bamFile, [region[0], region[3], region[4]], 2*nBins, reverse = rev)]
-      signal4 = [e/rpm for e in fetchSignalBam(bamFile, [region[0], region[4], region[5]], nBins, reverse = rev)]
-      signal5 = [e/rpm for e in fetchSignalBam(bamFile, [region[0], region[5], region[6]], nBins, reverse = rev)]
-
-    # Updating vector
-    vector = vector + signal1 + signal2 + signal3 + signal4 + signal5
-
-    # Writing vector
-    outputFile.write("\t".join([str(e) for e in vector])+"\n")
-
-  # Closing all files
-  outputFile.close()
-  bamFile.close()
+  percentileVec = stratify([featureDict[gene] for gene in featureDictKeys], percentile_list = percentileList, reference_values = featureList)
+  for gene, percentile in zip(featureDictKeys, percentileVec.tolist()):
+    if(percentile >= 0): percentileDict[gene] = percentile
+
+  # Fetching the bam signal in all genes, one block of genes at a time
+  geneList = [[gene, regionDict[gene], featureDict[gene], percentileDict[gene]] for gene in featureDictKeys]
+  executor = ChromosomeExecutor(threads = threads, chrom_sizes = chromSizesFileName)
+  blockStartList = range(0, len(geneList), blockSize)
+  blockIterator = ((geneList[i:i+blockSize], [e[1][0] for e in geneList[i:i+blockSize]]) for i in blockStartList)
+
+  # Writing vectors and/or aggregating them by percentile group as soon as each block is done
+  # Indexed tables start with the gene coordinates (CHROM, START, END) so that they can be sorted and indexed
+  # The statistics only keep the gene score, its percentile and the mean signal of each segment
+  segmentList = [[0, nBins], [nBins, 2*nBins], [2*nBins, 4*nBins], [4*nBins, 5*nBins], [5*nBins, 6*nBins]]
+  if(geneTable): outputFile = open_table_writer(outputFileName, outputFormat, n_labels = 1, coordinate_columns = (0, 1, 2))
+  if(groupBoundaries): groupStats = GroupStatistics(groupBoundaries)
+  statList = []
+  for blockStart, vectorList in zip(blockStartList, executor.run_blocks(fetch_gene_vectors, blockIterator, nBins, rpm, bamFileName, verbose)):
+    for gene, vector in zip(geneList[blockStart:blockStart+blockSize], vectorList):
+      if(not vector): continue
+      if(geneTable and outputFormat == "indexed"): outputFile.write([gene[1][0], min(gene[1][1], gene[1][6]), max(gene[1][1], gene[1][6])] + vector)
+      elif(geneTable): outputFile.write(vector)
+      if(groupBoundaries): groupStats.add(vector[2], vector[3:])
+      if(statisticsFileName): statList.append(vector[1:3] + [np.mean(vector[3+s1:3+s2]) for s1, s2 in segmentList])
+  if(geneTable): outputFile.close()
+
+  # Base-resolution signal around the TSS and the TES of all genes, from which any binning can be derived
+  if(baseMatrixFileName): create_base_matrix(geneList, baseExt, bamFileName, baseMatrixFileName, executor)
+
+  # Correlation statistics between the gene score, its percentile and the mean signal of each segment
+  if(statisticsFileName):
+    statMatrix = np.array(statList, dtype=np.float64).reshape(-1, 7)
+    write_summary(statisticsFileName, statMatrix, ["SCORE", "PERCENTILE", "UPSTREAM", "TSS", "BODY", "TES", "DOWNSTREAM"], n_bootstrap = nBootstrap, threads = threads)
+
+  # Writing aggregate curves (they have no coordinates, so an indexed output writes them as tsv)
+  # GROUP, STATISTIC, COUNT, SIGNAL1, SIGNAL2, .....
+  if(groupBoundaries):
+    nColumns = 6 * nBins
+    aggrFile = open_table_writer(aggregateFileName(outputFileName), outputFormat if(outputFormat != "indexed") else "tsv", n_labels = 2, header = ["GROUP", "STATISTIC", "COUNT"] + ["BIN"+str(e) for e in range(1,nColumns+1)])
+    for row in groupStats.rows(nColumns): aggrFile.write(row)
+    aggrFile.close()
 
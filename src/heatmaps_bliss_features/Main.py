@@ -13,8 +13,10 @@ warnings.filterwarnings("ignore")
 
 # Internal
 from src import __version__
-from ..Util import PassThroughOptionParser
+from ..Util import PassThroughOptionParser, samfile_pool
 from createHeatmap import create_heatmap
+from heatmapMatrix import SORT_OPTIONS
+from heatmapRender import AGGREGATION_OPTIONS, RENDERER_OPTIONS
 
 """
 heatmap-dsb
@@ -23,7 +25,10 @@ This program creates a centered around the features given for the signal also gi
 Furthermore, it sorts the heatmap in decreasing order by intensity of a given list (e.g. DSBs).
 
 Dependencies:
-- deeptools
+- numpy
+- pysam
+- pyBigWig
+- deeptools (plotHeatmap) or matplotlib (native renderer)
 
 Authors: Eduardo G. Gusmao.
 """
@@ -117,8 +122,25 @@ def main():
   # Input Options
   parser.add_option("--half-ext", dest="half_ext", type="int", metavar="INT", default=200, help=("Half the distance (in bp) from the middle of the feature to plot the heatmap."))
   parser.add_option("--regions", dest="feature_summit_file_name", type="string", metavar="FILE", default=None, help=("A bed file in which the final heatmap will be sorted by its SCORE column."))
-  parser.add_option("--signal-file", dest="signal_file_name", type="string", metavar="FILE", default=None, help=("A BIGWIG file containing the signal in which to generate the heatmap."))
+  parser.add_option("--sort-by", dest="sort_by", type="choice", choices=SORT_OPTIONS, metavar="STRING", default="score", help=("Order of the heatmap rows: 'score' (decreasing SCORE column of --regions), 'dsb' (decreasing number of DSBs of --dsb-file in each window), 'signal' (decreasing mean of the first signal) or 'keep' (order of --regions)."))
+  parser.add_option("--dsb-file", dest="dsb_file_name", type="string", metavar="FILE", default=None, help=("A BAM (or BIGWIG, or pyramid .pyr) file containing the DSBs used with --sort-by dsb."))
+  parser.add_option("--bin-size", dest="bin_size", type="int", metavar="INT", default=10, help=("Size, in bp, of the heatmap bins."))
+  parser.add_option("--signal-file", dest="signal_file_name", type="string", metavar="FILE", default=None, help=("A BIGWIG (or BAM, or a pyramid .pyr written by dsb-coverage) file containing the signal in which to generate the heatmap."))
   parser.add_option("--signal-label", dest="signal_label", type="string", metavar="STRING", default=None, help=("A label which will be plotted with the heatmap of the signal."))
+  parser.add_option("--signal-file-list", dest="signal_file_list", type="string", metavar="FILE_1[,FILE_2,...,FILE_N]", default=None, help=("A comma-separated list of BIGWIG (or BAM) files. Their heatmaps are computed together and plotted side by side with the same row order (instead of --signal-file)."))
+  parser.add_option("--signal-label-list", dest="signal_label_list", type="string", metavar="NAME_1[,NAME_2,...,NAME_N]", default=None, help=("A comma-separated list of labels for each file of --signal-file-list."))
+  parser.add_option("--threads", dest="threads", type="int", metavar="INT", default=None, help=("Number of processors used to compute the matrix (default: half of the available processors)."))
+  parser.add_option("--bam-threads", dest="bam_threads", type="int", metavar="INT", default=1, help=("Number of htslib decompression threads of each open BAM file, in every process. More threads speed up the long sequential reads of large BAM files."))
+  parser.add_option("--chrom-sizes", dest="chrom_sizes_file_name", type="string", metavar="FILE", default=None, help=("File containing the total length of all chromosomes. Used to balance the parallel execution (optional)."))
+  parser.add_option("--block-size", dest="block_size", type="int", metavar="INT", default=10000, help=("Number of regions fetched at a time by the workers."))
+  parser.add_option("--kmeans", dest="kmeans", type="int", metavar="INT", default=0, help=("Number of clusters of a minibatch k-means clustering of the heatmap rows (all signals together). The rows are grouped by cluster (keeping the --sort-by order inside each cluster) and the cluster of each region is written in the output file name with the suffix _clusters.txt."))
+  parser.add_option("--kmeans-batch-size", dest="kmeans_batch_size", type="int", metavar="INT", default=1000, help=("Number of rows drawn at each iteration of the minibatch k-means."))
+  parser.add_option("--kmeans-iterations", dest="kmeans_iterations", type="int", metavar="INT", default=100, help=("Number of iterations of the minibatch k-means."))
+  parser.add_option("--seed", dest="seed", type="int", metavar="INT", default=111, help=("Random seed of the minibatch k-means. The same seed gives the same clusters."))
+  parser.add_option("--renderer", dest="renderer", type="choice", choices=RENDERER_OPTIONS, metavar="STRING", default="deeptools", help=("Heatmap renderer: 'deeptools' (plotHeatmap) or 'native' (matplotlib, with the rows aggregated to the image height and drawn as a raster layer, so that the rendering time and the file size do not depend on the number of regions). The output format is given by the extension of the output file (e.g. pdf or png)."))
+  parser.add_option("--row-aggregation", dest="aggregation", type="choice", choices=AGGREGATION_OPTIONS, metavar="STRING", default="mean", help=("How the native renderer aggregates the rows when there are more rows than pixels: 'mean' or 'max'."))
+  parser.add_option("--height", dest="height_pixels", type="int", metavar="INT", default=1000, help=("Height, in pixels, of the image of the native renderer."))
+  parser.add_option("--color-map", dest="color_map", type="string", metavar="STRING", default="RdYlBu", help=("Matplotlib color map of the heatmap."))
   parser.add_option("--temp", dest="temp_location", type="string", metavar="PATH", default=None, help=("Temporary location to aid in the execution."))
   parser.add_option("--output-file", dest="output_file_name", type="string", metavar="FILE", default=None, help=("Output file name."))
 
@@ -130,30 +152,65 @@ def main():
   feature_summit_file_name = options.feature_summit_file_name
   signal_file_name = options.signal_file_name
   signal_label = options.signal_label
+  signal_file_list = options.signal_file_list
+  signal_label_list = options.signal_label_list
   temp_location = options.temp_location
   output_file_name = options.output_file_name
+  sort_by = options.sort_by
+  dsb_file_name = options.dsb_file_name
+  bin_size = options.bin_size
+  chrom_sizes_file_name = options.chrom_sizes_file_name
+  block_size = options.block_size
+  kmeans = options.kmeans
+  kmeans_batch_size = options.kmeans_batch_size
+  kmeans_iterations = options.kmeans_iterations
+  seed = options.seed
+  renderer = options.renderer
+  aggregation = options.aggregation
+  height_pixels = options.height_pixels
+  color_map = options.color_map
+  threads = options.threads
+  bam_threads = options.bam_threads
 
   # Argument error
   argument_error_message = "ERROR: Please provide all arguments."
   if(not half_ext): print(argument_error_message)
   if(not feature_summit_file_name): print(argument_error_message)
-  if(not signal_file_name): print(argument_error_message)
-  if(not signal_label): print(argument_error_message)
+  if(signal_file_list and signal_label_list):
+    signal_file_list = signal_file_list.split(",")
+    signal_label_list = signal_label_list.split(",")
+    if(len(signal_file_list) != len(signal_label_list)): print("ERROR: --signal-file-list and --signal-label-list must have the same length.")
+  elif(signal_file_name and signal_label):
+    signal_file_list = [signal_file_name]
+    signal_label_list = [signal_label]
+  else: print(argument_error_message)
   if(not temp_location): print(argument_error_message)
   if(not output_file_name): print(argument_error_message)
+  if(sort_by == "dsb" and not dsb_file_name): print("ERROR: --sort-by dsb requires --dsb-file.")
+  if(half_ext % bin_size != 0): print("ERROR: --bin-size must divide --half-ext.")
 
   ###################################################################################################
   # Execution
   ###################################################################################################
 
+  # Decompression threads of the BAM files (inherited by the worker processes)
+  samfile_pool.set_threads(bam_threads)
+
   # Uncompress feature_summit_file_name
   feature_summit_file_name_unc = temp_location + "feature_summit_file_name_unc.bed"
-  uncompressing_files(feature_summit_file_name, temp_location, feature_summit_file_name_unc)
-
-  # Uncompress signal_file_name
-  signal_file_name_unc = temp_location + "signal_file_name_unc.bam"
-  uncompressing_files(signal_file_name, temp_location, signal_file_name_unc)
+  uncompressing_files(feature_summit_file_name, feature_summit_file_name_unc)
+
+  # Uncompress signal_file_list
+  signal_file_list_unc = []
+  counter = 1
+  for signal_file_name in signal_file_list:
+    if(signal_file_name.split(".")[-1].lower() in ["bw", "bigwig"]): signal_file_name_unc = temp_location + "signal_file_name_unc" + str(counter) + ".bw"
+    elif(signal_file_name.split(".")[-1].lower() == "pyr"): signal_file_name_unc = signal_file_name
+    else: signal_file_name_unc = temp_location + "signal_file_name_unc" + str(counter) + ".bam"
+    uncompressing_files(signal_file_name, signal_file_name_unc)
+    signal_file_list_unc.append(signal_file_name_unc)
+    counter += 1
 
   # Create heatmap
-  create_heatmap(half_ext, feature_summit_file_name_unc, signal_file_name_unc, signal_label, temp_location, output_file_name)
+  create_heatmap(half_ext, feature_summit_file_name_unc, signal_file_list_unc, signal_label_list, temp_location, output_file_name, threads = threads, sort_by = sort_by, dsb_file_name = dsb_file_name, bin_size = bin_size, chrom_sizes_file_name = chrom_sizes_file_name, block_size = block_size, renderer = renderer, aggregation = aggregation, height_pixels = height_pixels, color_map = color_map, kmeans = kmeans, kmeans_batch_size = kmeans_batch_size, kmeans_iterations = kmeans_iterations, seed = seed)
 
@@ -1 +1 @@
-__all__ = ["Main", "createHeatmap"]
+__all__ = ["Main", "createHeatmap", "heatmapMatrix", "heatmapRender", "heatmapCluster"]
@@ -7,12 +7,23 @@
 from __future__ import print_function
 import os
 import sys
+import multiprocessing
+import numpy as np
+
+# Internal
+from ..Util import ChromosomeExecutor, CommandExecutor, which
+from heatmapMatrix import read_heatmap_regions, compute_heatmap_matrices, heatmap_order, write_deeptools_matrix
+from heatmapRender import render_heatmap
+from heatmapCluster import minibatch_kmeans, cluster_order, clusterFileName, write_cluster_labels
 
 ###################################################################################################
 # Create Heatmap
 ###################################################################################################
 
-def create_heatmap(half_ext, feature_summit_file_name, signal_file_name, signal_label, temp_location, output_file_name):
+def matrixFileName(outputFileName):
+  return ".".join(outputFileName.split(".")[:-1]) + ".mat.gz"
+
+def create_heatmap(half_ext, feature_summit_file_name, signal_file_list, signal_label_list, temp_location, output_file_name, threads = None, sort_by = "score", dsb_file_name = None, bin_size = 10, chrom_sizes_file_name = None, block_size = 10000, renderer = "deeptools", aggregation = "mean", height_pixels = 1000, color_map = "RdYlBu", kmeans = 0, kmeans_batch_size = 1000, kmeans_iterations = 100, seed = 111):
 
   # Initialization
   command = "mkdir -p "+temp_location
@@ -20,31 +31,41 @@ def create_heatmap(half_ext, feature_summit_file_name, signal_file_name, signal_
   outLoc = "/".join(output_file_name.split("/")[:-1]) + "/"
   command = "mkdir -p "+outLoc
   os.system(command)
+  if(not threads): threads = max(multiprocessing.cpu_count() // 2, 1)
 
   # Allowed chromosomes
   chrList = ["chr"+str(e) for e in range(1,23)+["X"]]
 
-  # Creating bed from peak files
-  featureSummitFile = open(feature_summit_file_name,"r")
-  tempBedFileName = temp_location + "bedfile.bed"
-  bedFile = open(tempBedFileName,"w")
-  for line in featureSummitFile:
-    ll = line.strip().split("\t")
-    if(ll[0] not in chrList): continue
-    region = [ll[0], int(ll[1])-half_ext, int(ll[2])+half_ext]
-    if(int(region[1]) < 0): continue
-    bedFile.write("\t".join([str(e) for e in region])+"\n")
-  featureSummitFile.close()
-  bedFile.close()
-
-  # Creating heatmaps
-  tempMatFileName = temp_location + "matrix.mat.gz"
-
-  # Creating matrix (heatmaps_eachSignalOrderByDBS)
-  command = "computeMatrix reference-point -S \""+signal_file_name+"\" -R \""+tempBedFileName+"\" -a \""+str(half_ext)+"\" -b \""+str(half_ext)+"\" --referencePoint \"center\" --binSize \"10\" --sortRegions \"keep\" --missingDataAsZero --numberOfProcessors \"max/2\" -o \""+tempMatFileName+"\""
-  os.system(command)
+  # Reading regions (shared by all signals)
+  regionList = read_heatmap_regions(feature_summit_file_name, half_ext, chrList)
 
-  # Creating heatmap without yMax
-  command = "plotHeatmap -m \""+tempMatFileName+"\" -out \""+output_file_name+"\" --dpi \"90\" --missingDataColor \"white\" --refPointLabel \"Summit\" --yAxisLabel \""+signal_label+" Signal\" --samplesLabel \""+signal_label+"\" --legendLocation \"upper-right\" --plotFileFormat \"pdf\""
-  os.system(command)
+  # Creating matrices (heatmaps_eachSignalOrderByDBS)
+  executor = ChromosomeExecutor(threads = threads, chrom_sizes = chrom_sizes_file_name)
+  matrixList, dsb = compute_heatmap_matrices(regionList, bin_size, signal_file_list, executor, dsbFileName = dsb_file_name if(sort_by == "dsb") else None, blockSize = block_size)
+
+  # Sorting rows once (by the first signal with 'signal')
+  order = heatmap_order(sort_by, regionList, matrixList[0], dsb)
+
+  # Clustering the rows (all signals side by side) and grouping them by cluster, keeping the order inside each cluster
+  groupBoundaries = None
+  if(kmeans > 1):
+    labels = minibatch_kmeans(np.hstack(matrixList), kmeans, batchSize = kmeans_batch_size, nIterations = kmeans_iterations, seed = seed)
+    write_cluster_labels(clusterFileName(output_file_name), regionList, labels)
+    order, groupBoundaries = cluster_order(order, labels)
+
+  # Writing all signals side by side in the deeptools format
+  matFileName = matrixFileName(output_file_name)
+  write_deeptools_matrix(matFileName, [regionList[i] for i in order], [matrix[order] for matrix in matrixList], signal_label_list, half_ext, bin_size, threads = threads, groupBoundaries = groupBoundaries)
+
+  # Creating heatmap without yMax (the rows are already sorted, all panels share the same row order)
+  # The native renderer draws the matrices directly, aggregating the rows to the image height
+  yAxisLabel = signal_label_list[0]+" Signal" if(len(signal_label_list) == 1) else "Signal"
+  if(renderer == "deeptools" and not which("plotHeatmap")):
+    print("plotHeatmap (deeptools) was not found. Using the native renderer.")
+    renderer = "native"
+  if(renderer == "native"):
+    render_heatmap(output_file_name, [matrix[order] for matrix in matrixList], signal_label_list, half_ext, bin_size, yAxisLabel = yAxisLabel, colorMap = color_map, aggregation = aggregation, heightPixels = height_pixels, groupBoundaries = groupBoundaries)
+    return
+  command = "plotHeatmap -m \""+matFileName+"\" -out \""+output_file_name+"\" --sortRegions \"no\" --dpi \"90\" --missingDataColor \"white\" --refPointLabel \"Summit\" --yAxisLabel \""+yAxisLabel+"\" --samplesLabel "+" ".join(["\""+e+"\"" for e in signal_label_list])+" --colorMap \""+color_map+"\" --legendLocation \"upper-right\" --plotFileFormat \"pdf\""
+  if(not CommandExecutor().run(command)): sys.exit(1)
 
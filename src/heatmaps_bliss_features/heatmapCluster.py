@@ -0,0 +1,111 @@
+
+###################################################################################################
+# Import
+###################################################################################################
+
+# Import
+from __future__ import print_function
+import os
+import sys
+import numpy as np
+
+# Internal
+from ..TableIO import open_table_writer
+
+###################################################################################################
+# Functions
+###################################################################################################
+
+def nearest_centers(points, centers):
+
+  # Index of the nearest center (squared euclidean distance) of each point
+  distances = (points ** 2).sum(axis=1)[:,None] - 2 * np.dot(points, centers.T) + (centers ** 2).sum(axis=1)[None,:]
+  return distances.argmin(axis=1)
+
+def kmeans_plusplus(sample, k, randomState):
+
+  # k-means++ seeding: each new center is drawn with probability proportional to its squared distance to the nearest center
+  centerList = [sample[randomState.randint(len(sample))]]
+  distances = ((sample - centerList[0]) ** 2).sum(axis=1)
+  for j in range(1, k):
+    if(distances.sum() > 0): index = randomState.choice(len(sample), p = distances / distances.sum())
+    else: index = randomState.randint(len(sample))
+    centerList.append(sample[index])
+    distances = np.minimum(distances, ((sample - sample[index]) ** 2).sum(axis=1))
+
+  # Return objects
+  return np.array(centerList, dtype=np.float64)
+
+def minibatch_centers(matrix, k, batchSize, nIterations, randomState):
+
+  # Seeding on a sample of the rows
+  nRows = matrix.shape[0]
+  sampleIndex = np.sort(randomState.choice(nRows, min(nRows, max(10 * k, batchSize)), replace = False))
+  centers = kmeans_plusplus(matrix[sampleIndex].astype(np.float64), k, randomState)
+
+  # Minibatch updates: each center moves towards the mean of its batch points with a rate of 1 / (points assigned so far)
+  counts = np.zeros(k)
+  for iteration in range(0, nIterations):
+    batch = matrix[randomState.randint(0, nRows, min(batchSize, nRows))].astype(np.float64)
+    labels = nearest_centers(batch, centers)
+    batchCounts = np.bincount(labels, minlength = k).astype(np.float64)
+    batchSums = np.zeros(centers.shape)
+    np.add.at(batchSums, labels, batch)
+    counts += batchCounts
+    updated = batchCounts > 0
+    centers[updated] += (batchSums[updated] - batchCounts[updated,None] * centers[updated]) / counts[updated,None]
+
+  # Return objects
+  return centers
+
+def minibatch_kmeans(matrix, k, batchSize = 1000, nIterations = 100, nInit = 3, seed = 111, chunkRows = 10000):
+
+  # Initialization
+  nRows = matrix.shape[0]
+  k = max(min(k, nRows), 1)
+  randomState = np.random.RandomState(seed)
+  if(nRows == 0): return np.zeros(0, dtype=np.int64)
+
+  # The best of nInit runs (lowest inertia on a validation sample of the rows)
+  validation = matrix[np.sort(randomState.choice(nRows, min(nRows, 10 * batchSize), replace = False))].astype(np.float64)
+  bestInertia = None
+  for run in range(0, nInit):
+    centers = minibatch_centers(matrix, k, batchSize, nIterations, randomState)
+    inertia = ((validation - centers[nearest_centers(validation, centers)]) ** 2).sum()
+    if(bestInertia is None or inertia < bestInertia): bestInertia, bestCenters = inertia, centers
+  centers = bestCenters
+
+  # Final assignment of all rows (in chunks of chunkRows rows)
+  labels = np.concatenate([nearest_centers(matrix[i:i+chunkRows].astype(np.float64), centers) for i in range(0, nRows, chunkRows)])
+
+  # Clusters are numbered by decreasing mean signal of their centers (empty clusters are dropped)
+  used = np.unique(labels)
+  used = used[np.argsort(-centers[used].mean(axis=1), kind="mergesort")]
+  rank = np.zeros(k, dtype=np.int64)
+  rank[used] = np.arange(len(used))
+
+  # Return objects
+  return rank[labels]
+
+def cluster_order(order, labels):
+
+  # Groups the rows of order by cluster, keeping order inside each cluster
+  # Returns the new order and the group boundaries
+  order = order[np.argsort(labels[order], kind="mergesort")]
+  boundaries = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength = labels.max() + 1 if(len(labels)) else 0))])
+
+  # Return objects
+  return order, [int(e) for e in boundaries]
+
+def clusterFileName(outputFileName):
+  return ".".join(outputFileName.split(".")[:-1]) + "_clusters.txt"
+
+def write_cluster_labels(fileName, regionList, labels):
+
+  # Cluster of each region, in the order of the regions file
+  # CHROM, START, END, NAME, CLUSTER
+  outputFile = open_table_writer(fileName, "tsv", header = ["CHROM", "START", "END", "NAME", "CLUSTER"])
+  for region, label in zip(regionList, labels.tolist()):
+    outputFile.write([region[0], region[1], region[2], region[3], "cluster_"+str(label+1)])
+  outputFile.close()
+
@@ -0,0 +1,133 @@
+
+###################################################################################################
+# Import
+###################################################################################################
+
+# Import
+from __future__ import print_function
+import os
+import sys
+import gzip
+import json
+import numpy as np
+
+# Internal
+from ..Signal import open_signal
+
+###################################################################################################
+# Functions
+###################################################################################################
+
+# Row orders of the heatmap
+SORT_OPTIONS = ["score", "dsb", "signal", "keep"]
+
+def read_heatmap_regions(feature_summit_file_name, half_ext, chrList):
+
+  # Heatmap rows: windows of 2*half_ext bp centered at the middle of each region of the bed file
+  # CHROM, WINDOW_START, WINDOW_END, NAME, SCORE, STRAND
+  regionList = []
+  featureSummitFile = open(feature_summit_file_name,"r")
+  for line in featureSummitFile:
+    ll = line.strip().split("\t")
+    if(ll[0] not in chrList): continue
+    if(int(ll[1])-half_ext < 0): continue
+    center = (int(ll[1]) + int(ll[2])) // 2
+    name = ll[3] if(len(ll) > 3) else ":".join([ll[0], ll[1], ll[2]])
+    try: score = float(ll[4])
+    except Exception: score = 0.0
+    regionList.append([ll[0], center - half_ext, center + half_ext, name, score, "."])
+  featureSummitFile.close()
+
+  # Return objects
+  return regionList
+
+def fetch_heatmap_rows(regionList, binSize, signalFileList, dsbFileName):
+
+  # Initialization
+  nBins = (regionList[0][2] - regionList[0][1]) // binSize if(regionList) else 0
+  signalFileList = [open_signal(signalFileName, verbose = False) for signalFileName in signalFileList]
+  for signalFile in signalFileList: signalFile.plan([e[:3] for e in regionList])
+  if(dsbFileName):
+    dsbFile = open_signal(dsbFileName, verbose = False)
+    dsbFile.plan([e[:3] for e in regionList])
+
+  # Each chromosome is answered from a single query per file (read counts of a BAM file or mean values of a BigWig file per bin, or the same from their pyramids)
+  # SIGNALS (array of m signals x n bins), DSB_TOTAL
+  # Chromosomes missing from a file have no signal; any other error of a query is raised
+  chromSetList = [set(signalFile.chromosomes()) for signalFile in signalFileList]
+  if(dsbFileName): dsbChromSet = set(dsbFile.chromosomes())
+  resultList = [None] * len(regionList)
+  chromDict = dict()
+  for i, region in enumerate(regionList): chromDict.setdefault(region[0], []).append(i)
+  for chrom, indexList in chromDict.items():
+    starts = np.array([regionList[i][1] for i in indexList], dtype=np.int64)
+    edges = starts[:,None] + binSize * np.arange(nBins+1)[None,:]
+    # A leading bin (dropped) takes the BAM reads that start before the window but overlap it
+    leadingEdges = np.column_stack((np.maximum(starts - binSize, 0), edges))
+    signalList = []
+    for signalFile, chromSet in zip(signalFileList, chromSetList):
+      if(chrom in chromSet): signal = signalFile.binned(chrom, [leadingEdges])[0][:,1:].astype(np.float64)
+      else: signal = np.zeros((len(indexList), nBins))
+      if(signalFile.per_base): signal = signal / binSize
+      signalList.append(signal)
+    if(dsbFileName and chrom in dsbChromSet): dsb = dsbFile.binned(chrom, [edges[:,[0,-1]]])[0][:,0].astype(np.float64)
+    else: dsb = np.zeros(len(indexList))
+    signalArray = np.stack(signalList, axis=1) if(signalList) else np.zeros((len(indexList), 0, nBins))
+    for j, i in enumerate(indexList): resultList[i] = [signalArray[j], float(dsb[j])]
+
+  # Closing all files
+  for signalFile in signalFileList: signalFile.close()
+  if(dsbFileName): dsbFile.close()
+
+  # Return objects
+  return resultList
+
+def compute_heatmap_matrices(regionList, binSize, signalFileList, executor, dsbFileName = None, blockSize = 10000):
+
+  # Regions are fetched in blocks of blockSize regions, each block split among the workers
+  # All signals of a block are read by the same worker, so the regions are sorted and planned once for all signals
+  # The rows of each block are copied into the preallocated matrices (one per signal) as soon as the block is done
+  nBins = (regionList[0][2] - regionList[0][1]) // binSize if(regionList) else 0
+  blockStartList = range(0, len(regionList), blockSize)
+  blockIterator = ((regionList[i:i+blockSize], [e[0] for e in regionList[i:i+blockSize]]) for i in blockStartList)
+  matrixList = [np.empty((len(regionList), nBins), dtype=np.float64) for signalFileName in signalFileList]
+  dsb = np.empty(len(regionList), dtype=np.float64)
+  for blockStart, resultList in zip(blockStartList, executor.run_blocks(fetch_heatmap_rows, blockIterator, binSize, signalFileList, dsbFileName)):
+    blockEnd = blockStart + len(resultList)
+    blockArray = np.array([e[0] for e in resultList], dtype=np.float64).reshape(len(resultList), len(signalFileList), nBins)
+    for k, matrix in enumerate(matrixList): matrix[blockStart:blockEnd] = blockArray[:,k]
+    dsb[blockStart:blockEnd] = [e[1] for e in resultList]
+
+  # Return objects
+  return matrixList, dsb
+
+def heatmap_order(sortBy, regionList, matrix, dsb):
+
+  # Decreasing order of the region score, of the DSB intensity or of the mean signal of matrix (ties keep the file order)
+  if(sortBy == "score"): key = np.array([e[4] for e in regionList], dtype=np.float64)
+  elif(sortBy == "dsb"): key = dsb
+  elif(sortBy == "signal"): key = matrix.mean(axis=1) if(matrix.shape[1] > 0) else np.zeros(matrix.shape[0])
+  else: return np.arange(len(regionList))
+  return np.argsort(-key, kind="mergesort")
+
+def write_deeptools_matrix(fileName, regionList, matrixList, sampleLabelList, halfExt, binSize, threads = 1, groupBoundaries = None, groupLabelList = None):
+
+  # Matrix in the format of deeptools computeMatrix reference-point (readable by plotHeatmap and plotProfile)
+  # The JSON header is followed by one row per region: CHROM, START, END, NAME, SCORE, STRAND, VALUES (all samples side by side)
+  nBins = [e.shape[1] for e in matrixList]
+  if(not groupBoundaries): groupBoundaries = [0, len(regionList)]
+  if(not groupLabelList): groupLabelList = ["regions"] if(len(groupBoundaries) == 2) else ["cluster_"+str(e) for e in range(1, len(groupBoundaries))]
+  header = {"upstream": [halfExt] * len(matrixList), "downstream": [halfExt] * len(matrixList), "body": [0] * len(matrixList),
+            "bin size": [binSize] * len(matrixList), "ref point": ["center"] * len(matrixList), "verbose": False,
+            "bin avg type": "mean", "missing data as zero": True, "min threshold": None, "max threshold": None,
+            "scale": [1] * len(matrixList), "skip zeros": False, "nan after end": False, "proc number": threads,
+            "sort regions": "keep", "sort using": "mean", "unscaled 5 prime": [0] * len(matrixList),
+            "unscaled 3 prime": [0] * len(matrixList), "group_labels": groupLabelList, "group_boundaries": groupBoundaries,
+            "sample_labels": sampleLabelList, "sample_boundaries": [int(e) for e in np.cumsum([0] + nBins)]}
+  matFile = gzip.open(fileName, "wb")
+  matFile.write("@" + json.dumps(header) + "\n")
+  matrix = np.hstack(matrixList) if(matrixList) else np.zeros((len(regionList), 0))
+  for region, values in zip(regionList, matrix.tolist()):
+    matFile.write("\t".join([region[0], str(region[1]), str(region[2]), region[3], str(region[4]), region[5]] + ["%g" % e for e in values]) + "\n")
+  matFile.close()
+
@@ -0,0 +1,107 @@
+
+###################################################################################################
+# Import
+###################################################################################################
+
+# Import
+from __future__ import print_function
+import os
+import sys
+import copy
+import numpy as np
+
+# Optional (only needed by the native renderer)
+try:
+  import matplotlib
+  matplotlib.use("Agg")
+  import matplotlib.pyplot as plt
+  from matplotlib.gridspec import GridSpec
+except ImportError:
+  plt = None
+
+###################################################################################################
+# Functions
+###################################################################################################
+
+# Row aggregations and renderers
+AGGREGATION_OPTIONS = ["mean", "max"]
+RENDERER_OPTIONS = ["deeptools", "native"]
+
+def row_bin_starts(nRows, nPixels):
+
+  # First row of each of the min(nRows, nPixels) row bins (consecutive rows of about the same size)
+  nBins = max(min(nRows, nPixels), 1)
+  return np.unique(np.linspace(0, nRows, nBins + 1).astype(np.int64)[:-1])
+
+def downsample_rows(matrix, nPixels, aggregation = "mean"):
+
+  # Aggregates the rows of matrix in at most nPixels bins of consecutive rows
+  if(matrix.shape[0] <= nPixels): return matrix
+  starts = row_bin_starts(matrix.shape[0], nPixels)
+  if(aggregation == "max"): return np.maximum.reduceat(matrix, starts, axis=0)
+  sizes = np.diff(np.append(starts, matrix.shape[0]))
+  return np.add.reduceat(matrix, starts, axis=0) / sizes[:,None]
+
+def render_heatmap(fileName, matrixList, labelList, halfExt, binSize, yAxisLabel = "Signal", refPointLabel = "Summit", colorMap = "RdYlBu", missingDataColor = "white", aggregation = "mean", heightPixels = 1000, dpi = 90, groupBoundaries = None, groupLabelList = None):
+
+  # Initialization
+  if(plt is None):
+    print("ERROR: The native renderer requires matplotlib.")
+    return False
+  nRows = matrixList[0].shape[0]
+  if(not groupBoundaries): groupBoundaries = [0, nRows]
+  groupList = zip(groupBoundaries[:-1], groupBoundaries[1:])
+  if(not groupLabelList): groupLabelList = [str(nRows)+" regions"] if(len(groupList) == 1) else ["cluster_"+str(e+1) for e in range(len(groupList))]
+  heightInches = heightPixels / float(dpi)
+  nPixels = int(heightPixels * 0.8)
+
+  # One panel per signal: mean profile above the heatmap, whose rows are aggregated to the image resolution
+  # The heatmap is drawn as a raster layer, so the file size does not depend on the number of regions
+  # The color bar has its own row, below an empty row (in inches, as the other rows) that holds the x tick labels of the heatmap
+  figure = plt.figure(figsize = (2.5 * len(matrixList) + 1, heightInches + 3.25), dpi = dpi)
+  grid = GridSpec(4, len(matrixList), height_ratios = [2, heightInches, 0.6, 0.15], hspace = 0.05)
+  colorMap = copy.copy(plt.get_cmap(colorMap))
+  colorMap.set_bad(missingDataColor)
+  xTicks = [-0.5, (2 * halfExt // binSize) / 2. - 0.5, 2 * halfExt // binSize - 0.5]
+  xTickLabels = ["-"+str(halfExt / 1000.)+"kb", refPointLabel, str(halfExt / 1000.)+"kb"]
+  for k, (matrix, label) in enumerate(zip(matrixList, labelList)):
+
+    # Profile (one curve per group of rows)
+    axis = figure.add_subplot(grid[0, k])
+    for (first, last), groupLabel in zip(groupList, groupLabelList):
+      axis.plot(np.arange(matrix.shape[1]), matrix[first:last].mean(axis=0) if(last > first) else np.zeros(matrix.shape[1]), label = groupLabel)
+    axis.set_title(label)
+    axis.set_xlim(xTicks[0], xTicks[-1])
+    axis.set_xticks([])
+    if(k == 0): axis.set_ylabel(yAxisLabel)
+    if(k == len(matrixList) - 1 and len(groupList) > 1): axis.legend(loc = "upper right", fontsize = "x-small")
+
+    # Heatmap (each group gets a share of the pixels proportional to its number of rows, at least one)
+    axis = figure.add_subplot(grid[1, k])
+    vmin = matrix.min() if(matrix.size > 0) else 0.0
+    vmax = matrix.max() if(matrix.size > 0) else 1.0
+    for first, last in groupList:
+      if(last <= first): continue
+      groupPixels = max(int(round(nPixels * (last - first) / float(max(nRows, 1)))), 1)
+      image = axis.imshow(downsample_rows(matrix[first:last], groupPixels, aggregation), aspect = "auto", interpolation = "nearest", cmap = colorMap, vmin = vmin, vmax = vmax, extent = (xTicks[0], xTicks[-1], last - 0.5, first - 0.5))
+      image.set_rasterized(True)
+      if(first > 0): axis.axhline(first - 0.5, color = "black", linewidth = 0.8)
+    axis.set_xlim(xTicks[0], xTicks[-1])
+    axis.set_ylim(nRows - 0.5, -0.5)
+    axis.set_xticks(xTicks)
+    axis.set_xticklabels(xTickLabels)
+    if(k == 0 and len(groupList) > 1):
+      axis.set_yticks([(first + last) / 2. - 0.5 for first, last in groupList])
+      axis.set_yticklabels(groupLabelList)
+    else:
+      if(k == 0): axis.set_ylabel(groupLabelList[0])
+      axis.set_yticks([])
+    figure.colorbar(image, cax = figure.add_subplot(grid[3, k]), orientation = "horizontal")
+
+  # Writing the figure (the format is given by the file extension, e.g. pdf or png)
+  figure.savefig(fileName, dpi = dpi, bbox_inches = "tight")
+  plt.close(figure)
+
+  # Return objects
+  return True
+
@@ -0,0 +1,105 @@
+
+###################################################################################################
+# Libraries
+###################################################################################################
+
+# Python
+from __future__ import print_function
+import os
+import sys
+from optparse import SUPPRESS_HELP
+import warnings
+warnings.filterwarnings("ignore")
+
+# Internal
+from src import __version__
+from ..Util import PassThroughOptionParser
+from ..TableIO import convert_to_tsv, convert_indexed_to_tsv
+
+"""
+table-to-tsv
+
+This program converts a binary table (written with --output-format binary) or an indexed table
+(written with --output-format indexed) into the tab-separated table the tools write by default.
+The rows of a single region can be pulled from an indexed table without decompressing it.
+
+Dependencies:
+- Numpy >= 1.13.1
+- Pysam >= 0.11.2.2
+
+Authors: Eduardo G. Gusmao.
+"""
+
+###################################################################################################
+# Main
+###################################################################################################
+
+def main():
+  """
+  Main function that converts a binary or indexed table into a tab-separated table.
+
+  Keyword arguments: None
+
+  Return: None
+  """
+
+  ###################################################################################################
+  # Processing Input Arguments
+  ###################################################################################################
+
+  # Parameters
+  usage_message = ("\n--------------------------------------------------\n"
+                   "This program converts a binary or an indexed table\n"
+                   "(written with --output-format binary or indexed) into\n"
+                   "the tab-separated table the tools write by default.\n\n"
+
+                   "The program should be called as:\n"
+                   "%prog <args>\n\n"
+
+                   "For more information on the arguments please type:\n"
+                   "%prog --help\n\n"
+
+                   "For more information, please refer to the original paper:\n"
+                   "Placeholder.\n\n"
+
+                   "For further questions or comments please contact:\n"
+                   "eduardogade@gmail.com\n"
+                   "--------------------------------------------------")
+  version_message = "Gothe et al. - Spatial chromosome folding and active transcription drive DNA fragility and formation of oncogenic MLL translocations. Version: " + str(__version__)
+
+  # Initializing Option Parser
+  parser = PassThroughOptionParser(usage=usage_message, version=version_message)
+
+  # Input Options
+  parser.add_option("--input-file", dest="input_file_name", type="string", metavar="FILE", default=None, help=("The binary table (its .json, .bin or .labels.txt file, or the output file name given to the tool) or the indexed table (its .gz file)."))
+  parser.add_option("--region", dest="region", type="string", metavar="CHROM[:START-END]", default=None, help=("Writes only the rows of an indexed table overlapping this region (START is 0-based)."))
+  parser.add_option("--output-file", dest="output_file_name", type="string", metavar="FILE", default=None, help=("Output file name."))
+
+  # Processing Options
+  options, arguments = parser.parse_args()
+
+  # General options
+  input_file_name = options.input_file_name
+  output_file_name = options.output_file_name
+  region = options.region
+
+  # Argument error
+  argument_error_message = "ERROR: Please provide all arguments."
+  if(not input_file_name): print(argument_error_message)
+  if(not output_file_name): print(argument_error_message)
+
+  ###################################################################################################
+  # Execution
+  ###################################################################################################
+
+  # Region
+  if(region):
+    rr = region.replace(",", "").split(":")
+    if(len(rr) > 1): region = (rr[0], int(rr[1].split("-")[0]), int(rr[1].split("-")[1]))
+    else: region = (rr[0], None, None)
+
+  # Converting table
+  if(input_file_name.split(".")[-1] == "gz"): convert_indexed_to_tsv(input_file_name, output_file_name, region = region)
+  elif(region): print("ERROR: --region requires an indexed table.")
+  else: convert_to_tsv(input_file_name, output_file_name)
+
@@ -0,0 +1,79 @@
+
+from __future__ import print_function
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from src.Coverage import SparseCoverage, read_coverage, dsb_coverage
+from src.dsb_coverage.coverage import bin_runs
+
+class SparseCoverageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.location)
+
+    def test_merge_overlapping_replicates(self):
+        first = SparseCoverage({"chr1": 1000})
+        first.add("chr1", [10, 10, 50, 999, 1000, -1])
+        second = SparseCoverage({"chr1": 1000, "chr2": 500})
+        second.add("chr1", [10, 20, 50], [2, 1, 1])
+        second.add("chr2", [5])
+        first.merge(second)
+        positions, values = first.counts("chr1")
+        self.assertEqual(positions.tolist(), [10, 20, 50, 999])
+        self.assertEqual(values.tolist(), [4, 1, 2, 1])
+        self.assertEqual(first.chromosomes(), ["chr1", "chr2"])
+        self.assertEqual(first.total(), 9)
+        self.assertEqual(first.window_sums("chr1", [0, 15, 20], [15, 51, 1000]).tolist(), [4, 3, 4])
+
+    def test_bin_totals_at_chromosome_ends(self):
+        coverage = SparseCoverage({"chr1": 1005})
+        coverage.add("chr1", [0, 99, 100, 999, 1000, 1004])
+        bin_index, totals = coverage.bin_totals("chr1", 100)
+        self.assertEqual(bin_index.tolist(), [0, 1, 9, 10])
+        self.assertEqual(totals.tolist(), [2, 1, 1, 2])
+
+    def test_write_and_read(self):
+        coverage = SparseCoverage({"chr1": 100000, "chr2": 300})
+        coverage.add("chr1", [5, 70000, 70000, 99999], [1, 2, 300, 1])
+        coverage.add("chr2", [0])
+        file_name = os.path.join(self.location, "coverage.npz")
+        coverage.write(file_name)
+        coverage_read = read_coverage(file_name)
+        self.assertEqual(coverage_read.chromosomes(), coverage.chromosomes())
+        self.assertEqual(coverage_read.chrom_sizes_dict, coverage.chrom_sizes_dict)
+        for chrom in coverage.chromosomes():
+            self.assertEqual(coverage_read.counts(chrom)[0].tolist(), coverage.counts(chrom)[0].tolist())
+            self.assertEqual(coverage_read.counts(chrom)[1].tolist(), coverage.counts(chrom)[1].tolist())
+
+    def test_dsb_bed_file(self):
+        file_name = os.path.join(self.location, "dsb.bed")
+        bed_file = open(file_name, "w")
+        bed_file.write("track name=dsb\n1\t100\t101\t3\nchr1\t100\t101\n2\t7\t8\tNA\nchr3\t1\t2\t1\n")
+        bed_file.close()
+        coverage = dsb_coverage(file_name, {"chr1": 1000, "chr2": 1000}, max_starts=1)
+        self.assertEqual(coverage.counts("chr1")[1].tolist(), [4])
+        self.assertEqual(coverage.counts("chr2")[0].tolist(), [7])
+        self.assertEqual(coverage.chromosomes(), ["chr1", "chr2"])
+
+class BinRunsTest(unittest.TestCase):
+
+    def test_equal_adjacent_bins_are_merged(self):
+        starts, ends, values = bin_runs(np.array([0, 1, 2, 4, 5, 9]), np.array([3., 3., 1., 1., 1., 2.]), 95, 10)
+        self.assertEqual(starts.tolist(), [0, 20, 40, 90])
+        # The last run is clipped to the chromosome size
+        self.assertEqual(ends.tolist(), [20, 30, 60, 95])
+        self.assertEqual(values.tolist(), [3., 1., 1., 2.])
+
+    def test_no_bins(self):
+        starts, ends, values = bin_runs(np.zeros(0, dtype=np.int64), np.zeros(0), 100, 10)
+        self.assertEqual((len(starts), len(ends), len(values)), (0, 0, 0))
+
+if __name__ == "__main__":
+    unittest.main()
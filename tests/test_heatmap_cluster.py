@@ -0,0 +1,40 @@
+
+from __future__ import print_function
+import unittest
+
+import numpy as np
+
+from src.heatmaps_bliss_features.heatmapCluster import minibatch_kmeans, cluster_order
+
+class MinibatchKmeansTest(unittest.TestCase):
+
+    def setUp(self):
+        # Three well-separated groups of rows (mean signal 0, 5 and 10), shuffled
+        random_state = np.random.RandomState(3)
+        self.truth = random_state.permutation(np.repeat([0, 1, 2], [3000, 2000, 1000]))
+        self.matrix = (self.truth * 5.0)[:, None] + random_state.normal(0, 0.5, (len(self.truth), 20))
+
+    def test_same_seed_same_labels(self):
+        labels = minibatch_kmeans(self.matrix, 3, batchSize=200, nIterations=30, seed=11)
+        self.assertTrue(np.array_equal(labels, minibatch_kmeans(self.matrix, 3, batchSize=200, nIterations=30, seed=11)))
+        # The final assignment does not depend on the chunk size
+        self.assertTrue(np.array_equal(labels, minibatch_kmeans(self.matrix, 3, batchSize=200, nIterations=30, seed=11, chunkRows=777)))
+
+    def test_separated_clusters_are_recovered(self):
+        for seed in [1, 2, 3]:
+            labels = minibatch_kmeans(self.matrix, 3, batchSize=200, nIterations=30, seed=seed)
+            # Clusters are numbered by decreasing mean signal
+            self.assertTrue(np.array_equal(labels, 2 - self.truth))
+
+    def test_cluster_order(self):
+        labels = np.array([1, 0, 1, 2, 0])
+        order, boundaries = cluster_order(np.array([4, 3, 2, 1, 0]), labels)
+        self.assertEqual(order.tolist(), [4, 1, 2, 0, 3])
+        self.assertEqual(boundaries, [0, 2, 4, 5])
+
+    def test_more_clusters_than_rows(self):
+        labels = minibatch_kmeans(self.matrix[:2], 5, seed=1)
+        self.assertEqual(sorted(labels.tolist()), [0, 1])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,42 @@
+
+from __future__ import print_function
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from src.Signal import build_pyramid, pyramid_file_names
+from src.heatmaps_bliss_features.heatmapMatrix import fetch_heatmap_rows
+from tests.test_signal import CHROM_SIZES, write_bam, write_bigwig
+
+class HeatmapRowsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        random_state = np.random.RandomState(5)
+        self.bam_file_name = os.path.join(self.location, "signal.bam")
+        self.bw_file_name = os.path.join(self.location, "signal.bw")
+        write_bam(self.bam_file_name, random_state)
+        write_bigwig(self.bw_file_name, random_state)
+        self.region_list = [["chr1", 1000, 1200, "a", 0.0, "."], ["chr9", 1000, 1200, "b", 0.0, "."], ["chr2", 5000, 5200, "c", 0.0, "."]]
+
+    def tearDown(self):
+        shutil.rmtree(self.location)
+
+    def test_missing_chromosome_has_no_signal(self):
+        result_list = fetch_heatmap_rows(self.region_list, 20, [self.bam_file_name, self.bw_file_name], self.bam_file_name)
+        self.assertEqual(result_list[1][0].shape, (2, 10))
+        self.assertEqual((result_list[1][0].sum(), result_list[1][1]), (0.0, 0.0))
+        self.assertTrue(result_list[0][0].sum() > 0 and result_list[2][1] > 0)
+
+    def test_query_errors_are_raised(self):
+        file_name = os.path.join(self.location, "signal.pyr")
+        build_pyramid(self.bam_file_name, file_name, CHROM_SIZES, level_list=[10, 100])
+        # A truncated pyramid must fail instead of giving empty rows
+        open(pyramid_file_names(file_name)[0], "wb").close()
+        self.assertRaises(ValueError, fetch_heatmap_rows, self.region_list, 20, [file_name], None)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+
+from __future__ import print_function
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from src.Util import Html
+
+class HtmlReportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.location)
+
+    def test_streamed_paged_report(self):
+        report_file_name = os.path.join(self.location, "report.html")
+        html = Html("Report", {"Index": "index.html"}, fig_dir=os.path.join(self.location, "fig"),
+                    stream_file_name=os.path.join(self.location, "report.tmp"))
+        html.add_heading("Regions")
+        row_iterator = (["region"+str(i), str(i), str(0.5 * i)] for i in range(0, 2500))
+        n_rows = html.add_paged_table(["NAME", "COUNT", "SCORE"], [30, 10, 10], "sss", row_iterator,
+                                      os.path.join(self.location, "pages"), page_rpath="pages", page_size=1000)
+        html.write(report_file_name)
+        self.assertEqual(n_rows, 2500)
+        self.assertFalse(os.path.exists(os.path.join(self.location, "report.tmp")))
+        report_file = open(report_file_name)
+        report = report_file.read()
+        report_file.close()
+        self.assertTrue("region999" in report and "region1000" not in report)
+        self.assertTrue("Page <span id=\"paged1_page\">1 / 3</span> (2500 rows)" in report)
+        self.assertEqual(sorted(os.listdir(os.path.join(self.location, "pages"))),
+                         ["Report_paged1_page"+str(e)+".js" for e in [1, 2, 3]])
+        page_file = open(os.path.join(self.location, "pages", "Report_paged1_page3.js"))
+        page = page_file.read()
+        page_file.close()
+        self.assertTrue(page.startswith("rgt_page_loaded(\"paged1\", 3, [") and page.endswith("]);\n"))
+        self.assertEqual(len(json.loads(page[page.index("["):page.rindex("]") + 1])), 500)
+
+if __name__ == "__main__":
+    unittest.main()
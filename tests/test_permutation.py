@@ -0,0 +1,73 @@
+
+from __future__ import print_function
+import unittest
+
+import numpy as np
+
+from src.Permutation import (merge_intervals, allowed_intervals, inside, sample_positions, chromosome_data,
+                             shuffled_dsb_counts, shuffled_feature_counts, permute, observed_counts,
+                             enrichment_summary)
+
+class PermutationTest(unittest.TestCase):
+
+    def setUp(self):
+        random_state = np.random.RandomState(1)
+        self.excluded = merge_intervals([1000, 1500, 40000], [2000, 2500, 60000])
+        self.data_dict = dict()
+        for chrom, size in [("chr1", 100000), ("chr2", 50000)]:
+            dsb = random_state.randint(0, size, 2000)
+            window_list = []
+            for width in [100, 1000]:
+                centers = random_state.randint(width, size - width, 50)
+                window_list.append((centers - width // 2, centers + width // 2))
+            self.data_dict[chrom] = chromosome_data(size, dsb, window_list, excluded=self.excluded)
+
+    def test_threads_do_not_change_the_result(self):
+        for mode in ["dsb", "features"]:
+            single = permute(self.data_dict, 2, mode=mode, n_permutations=250, seed=7, threads=1, chunk_size=40)
+            multiple = permute(self.data_dict, 2, mode=mode, n_permutations=250, seed=7, threads=2, chunk_size=40)
+            self.assertTrue(np.array_equal(single, multiple))
+            self.assertEqual(single.shape, (2, 250))
+            other_seed = permute(self.data_dict, 2, mode=mode, n_permutations=250, seed=8, threads=1, chunk_size=40)
+            self.assertFalse(np.array_equal(single, other_seed))
+
+    def test_shuffled_positions_avoid_excluded_regions(self):
+        self.assertEqual(merge_intervals([1000, 1500, 40000], [2000, 2500, 60000])[1].tolist(), [2500, 60000])
+        allowed = allowed_intervals(100000, self.excluded)
+        positions = sample_positions(np.random.RandomState(2), (20, 5000), allowed[0], allowed[1])
+        self.assertFalse(inside(positions.ravel(), self.excluded[0], self.excluded[1]).any())
+        self.assertTrue(((positions >= 0) & (positions < 100000)).all())
+        # Shuffled DSBs never fall in a window covering the excluded regions
+        data = dict(self.data_dict["chr1"])
+        data["windows"] = [(self.excluded[0], self.excluded[1])]
+        self.assertEqual(shuffled_dsb_counts(np.random.RandomState(3), 50, data).sum(), 0)
+        # Shuffled 1 bp windows never reach DSBs placed in the excluded regions
+        data["dsb"] = np.arange(40000, 60000, 7)
+        data["windows"] = [(np.arange(0, 300), np.arange(1, 301))]
+        self.assertEqual(shuffled_feature_counts(np.random.RandomState(4), 50, data).sum(), 0)
+
+    def test_excluded_data_is_removed(self):
+        for data in self.data_dict.values():
+            self.assertFalse(inside(data["dsb"], self.excluded[0], self.excluded[1]).any())
+            for starts, ends in data["windows"]:
+                self.assertFalse(inside((starts + ends) // 2, self.excluded[0], self.excluded[1]).any())
+        self.assertEqual(observed_counts(self.data_dict, 2).shape, (2,))
+
+    def test_enrichment_summary(self):
+        null = np.array([np.arange(0, 10), np.ones(10, dtype=np.int64) * 3])
+        row_list = enrichment_summary(np.array([8, 3]), null)
+        observed, expected, sd, z_score, fold, p_enrichment, p_depletion = row_list[0]
+        self.assertEqual(observed, 8)
+        self.assertAlmostEqual(expected, 4.5)
+        self.assertAlmostEqual(sd, np.std(np.arange(0, 10), ddof=1))
+        self.assertAlmostEqual(z_score, 3.5 / np.std(np.arange(0, 10), ddof=1))
+        self.assertAlmostEqual(fold, 8 / 4.5)
+        # 8 and 9 are at least the observed value, 0 to 8 at most; the observed value counts as a permutation
+        self.assertAlmostEqual(p_enrichment, 3 / 11.0)
+        self.assertAlmostEqual(p_depletion, 10 / 11.0)
+        # A constant null has no z-score and both p-values are 1
+        self.assertTrue(np.isnan(row_list[1][3]))
+        self.assertEqual(row_list[1][5:], [1.0, 1.0])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,172 @@
+
+from __future__ import print_function
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pysam
+import pyBigWig
+
+from src.Signal import (ChunkCache, BamSignal, BigWigSignal, PyramidSignal, STRATEGIES, build_pyramid,
+                        pyramid_file_names)
+
+CHROM_SIZES = {"chr1": 300000, "chr2": 120005}
+
+def write_bam(file_name, random_state):
+    # Reads of 20 to 400 bp, some of them in dense clusters; returns their starts by chromosome
+    header = {"HD": {"VN": "1.0", "SO": "coordinate"}, "SQ": [{"SN": c, "LN": CHROM_SIZES[c]} for c in sorted(CHROM_SIZES)]}
+    start_dict = dict()
+    read_list = []
+    for chrom_id, chrom in enumerate(sorted(CHROM_SIZES)):
+        size = CHROM_SIZES[chrom]
+        starts = np.concatenate([random_state.randint(0, size - 400, 3000), random_state.randint(5000, 5600, 500)])
+        lengths = random_state.randint(20, 400, len(starts))
+        for start, length in zip(starts.tolist(), lengths.tolist()): read_list.append((chrom_id, start, length))
+        start_dict[chrom] = np.sort(starts)
+    read_list.sort()
+    bam_file = pysam.AlignmentFile(file_name, "wb", header=header)
+    for k, (chrom_id, start, length) in enumerate(read_list):
+        read = pysam.AlignedSegment()
+        read.query_name = "r"+str(k)
+        read.reference_id = chrom_id
+        read.reference_start = start
+        read.cigartuples = [(0, length)]
+        read.flag = 0
+        bam_file.write(read)
+    bam_file.close()
+    pysam.index(file_name)
+    return start_dict
+
+def write_bigwig(file_name, random_state):
+    # Runs of 50 bp with random values (and gaps); returns the per-base values by chromosome
+    value_dict = dict()
+    bw_file = pyBigWig.open(file_name, "w")
+    bw_file.addHeader([(chrom, CHROM_SIZES[chrom]) for chrom in sorted(CHROM_SIZES)])
+    for chrom in sorted(CHROM_SIZES):
+        values = np.zeros(CHROM_SIZES[chrom], dtype=np.float64)
+        starts = np.arange(0, CHROM_SIZES[chrom] - 50, 100)
+        run_values = np.round(random_state.random_sample(len(starts)) * 10, 2)
+        for start, value in zip(starts.tolist(), run_values.tolist()): values[start:start + 50] = value
+        bw_file.addEntries([chrom] * len(starts), starts.tolist(), ends=(starts + 50).tolist(), values=run_values.tolist())
+        value_dict[chrom] = values.astype(np.float32).astype(np.float64)
+    bw_file.close()
+    return value_dict
+
+def random_edges(random_state, size, n_rows, n_bins, bin_size):
+    starts = random_state.randint(0, size - n_bins * bin_size, n_rows)
+    return starts[:, None] + bin_size * np.arange(n_bins + 1)[None, :]
+
+class SignalTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.location = tempfile.mkdtemp()
+        random_state = np.random.RandomState(5)
+        cls.bam_file_name = os.path.join(cls.location, "signal.bam")
+        cls.bw_file_name = os.path.join(cls.location, "signal.bw")
+        cls.start_dict = write_bam(cls.bam_file_name, random_state)
+        cls.value_dict = write_bigwig(cls.bw_file_name, random_state)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.location)
+
+    def test_cache_hits_and_evictions(self):
+        cache = ChunkCache(max_bytes=100)
+        self.assertTrue(cache.get("a") is None)
+        cache.put("a", 1, 40)
+        cache.put("b", 2, 40)
+        self.assertEqual(cache.get("a"), 1)
+        # "b" is now the least recently used chunk
+        cache.put("c", 3, 40)
+        self.assertEqual((cache.hits, cache.misses, cache.evictions), (1, 1, 1))
+        self.assertTrue(cache.get("b") is None)
+        self.assertEqual(sorted(cache.chunks.keys()), ["a", "c"])
+        self.assertEqual(cache.current_bytes, 80)
+
+    def test_bam_chunk_cache(self):
+        bam_file = BamSignal(self.bam_file_name, chunk_size=10000, strategy="chunk")
+        bam_file.count("chr1", 1000, 25000)
+        self.assertEqual((bam_file.cache.hits, bam_file.cache.misses), (0, 3))
+        bam_file.count("chr1", 15000, 20000)
+        self.assertEqual((bam_file.cache.hits, bam_file.cache.misses), (1, 3))
+        bam_file.close()
+
+    def test_strategies_give_the_same_bins(self):
+        random_state = np.random.RandomState(3)
+        for chrom in sorted(CHROM_SIZES):
+            edges = random_edges(random_state, CHROM_SIZES[chrom], 200, 20, 50)
+            binned_list = []
+            for strategy in STRATEGIES:
+                bam_file = BamSignal(self.bam_file_name, chunk_size=8192, strategy=strategy)
+                binned_list.append(bam_file.binned(chrom, [edges])[0])
+                bam_file.close()
+            for binned in binned_list[1:]: self.assertTrue(np.array_equal(binned, binned_list[0]))
+            # Inner bins hold the reads starting in them
+            starts = self.start_dict[chrom]
+            expected = np.diff(np.searchsorted(starts, edges, side="left"), axis=1)
+            self.assertTrue(np.array_equal(binned_list[0][:, 1:], expected[:, 1:]))
+
+    def test_strategy_selection(self):
+        bam_file = BamSignal(self.bam_file_name)
+        bam_file.plan([["chr1", 1000, 1200]] + [["chr2", e, e + 200] for e in range(0, 120000, 500)])
+        self.assertEqual(bam_file.get_strategy("chr1"), "fetch")
+        self.assertEqual(bam_file.get_strategy("chr2"), "sweep")
+        self.assertEqual(bam_file.get_strategy("chrUn"), "chunk")
+        bam_file.close()
+
+    def test_bam_pyramid_levels(self):
+        file_name = os.path.join(self.location, "bam.pyr")
+        build_pyramid(self.bam_file_name, file_name, CHROM_SIZES, level_list=[10, 100, 1000])
+        pyramid = PyramidSignal(file_name)
+        random_state = np.random.RandomState(4)
+        for chrom in sorted(CHROM_SIZES):
+            finest = pyramid.array(chrom, 0).astype(np.float64)
+            self.assertEqual(finest.sum(), len(self.start_dict[chrom]))
+            for level, resolution in enumerate([10, 100, 1000]):
+                factor = resolution // 10
+                expected = np.add.reduceat(finest, np.arange(0, len(finest), factor))
+                self.assertTrue(np.array_equal(pyramid.array(chrom, level), expected))
+                # Queries aligned to the level hold the reads starting in each bin
+                edges = random_edges(random_state, CHROM_SIZES[chrom], 50, 5, resolution) // resolution * resolution
+                starts = self.start_dict[chrom]
+                expected_bins = np.diff(np.searchsorted(starts, edges, side="left"), axis=1)
+                self.assertTrue(np.array_equal(pyramid.binned(chrom, [edges])[0], expected_bins))
+            self.assertEqual(pyramid.count(chrom, 0, CHROM_SIZES[chrom]), len(self.start_dict[chrom]))
+        pyramid.close()
+
+    def test_exact_pyramid_queries(self):
+        file_name = os.path.join(self.location, "exact.pyr")
+        build_pyramid(self.bam_file_name, file_name, CHROM_SIZES, level_list=[10, 100])
+        pyramid = PyramidSignal(file_name, exact=True)
+        edges = random_edges(np.random.RandomState(6), CHROM_SIZES["chr2"], 100, 7, 33)
+        expected_bins = np.diff(np.searchsorted(self.start_dict["chr2"], edges, side="left"), axis=1)
+        self.assertTrue(np.array_equal(pyramid.binned("chr2", [edges])[0], expected_bins))
+        pyramid.close()
+        os.rename(self.bam_file_name, self.bam_file_name + ".moved")
+        try: self.assertRaises(ValueError, PyramidSignal, file_name, exact=True)
+        finally: os.rename(self.bam_file_name + ".moved", self.bam_file_name)
+
+    def test_bigwig_pyramid(self):
+        file_name = os.path.join(self.location, "bigwig.pyr")
+        build_pyramid(self.bw_file_name, file_name, CHROM_SIZES, level_list=[10, 100, 1000])
+        self.assertTrue(all([os.path.exists(e) for e in pyramid_file_names(file_name)]))
+        pyramid = PyramidSignal(file_name)
+        bw_file = BigWigSignal(self.bw_file_name, chunk_size=8192)
+        random_state = np.random.RandomState(8)
+        for chrom in sorted(CHROM_SIZES):
+            prefix = np.concatenate([np.zeros(1), np.cumsum(self.value_dict[chrom])])
+            for resolution in [10, 100, 1000]:
+                edges = random_edges(random_state, CHROM_SIZES[chrom], 50, 5, resolution) // resolution * resolution
+                expected = np.diff(prefix[edges], axis=1)
+                self.assertTrue(np.allclose(bw_file.binned(chrom, [edges])[0], expected))
+                # The cells of a BigWig pyramid are float32 sums
+                self.assertTrue(np.allclose(pyramid.binned(chrom, [edges])[0], expected, rtol=1e-5, atol=1e-3))
+            self.assertTrue(np.allclose(pyramid.count(chrom, 0, CHROM_SIZES[chrom]), prefix[-1], rtol=1e-5))
+        bw_file.close()
+        pyramid.close()
+
+if __name__ == "__main__":
+    unittest.main()
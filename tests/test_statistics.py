@@ -0,0 +1,45 @@
+
+from __future__ import print_function
+import unittest
+import numpy as np
+
+from src.Statistics import partial_matrix, correlation_summary, RowReservoir
+
+class PartialCorrelationTest(unittest.TestCase):
+
+    def setUp(self):
+        random_state = np.random.RandomState(7)
+        self.data = np.column_stack([random_state.normal(size=50), random_state.normal(size=50), np.zeros(50)])
+        self.data[:, 1] += self.data[:, 0]
+
+    def test_constant_column(self):
+        corr = partial_matrix(self.data)
+        self.assertTrue(np.isnan(corr[2]).all() and np.isnan(corr[:, 2]).all())
+        self.assertTrue(np.isfinite(corr[:2, :2]).all())
+        self.assertAlmostEqual(corr[0, 1], np.corrcoef(self.data[:, 0], self.data[:, 1])[0, 1])
+
+    def test_summary_with_constant_column(self):
+        row_list = correlation_summary(self.data, ["A", "B", "C"], n_bootstrap=50)
+        partial = dict([((e[1], e[2]), e) for e in row_list if e[0] == "partial"])
+        self.assertTrue(np.isfinite(partial[("A", "B")][4]))
+        self.assertTrue(np.isfinite(partial[("A", "B")][6]) and np.isfinite(partial[("A", "B")][7]))
+        self.assertTrue(np.isnan(partial[("A", "C")][4]))
+
+class RowReservoirTest(unittest.TestCase):
+
+    def test_bounded_uniform_sample(self):
+        counts = np.zeros(1000)
+        for seed in range(0, 200):
+            reservoir = RowReservoir(1, max_rows=100, seed=seed)
+            for k in range(0, 10): reservoir.add(np.arange(k * 100, (k + 1) * 100).reshape(-1, 1))
+            self.assertEqual(reservoir.rows().shape, (100, 1))
+            counts[reservoir.rows()[:, 0].astype(int)] += 1
+        self.assertTrue(np.all(np.abs(counts.reshape(10, 100).mean(axis=1) - 20) < 3))
+
+    def test_small_table_kept(self):
+        reservoir = RowReservoir(2, max_rows=100)
+        reservoir.add(np.arange(60).reshape(30, 2))
+        self.assertTrue(np.array_equal(reservoir.rows(), np.arange(60).reshape(30, 2)))
+
+if __name__ == "__main__":
+    unittest.main()
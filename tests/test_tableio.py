@@ -0,0 +1,84 @@
+
+from __future__ import print_function
+import os
+import shutil
+import random
+import tempfile
+import unittest
+
+from src.TableIO import BinaryTableWriter, BinaryTable, convert_to_tsv, IndexedTableWriter, fetch_region
+
+class BinaryTableRoundTripTest(unittest.TestCase):
+
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.location)
+
+    def round_trip(self, header, row_list):
+        table_name = os.path.join(self.location, "table.txt")
+        writer = BinaryTableWriter(table_name, 1, header=header, chunk_rows=2)
+        for row in row_list: writer.write(row)
+        writer.close()
+        convert_to_tsv(table_name, os.path.join(self.location, "table.tsv"))
+        tsv_file = open(os.path.join(self.location, "table.tsv"))
+        line_list = tsv_file.read().splitlines()
+        tsv_file.close()
+        return BinaryTable(table_name), line_list
+
+    def test_mixed_integer_columns(self):
+        row_list = [["g1", "NA", 0, 0], ["g2", 0.5, 12, 0.25], ["g3", 3, 7, 1], ["g4", 1.5, 0.75, 2]]
+        table, line_list = self.round_trip(["GENE", "GRO_VALUE", "GRO_PERC", "SIGNAL"], row_list)
+        self.assertEqual(line_list[1:], ["\t".join([str(e) for e in row]) for row in row_list])
+        self.assertTrue(table.mask is not None)
+
+    def test_integer_columns_without_mask(self):
+        row_list = [["g1", 1, 0.5], ["g2", "NA", 2.0], ["g3", 3, 0.0]]
+        table, line_list = self.round_trip(None, row_list)
+        self.assertEqual(line_list, ["\t".join([str(e) for e in row]) for row in row_list])
+        self.assertEqual(sorted(table.integer_columns), [0])
+        self.assertTrue(table.mask is None)
+        self.assertFalse(os.path.exists(os.path.join(self.location, "table.mask.bin")))
+
+class IndexedTableTest(unittest.TestCase):
+
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.location)
+
+    def write_rows(self, row_list):
+        table_name = os.path.join(self.location, "table.txt")
+        writer = IndexedTableWriter(table_name, (1, 2, 3), header=["NAME", "CHROM", "START", "END", "VALUE"])
+        for row in row_list: writer.write(row)
+        writer.close()
+        self.assertEqual(sorted(os.listdir(self.location)), ["table.txt.gz", "table.txt.gz.tbi"])
+        return table_name
+
+    def check_regions(self, table_name, row_list):
+        # The rows of many bgzip blocks are read back by region (tabix also returns the rows starting at the region end)
+        for chrom, start, end in [("chr1", 0, 1000), ("chr1", 150000, 400000), ("chr2", 999000, 2000000), ("chr10", 0, 10**7), ("chr3", 0, 100)]:
+            expected = sorted([[str(e) for e in row] for row in row_list if row[1] == chrom and row[3] > start and row[2] <= end], key=lambda e: (int(e[2]), int(e[3])))
+            self.assertEqual(sorted(fetch_region(table_name, chrom, start, end), key=lambda e: (int(e[2]), int(e[3]))), expected)
+        self.assertEqual(len(list(fetch_region(table_name))), len(row_list))
+
+    def test_unsorted_rows(self):
+        random_state = random.Random(7)
+        row_list = []
+        for i in range(0, 30000):
+            start = random_state.randint(0, 2000000)
+            row_list.append(["r"+str(i), random_state.choice(["chr1", "chr2", "chr10"]), start, start + random_state.randint(1, 500), random_state.random()])
+        table_name = self.write_rows(row_list)
+        self.check_regions(table_name, row_list)
+        chrom_list = [row[0] for row in fetch_region(table_name)]
+        self.assertEqual(chrom_list, [row[0] for row in sorted(row_list, key=lambda e: (e[1], e[2], e[3]))])
+
+    def test_sorted_rows(self):
+        row_list = [["r"+str(i), chrom, 100 * i, 100 * i + 150, i] for chrom in ["chr1", "chr10", "chr2"] for i in range(0, 10000)]
+        table_name = self.write_rows(row_list)
+        self.check_regions(table_name, row_list)
+
+if __name__ == "__main__":
+    unittest.main()
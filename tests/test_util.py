@@ -0,0 +1,40 @@
+
+from __future__ import print_function
+import os
+import unittest
+
+from src.Util import ChromosomeExecutor
+
+# Value set by the initializer in each process
+process_value = None
+
+def set_process_value(value):
+    global process_value
+    process_value = (value, os.getpid())
+
+def tag_items(item_list):
+    return [(item, process_value) for item in item_list]
+
+class ChromosomeExecutorInitializerTest(unittest.TestCase):
+
+    def blocks(self):
+        item_list = [("chr1", i) for i in range(0, 20)] + [("chr2", i) for i in range(0, 20)]
+        return ((item_list[i:i+7], [e[0] for e in item_list[i:i+7]]) for i in range(0, len(item_list), 7))
+
+    def test_single_process(self):
+        global process_value
+        process_value = None
+        executor = ChromosomeExecutor(threads=1, initializer=set_process_value, initargs=("signal",))
+        result_list = [e for block in executor.run_blocks(tag_items, self.blocks()) for e in block]
+        self.assertEqual(len(result_list), 40)
+        self.assertEqual(set([e[1] for e in result_list]), set([("signal", os.getpid())]))
+
+    def test_worker_processes(self):
+        executor = ChromosomeExecutor(threads=2, initializer=set_process_value, initargs=("signal",))
+        result_list = [e for block in executor.run_blocks(tag_items, self.blocks()) for e in block]
+        self.assertEqual([e[0] for e in result_list], [("chr1", i) for i in range(0, 20)] + [("chr2", i) for i in range(0, 20)])
+        self.assertTrue(all([e[1] is not None and e[1][0] == "signal" for e in result_list]))
+        self.assertTrue(os.getpid() not in set([e[1][1] for e in result_list]))
+
+if __name__ == "__main__":
+    unittest.main()